@@ -0,0 +1,277 @@
+import numpy as np
+import clip
+import featuretable
+from spatialindex import expand_ranges
+
+
+def is_pole_edge(lat0, lat1):
+    """Tell which edges run along a pole.  Such an edge has no
+    length, so its change of longitude is not a jump.
+    Returns a boolean array.
+    """
+    return (np.abs(lat0) == 90.0) & (lat0 == lat1)
+
+def unwrap_parts(points, begin, end):
+    """Make the longitudes of many parts continuous: wherever two
+    consecutive points of a part are more than 180 degrees of
+    longitude apart, the rest of the part is shifted by 360 degrees.
+    Edges along a pole are left as they are.
+    Returns the unwrapped longitudes.
+    """
+    lon = points[:, 0]
+    lat = points[:, 1]
+    part = np.repeat(np.arange(len(begin)), end - begin)
+    step = -360.0 * np.rint(np.diff(lon) / 360.0)
+    step[(part[1:] != part[:-1]) | is_pole_edge(lat[:-1], lat[1:])] = 0.0
+    shift = np.concatenate(([0.0], np.cumsum(step)))
+    # Start every part without a shift.
+    shift -= np.repeat(shift[begin], end - begin)
+    return lon + shift
+
+def close_rings(points, begin, end):
+    """Repeat the first point of rings that do not end with it.
+    Returns (points, begin, end).
+    """
+    is_open = np.any(points[begin] != points[end - 1], axis=1)
+    if (not is_open.any()):
+        return (points, begin, end)
+    idx = np.insert(expand_ranges(begin, end),
+                    np.cumsum(end - begin)[is_open], begin[is_open])
+    count = end - begin + is_open
+    end = np.cumsum(count)
+    return (points[idx], end - count, end)
+
+def close_pole_rings(points, begin, end, lon):
+    """Rings that go around a pole end 360 degrees east or west of
+    where they start once unwrapped.  Close them along the pole (the
+    north pole if the ring is mostly north of the equator) so every
+    ring ends where it starts.  The rings must end with their first
+    point.
+    points holds the original points and lon the unwrapped longitudes.
+    Returns (points, begin, end) with the unwrapped longitudes, and
+    the number of rings closed.
+    """
+    points = np.column_stack((lon, points[:, 1]))
+    winding = lon[end - 1] - lon[begin]
+    pole = np.flatnonzero(np.abs(winding) > 180.0)
+    if (len(pole) == 0):
+        return (points, begin, end, 0)
+    pieces = []
+    count = end - begin
+    prev = 0
+    for k in pole.tolist():
+        b, e = begin[k], end[k]
+        ring = points[b:e]
+        lat = 90.0 if (ring[:, 1].mean() > 0) else -90.0
+        ring = np.concatenate((ring, [[ring[-1, 0], lat], [ring[0, 0], lat],
+                                      ring[0]]))
+        pieces += [points[prev:b], ring]
+        count[k] = len(ring)
+        prev = e
+    pieces.append(points[prev:])
+    end = np.cumsum(count)
+    return (np.concatenate(pieces), end - count, end, len(pole))
+
+
+class Antimeridian():
+    """Cut lines and polygon rings in degrees at the antimeridian of
+    a central meridian, the seam of the map, and move them within
+    180 degrees of longitude of it, so that a projection centered
+    there draws them in one piece.
+
+    Parts jumping across the seam (steps of more than 180 degrees of
+    longitude) are made continuous first.  Rings around a pole that
+    are not cut along it (they end 360 degrees from where they start
+    once continuous) are closed along the pole.  Parts are then
+    shifted by a multiple of 360 degrees into the window; parts too
+    wide for it are clipped to the window with every shift that
+    overlaps it.  Edges along a pole, like those of Antarctica,
+    are never taken as jumps.
+    """
+
+    def __init__(self, center = 0.0):
+        self.center = center
+        self.west = center - 180.0
+        self.east = center + 180.0
+        self.parts_moved = 0
+        self.parts_split = 0
+        self.pole_rings = 0
+
+    def get_class_name(self):
+        return type(self).__name__
+
+    def is_inside(self, points):
+        """Tell if a part needs no change: it lies within the window
+        and does not jump across the seam.
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        lon = points[:, 0]
+        if (len(lon) == 0):
+            return True
+        if (lon.min() < self.west or lon.max() > self.east):
+            return False
+        jump = np.abs(np.diff(lon)) > 180.0
+        if (not jump.any()):
+            return True
+        lat = points[:, 1]
+        return not np.any(jump & ~is_pole_edge(lat[:-1], lat[1:]))
+
+    def wrap_points(self, points):
+        """Move points outside the window into it.
+        Returns an N x 2 array.
+        """
+        points = np.array(points, dtype=np.float64).reshape(-1, 2)
+        outside = (points[:, 0] < self.west) | (points[:, 0] > self.east)
+        points[outside, 0] = (self.west +
+                              (points[outside, 0] - self.west) % 360.0)
+        return points
+
+    def split(self, points, closed = False):
+        """Cut a line, or a polygon ring if closed is True, at the seam.
+        Returns a list of N x 2 arrays.
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        if (self.is_inside(points)):
+            return [points]
+        points, begin, end, part = self.split_parts(points, np.array([0]),
+                                                    np.array([len(points)]),
+                                                    closed)
+        return [points[begin[i]:end[i]] for i in range(len(begin))]
+
+    def find_outside_parts(self, table):
+        """Tell which parts of a featuretable.FeatureTable need to be
+        cut or moved, as is_inside does for one part, for all parts
+        at once.
+        Returns a boolean array.
+        """
+        begin, end = table.get_part_ranges()
+        count = end - begin
+        outside = np.zeros(len(begin), dtype=bool)
+        full = np.flatnonzero(count > 0)
+        if (len(full) == 0):
+            return outside
+        lon = table.points[:, 0]
+        lat = table.points[:, 1]
+        outside[full] = ((np.minimum.reduceat(lon, begin[full]) < self.west) |
+                         (np.maximum.reduceat(lon, begin[full]) > self.east))
+        part = np.repeat(np.arange(len(begin)), count)
+        jump = ((part[:-1] == part[1:]) & (np.abs(np.diff(lon)) > 180.0) &
+                ~is_pole_edge(lat[:-1], lat[1:]))
+        outside |= np.bincount(part[:-1][jump], minlength=len(begin)) > 0
+        return outside
+
+    def split_table(self, table, closed = False):
+        """Cut the lines, or rings if closed is True, of a
+        featuretable.FeatureTable in degrees at the seam.  Only the
+        parts found by find_outside_parts are passed to split_parts.
+        Returns a FeatureTable, table itself if nothing changed.
+        """
+        outside = self.find_outside_parts(table)
+        if (not outside.any()):
+            return table
+        begin, end = table.get_part_ranges()
+        points, cut_begin, cut_end, cut_part = self.split_parts(
+            table.points, begin[outside], end[outside], closed)
+        # Put the pieces in place of the parts they come from.
+        source = np.concatenate((np.flatnonzero(~outside),
+                                 np.flatnonzero(outside)[cut_part]))
+        order = np.argsort(source, kind="stable")
+        offset = len(table.points)
+        begin = np.concatenate((begin[~outside], cut_begin + offset))[order]
+        end = np.concatenate((end[~outside], cut_end + offset))[order]
+        return featuretable.build_feature_table(
+            table.shape_type, np.concatenate((table.points, points)), begin,
+            end, table.get_part_record()[source[order]], len(table),
+            table.records, table.columns)
+
+    def split_parts(self, points, begin, end, closed = False):
+        """Cut many lines, or rings if closed is True, at the seam.
+        Closed rings stay closed.
+        Returns (points, begin, end) of the pieces and the number of
+        the part each piece comes from.
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        begin = np.asarray(begin, dtype=np.intp)
+        end = np.asarray(end, dtype=np.intp)
+        # Make the parts contiguous.
+        count = end - begin
+        points = points[expand_ranges(begin, end)]
+        end = np.cumsum(count)
+        begin = end - count
+        if (len(begin) == 0):
+            return (points, begin, end, np.zeros(0, dtype=np.intp))
+        if (closed):
+            points, begin, end = close_rings(points, begin, end)
+        lon = unwrap_parts(points, begin, end)
+        if (closed):
+            points, begin, end, num_pole = close_pole_rings(points, begin,
+                                                            end, lon)
+            self.pole_rings += num_pole
+        else:
+            points = np.column_stack((lon, points[:, 1]))
+        lo = np.minimum.reduceat(points[:, 0], begin)
+        hi = np.maximum.reduceat(points[:, 0], begin)
+        # Shift of the parts that fit in the window.
+        k_in = np.ceil((self.west - lo) / 360.0)
+        fits = (hi + 360.0 * k_in <= self.east)
+        moved = fits & (k_in != 0)
+        self.parts_moved += int(np.count_nonzero(moved))
+        self.parts_split += int(np.count_nonzero(~fits))
+        out_points = [points + np.repeat(360.0 * np.where(fits, k_in, 0.0),
+                                         end - begin)[:, None] * [1.0, 0.0]]
+        out_begin = [begin[fits]]
+        out_end = [end[fits]]
+        out_part = [np.flatnonzero(fits)]
+        offset = len(points)
+        # Parts wider than the window: clip every shifted copy that
+        # overlaps it.
+        wide = np.flatnonzero(~fits)
+        if (len(wide) > 0):
+            k_min = np.floor((self.west - hi[wide]) / 360.0) + 1
+            k_max = np.ceil((self.east - lo[wide]) / 360.0) - 1
+            window = [self.west, -np.inf, self.east, np.inf]
+            for k in range(int(k_min.min()), int(k_max.max()) + 1):
+                select = wide[(k_min <= k) & (k_max >= k)]
+                if (len(select) == 0):
+                    continue
+                idx = expand_ranges(begin[select], end[select])
+                count = end[select] - begin[select]
+                sub_end = np.cumsum(count)
+                sub = points[idx] + [360.0 * k, 0.0]
+                if (closed):
+                    # clip_rings takes rings without the closing point.
+                    sub_points, sub_begin, sub_end, piece_part = \
+                        self.__clip_rings(sub, sub_end - count, sub_end - 1,
+                                          window)
+                else:
+                    sub_points, sub_begin, sub_end, piece_part = \
+                        clip.clip_lines(sub, sub_end - count, sub_end, window)
+                out_points.append(sub_points)
+                out_begin.append(sub_begin + offset)
+                out_end.append(sub_end + offset)
+                out_part.append(select[piece_part])
+                offset += len(sub_points)
+        points = np.concatenate(out_points)
+        begin = np.concatenate(out_begin)
+        end = np.concatenate(out_end)
+        part = np.concatenate(out_part)
+        order = np.argsort(part, kind="stable")
+        return (points, begin[order], end[order], part[order])
+
+    def __clip_rings(self, points, begin, end, window):
+        """Clip rings given without their closing point, and close
+        the pieces again.
+        Returns (points, begin, end, ring number) of the pieces.
+        """
+        points, begin, end = clip.clip_rings(points, begin, end, window)
+        ring = np.flatnonzero(end > begin)
+        begin, end = begin[ring], end[ring]
+        idx = np.insert(expand_ranges(begin, end),
+                        np.cumsum(end - begin), begin)
+        count = end - begin + 1
+        end = np.cumsum(count)
+        return (points[idx], end - count, end, ring)
+
+    def __str__(self):
+        return "{} parts moved, {} cut at the seam".format(
+            self.parts_moved, self.parts_split)
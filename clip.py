@@ -0,0 +1,223 @@
+import numpy as np
+import featuretable
+from spatialindex import expand_ranges
+
+
+def group_starts(group):
+    """Find where each run of equal values starts in a sorted array.
+    Returns an array of indices.
+    """
+    if (len(group) == 0):
+        return np.zeros(0, dtype=np.intp)
+    return np.flatnonzero(np.concatenate(([True], group[1:] != group[:-1])))
+
+def next_in_ring(ring):
+    """Get the index of the next point of every point of the rings
+    numbered by the sorted array ring, wrapping around at the end
+    of each ring.
+    Returns an array of indices.
+    """
+    first = group_starts(ring)
+    last = np.append(first[1:], len(ring)) - 1
+    nxt = np.arange(1, len(ring) + 1)
+    nxt[last] = first
+    return nxt
+
+def clip_rings_edge(points, ring, axis, value, keep_above):
+    """One Sutherland-Hodgman pass: clip rings, implicitly closed,
+    to the half plane points[:, axis] >= value (or <= value if
+    keep_above is False), for all rings at once.
+    Returns the clipped (points, ring).
+    """
+    nxt = next_in_ring(ring)
+    if (keep_above):
+        inside = points[:, axis] >= value
+    else:
+        inside = points[:, axis] <= value
+    p0 = points
+    p1 = points[nxt]
+    crossing = inside != inside[nxt]
+    # Each edge emits the crossing point, if it crosses, then its
+    # end point, if inside.
+    cross = p0.copy()
+    with np.errstate(divide="ignore", invalid="ignore"):
+        t = (value - p0[crossing, axis]) / (p1[crossing, axis] -
+                                            p0[crossing, axis])
+    cross[crossing] = p0[crossing] + t[:, None] * (p1[crossing] - p0[crossing])
+    cross[crossing, axis] = value
+    out = np.stack((cross, p1), axis=1).reshape(-1, 2)
+    emit = np.column_stack((crossing, inside[nxt])).reshape(-1)
+    return (out[emit], np.repeat(ring, 2)[emit])
+
+def clip_rings(points, begin, end, bbox):
+    """Clip polygon rings to a box with Sutherland-Hodgman, for all
+    rings at once.  Rings are implicitly closed; the clipped rings
+    may run along the box edges.
+    bbox is [min_x, min_y, max_x, max_y].
+    Returns (points, begin, end) of the clipped rings, rings
+    clipped away having begin == end.
+    """
+    ring = np.repeat(np.arange(len(begin)), end - begin)
+    points = np.asarray(points, dtype=np.float64)[expand_ranges(begin, end)]
+    edges = ((0, bbox[0], True), (0, bbox[2], False),
+             (1, bbox[1], True), (1, bbox[3], False))
+    for axis, value, keep_above in edges:
+        if (len(points) == 0):
+            break
+        points, ring = clip_rings_edge(points, ring, axis, value, keep_above)
+    count = np.bincount(ring, minlength=len(begin))
+    # A ring needs three points to enclose anything.
+    count[count < 3] = 0
+    points = points[(count >= 3)[ring]]
+    new_end = np.cumsum(count)
+    return (points, new_end - count, new_end)
+
+def clip_lines(points, begin, end, bbox):
+    """Clip polylines to a box with Liang-Barsky, for all segments
+    at once.  A line leaving and entering the box again is split.
+    bbox is [min_x, min_y, max_x, max_y].
+    Returns (points, begin, end) of the visible pieces and the
+    number of the line each piece belongs to.
+    """
+    points = np.asarray(points, dtype=np.float64)[expand_ranges(begin, end)]
+    line = np.repeat(np.arange(len(begin)), end - begin)
+    # Segment i runs from point i to point i + 1 of the same line.
+    seg = np.flatnonzero(line[:-1] == line[1:])
+    p0 = points[seg]
+    d = points[seg + 1] - p0
+    t0 = np.zeros(len(seg))
+    t1 = np.ones(len(seg))
+    visible = np.ones(len(seg), dtype=bool)
+    boundaries = ((-d[:, 0], p0[:, 0] - bbox[0]), (d[:, 0], bbox[2] - p0[:, 0]),
+                  (-d[:, 1], p0[:, 1] - bbox[1]), (d[:, 1], bbox[3] - p0[:, 1]))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for p, q in boundaries:
+            # Parallel to the boundary and outside it.
+            visible &= ~((p == 0) & (q < 0))
+            r = q / p
+            t0 = np.where(p < 0, np.maximum(t0, r), t0)
+            t1 = np.where(p > 0, np.minimum(t1, r), t1)
+    visible &= t0 <= t1
+    seg, p0, d = seg[visible], p0[visible], d[visible]
+    t0, t1 = t0[visible], t1[visible]
+    # A piece continues through the previous segment if that one is
+    # visible and both pass their shared point unclipped.
+    joined = np.zeros(len(seg), dtype=bool)
+    if (len(seg) > 1):
+        joined[1:] = ((seg[1:] == seg[:-1] + 1) & (t1[:-1] == 1.0) &
+                      (t0[1:] == 0.0))
+    start = p0 + t0[:, None] * d
+    stop = p0 + t1[:, None] * d
+    stop[t1 == 1.0] = points[seg[t1 == 1.0] + 1]
+    out = np.stack((start, stop), axis=1).reshape(-1, 2)
+    emit = np.column_stack((~joined, np.ones(len(seg), dtype=bool))).reshape(-1)
+    piece = np.cumsum(~joined) - 1
+    count = np.bincount(piece, minlength=int(np.count_nonzero(~joined)))
+    count += 1
+    new_end = np.cumsum(count)
+    return (out[emit], new_end - count, new_end, line[seg[~joined]])
+
+
+class Clipper():
+    """Cull and clip projected lines and polygon rings to a box in
+    map units, and count the parts going in and out.
+    Parts whose bbox misses the box are dropped and parts inside it
+    are passed on unchanged; only the others are clipped, all in
+    one batch.
+    bbox is [min_x, min_y, max_x, max_y].
+    """
+
+    def __init__(self, bbox):
+        self.bbox = list(bbox)
+        self.parts_in = 0
+        self.parts_culled = 0
+        self.parts_clipped = 0
+
+    def get_class_name(self):
+        return type(self).__name__
+
+    def clip_table(self, table, closed = False):
+        """Cull and clip the lines, or rings if closed is True, of a
+        featuretable.FeatureTable in map units.  The bboxes of all
+        parts are found at once, and all parts crossing the edge of
+        the box go through one call of clip_rings or clip_lines.
+        Closed rings stay closed; a line may be split into several
+        pieces.
+        Returns a FeatureTable.
+        """
+        begin, end = table.get_part_ranges()
+        count = end - begin
+        self.parts_in += len(begin)
+        culled = np.zeros(len(begin), dtype=bool)
+        inside = np.zeros(len(begin), dtype=bool)
+        full = np.flatnonzero(count > 0)
+        if (len(full) > 0):
+            points = table.points
+            bbox = self.bbox
+            lo = [np.minimum.reduceat(points[:, axis], begin[full])
+                  for axis in (0, 1)]
+            hi = [np.maximum.reduceat(points[:, axis], begin[full])
+                  for axis in (0, 1)]
+            culled[full] = ((lo[0] > bbox[2]) | (hi[0] < bbox[0]) |
+                            (lo[1] > bbox[3]) | (hi[1] < bbox[1]))
+            inside[full] = ((lo[0] >= bbox[0]) & (hi[0] <= bbox[2]) &
+                            (lo[1] >= bbox[1]) & (hi[1] <= bbox[3]))
+        cut = np.flatnonzero((count > 0) & ~culled & ~inside)
+        self.parts_culled += int(np.count_nonzero(culled))
+        self.parts_clipped += len(cut)
+        if (closed):
+            points, cut_begin, cut_end = self.__clip_rings(table.points,
+                                                           begin[cut],
+                                                           end[cut])
+            # Rings clipped away are dropped.
+            kept = cut_end > cut_begin
+            cut_begin, cut_end, cut_part = (cut_begin[kept], cut_end[kept],
+                                            cut[kept])
+        else:
+            points, cut_begin, cut_end, line = clip_lines(
+                table.points, begin[cut], end[cut], self.bbox)
+            cut_part = cut[line]
+        # Put the pieces in place of the parts they come from.
+        inside = np.flatnonzero(inside)
+        source = np.concatenate((inside, cut_part))
+        order = np.argsort(source, kind="stable")
+        offset = len(table.points)
+        return featuretable.build_feature_table(
+            table.shape_type, np.concatenate((table.points, points)),
+            np.concatenate((begin[inside], cut_begin + offset))[order],
+            np.concatenate((end[inside], cut_end + offset))[order],
+            table.get_part_record()[source[order]], len(table),
+            table.records, table.columns)
+
+    def __clip_rings(self, points, begin, end):
+        """Clip rings with clip_rings, closing the rings that were
+        closed again.
+        Returns (points, begin, end) of the clipped rings.
+        """
+        is_closed = (((end - begin) > 1) &
+                     np.all(points[begin] == points[end - 1], axis=1))
+        points, begin, end = clip_rings(points, begin, end - is_closed,
+                                        self.bbox)
+        count = end - begin
+        count_closed = count + (is_closed & (count > 0))
+        idx = expand_ranges(begin, begin + count_closed)
+        # The closing point repeats the first point.
+        closing = (idx == np.repeat(end, count_closed))
+        idx[closing] = np.repeat(begin, count_closed)[closing]
+        new_end = np.cumsum(count_closed)
+        return (points[idx], new_end - count_closed, new_end)
+
+    def clip(self, points, closed = False):
+        """Clip a line, or a polygon ring if closed is True; see
+        clip_table.
+        Returns a list of N x 2 arrays: a line may be split into
+        several pieces, and nothing is left of parts outside the box.
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        table = featuretable.FeatureTable(None, points, [0, len(points)],
+                                          [0, 1])
+        return self.clip_table(table, closed).get_parts(0)
+
+    def __str__(self):
+        return "{} parts, {} culled, {} clipped".format(
+            self.parts_in, self.parts_culled, self.parts_clipped)
@@ -0,0 +1,194 @@
+import mmap
+import struct
+import numpy as np
+
+
+DBF_HEADER_SIZE = 32
+DBF_FIELD_SIZE = 32
+DBF_HEADER_END = 0x0D
+DBF_DELETED = ord("*")
+
+
+class DbfError(Exception):
+    """Error reading a .dbf file with DbfColumns.
+    """
+
+    def __init__(self, message):
+        self.message = message
+        super().__init__(self.message)
+
+
+class DbfField():
+    """Description of one .dbf column.
+    offset is the byte offset of the column within a record.
+    """
+
+    def __init__(self, name, field_type, size, decimal, offset):
+        self.name = name
+        self.field_type = field_type
+        self.size = size
+        self.decimal = decimal
+        self.offset = offset
+
+
+class DbfColumns():
+    """Column-wise reader for .dbf attribute tables.
+    The records are viewed as a 2D byte array (one row per record)
+    and only the requested columns are sliced out and converted,
+    so selecting records never builds per record Python objects.
+    dbf is a file name or an open binary file; files on disk are
+    memory mapped, other file objects are read into memory.
+    """
+
+    def __init__(self, dbf, encoding = "utf-8"):
+        self.encoding = encoding
+        if (isinstance(dbf, str)):
+            with open(dbf, "rb") as f:
+                self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            try:
+                self.data = mmap.mmap(dbf.fileno(), 0, access=mmap.ACCESS_READ)
+            except (OSError, ValueError):
+                dbf.seek(0)
+                self.data = dbf.read()
+        (self.num_records, header_size,
+         self.record_size) = struct.unpack("<xxxxIHH", self.data[0:12])
+        self.fields = {}
+        pos = DBF_HEADER_SIZE
+        offset = 1   # Deletion flag
+        while (self.data[pos] != DBF_HEADER_END):
+            desc = self.data[pos:pos + DBF_FIELD_SIZE]
+            name = desc[0:11].split(b"\0")[0].decode("ascii")
+            field_type = chr(desc[11])
+            size = desc[16]
+            decimal = desc[17]
+            self.fields[name] = DbfField(name, field_type, size, decimal, offset)
+            offset += size
+            pos += DBF_FIELD_SIZE
+        self.rows = np.frombuffer(self.data, dtype=np.uint8,
+                                  count=self.num_records * self.record_size,
+                                  offset=header_size)
+        self.rows = self.rows.reshape(self.num_records, self.record_size)
+        self.columns = {}
+
+    def get_class_name(self):
+        return type(self).__name__
+
+    def __len__(self):
+        return self.num_records
+
+    def get_field(self, name):
+        if (name not in self.fields):
+            raise DbfError("Unknown field " + name)
+        return self.fields[name]
+
+    def get_raw_column(self, name):
+        """Get the bytes of a column.
+        Returns an array of fixed size byte strings, one per record.
+        """
+        field = self.get_field(name)
+        raw = self.rows[:, field.offset:field.offset + field.size]
+        return np.ascontiguousarray(raw).view("S" + str(field.size))[:, 0]
+
+    def get_column(self, name):
+        """Get the values of a column, converted by field type:
+        numbers (N, F) to float64 with NaN for blanks, logicals (L)
+        to bool, and everything else to stripped strings.
+        Converted columns are kept for reuse.
+        Returns an array with one value per record.
+        """
+        if (name in self.columns):
+            return self.columns[name]
+        field = self.get_field(name)
+        raw = np.char.strip(self.get_raw_column(name))
+        if (field.field_type in "NF"):
+            # Blank or overflowed (*****) numbers become NaN.
+            bad = (raw == b"") | np.char.startswith(raw, b"*")
+            raw = np.where(bad, b"nan", raw)
+            values = raw.astype(np.float64)
+        elif (field.field_type == "L"):
+            values = np.isin(np.char.upper(raw), [b"T", b"Y"])
+        else:
+            values = np.char.decode(raw, self.encoding)
+        self.columns[name] = values
+        return values
+
+    def get_deleted(self):
+        """Returns a boolean array marking deleted records.
+        """
+        return self.rows[:, 0] == DBF_DELETED
+
+    def select(self, predicates):
+        """Find the records matching all the predicates.
+        Returns a sorted array of record numbers.
+        """
+        keep = ~self.get_deleted()
+        for predicate in predicates:
+            keep &= predicate.evaluate(self.get_column(predicate.field))
+        return np.flatnonzero(keep)
+
+
+class FieldPredicate():
+    """Base class for record predicates on one .dbf field.
+    """
+
+    def __init__(self, field):
+        self.field = field
+
+    def get_class_name(self):
+        return type(self).__name__
+
+    def evaluate(self, values):
+        """Evaluate the predicate on a whole column.
+        Returns a boolean array.
+        """
+        return np.ones(len(values), dtype=bool)
+
+    def get_cache_key(self):
+        """Returns a string identifying the predicate and its
+        parameters, for use in cache keys.
+        """
+        return self.get_class_name() + repr(sorted(vars(self).items()))
+
+
+class FieldEquals(FieldPredicate):
+    """Select records where field == value.
+    """
+
+    def __init__(self, field, value):
+        super().__init__(field)
+        self.value = value
+
+    def evaluate(self, values):
+        return values == self.value
+
+
+class FieldIn(FieldPredicate):
+    """Select records where the field is one of values.
+    """
+
+    def __init__(self, field, values):
+        super().__init__(field)
+        self.values = list(values)
+
+    def evaluate(self, values):
+        return np.isin(values, self.values)
+
+
+class FieldRange(FieldPredicate):
+    """Select records where lo <= field <= hi.
+    Either limit may be None for an open range.
+    """
+
+    def __init__(self, field, lo = None, hi = None):
+        super().__init__(field)
+        self.lo = lo
+        self.hi = hi
+
+    def evaluate(self, values):
+        keep = np.ones(len(values), dtype=bool)
+        if (self.lo != None):
+            keep &= values >= self.lo
+        if (self.hi != None):
+            keep &= values <= self.hi
+        return keep
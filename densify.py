@@ -0,0 +1,110 @@
+import numpy as np
+from simplify import segment_distance2
+from spatialindex import expand_ranges
+
+
+def densify_parts(proj, points, begin, end, tolerance, max_depth = 8):
+    """Project many lines or rings in one call, adding points where
+    the projection bends an edge away from the straight line.
+    The midpoint and quarter points (in degrees) of every edge are
+    projected, and if any is more than tolerance (map units) from
+    the projected chord the midpoint is kept and both halves are
+    tested in the next pass, up to max_depth passes.  All pending
+    edges of all parts are tested in each pass.  Only these sample
+    points are tested, so the lines stay close to, not strictly
+    within, the tolerance of the true curve.
+    points holds all parts in degrees, part i being
+    points[begin[i]:end[i]].
+    Returns (projected points, begin, end) of the densified parts.
+    """
+    count = end - begin
+    points = np.asarray(points, dtype=np.float64)[expand_ranges(begin, end)]
+    end = np.cumsum(count)
+    begin = end - count
+    pcs_array = proj.project_array(points)
+    part = np.repeat(np.arange(len(begin)), count)
+    edge = np.flatnonzero(part[:-1] == part[1:])
+    a, b = points[edge], points[edge + 1]
+    pa, pb = pcs_array[edge], pcs_array[edge + 1]
+    t0 = np.zeros(len(edge))
+    t1 = np.ones(len(edge))
+    tol2 = tolerance * tolerance
+    added_pcs = []
+    added_key = []
+    for depth in range(max_depth):
+        if (len(edge) == 0):
+            break
+        # The midpoint and the quarter points of every edge, so that
+        # an edge bent into an S through its chord midpoint is caught.
+        step = b - a
+        pm, pq1, pq3 = np.split(proj.project_array(np.concatenate(
+            (a + 0.5 * step, a + 0.25 * step, a + 0.75 * step))), 3)
+        mid = a + 0.5 * step
+        # NaN distances, from points off the map, never split.
+        split = ((segment_distance2(pm, pa, pb) > tol2)
+                 | (segment_distance2(pq1, pa, pb) > tol2)
+                 | (segment_distance2(pq3, pa, pb) > tol2))
+        if (not split.any()):
+            break
+        tm = 0.5 * (t0 + t1)
+        edge, mid, pm, tm = edge[split], mid[split], pm[split], tm[split]
+        added_pcs.append(pm)
+        # An added point sorts between the ends of its edge.
+        added_key.append(edge + tm)
+        a, b = np.concatenate((a[split], mid)), np.concatenate((mid, b[split]))
+        pa, pb = (np.concatenate((pa[split], pm)),
+                  np.concatenate((pm, pb[split])))
+        t0, t1 = np.concatenate((t0[split], tm)), np.concatenate((tm, t1[split]))
+        edge = np.concatenate((edge, edge))
+    if (len(added_pcs) == 0):
+        return (pcs_array, begin, end)
+    added_key = np.concatenate(added_key)
+    keys = np.concatenate((np.arange(len(points), dtype=np.float64),
+                           added_key))
+    order = np.argsort(keys, kind="stable")
+    pcs_array = np.concatenate([pcs_array] + added_pcs)[order]
+    count = count + np.bincount(part[added_key.astype(np.intp)],
+                                minlength=len(begin))
+    end = np.cumsum(count)
+    return (pcs_array, end - count, end)
+
+
+class Densifier():
+    """Project lines and polygon rings, adding points only where the
+    projection curves an edge more than a tolerance in map units
+    away from its chord (see densify_parts), and count the vertices
+    going in and out.
+    """
+
+    def __init__(self, tolerance, max_depth = 8):
+        self.tolerance = tolerance
+        self.max_depth = max_depth
+        self.points_in = 0
+        self.points_out = 0
+
+    def get_class_name(self):
+        return type(self).__name__
+
+    def project_parts(self, proj, points, begin, end):
+        """Project and densify many parts at once.
+        Returns (projected points, begin, end).
+        """
+        self.points_in += int(np.sum(end - begin))
+        pcs_array, begin, end = densify_parts(proj, points, begin, end,
+                                              self.tolerance, self.max_depth)
+        self.points_out += len(pcs_array)
+        return (pcs_array, begin, end)
+
+    def project_table(self, proj, table):
+        """Project and densify all parts of a
+        featuretable.FeatureTable.
+        Returns a new FeatureTable in the map projection.
+        """
+        begin, end = table.get_part_ranges()
+        pcs_array, begin, end = self.project_parts(proj, table.points,
+                                                   begin, end)
+        return table.with_points(pcs_array, np.concatenate(([0], end)))
+
+    def __str__(self):
+        return "{} vertices densified to {}".format(self.points_in,
+                                                    self.points_out)
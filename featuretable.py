@@ -0,0 +1,167 @@
+import numpy as np
+from spatialindex import expand_ranges
+
+
+class FeatureTable():
+    """Columnar geometry and attributes of the records of a layer.
+
+    All points are held in one N x 2 float64 array; part i is
+    points[part_offsets[i]:part_offsets[i + 1]] and the parts of
+    record j are part_offsets rows record_offsets[j] up to
+    record_offsets[j + 1].  records holds the record number of each
+    row in the shapefile and columns maps field names to arrays
+    with one value per row.  The coordinates are either degrees or
+    map units; projecting a table makes a new table sharing the
+    offsets, records and columns.
+    """
+
+    def __init__(self, shape_type, points, part_offsets, record_offsets,
+                 records = None, columns = None):
+        self.shape_type = shape_type
+        self.points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        self.part_offsets = np.asarray(part_offsets, dtype=np.intp)
+        self.record_offsets = np.asarray(record_offsets, dtype=np.intp)
+        if (records is None):
+            records = np.arange(len(self.record_offsets) - 1)
+        self.records = np.asarray(records, dtype=np.intp)
+        if (columns == None):
+            columns = {}
+        self.columns = columns
+
+    def get_class_name(self):
+        return type(self).__name__
+
+    def __len__(self):
+        return len(self.record_offsets) - 1
+
+    def get_num_parts(self):
+        """Returns the number of parts of all records.
+        """
+        return len(self.part_offsets) - 1
+
+    def get_part_ranges(self):
+        """Returns the begin and end index of every part in points.
+        """
+        return (self.part_offsets[:-1], self.part_offsets[1:])
+
+    def get_part_record(self):
+        """Returns the row of the record owning each part.
+        """
+        return np.repeat(np.arange(len(self)), np.diff(self.record_offsets))
+
+    def get_part(self, i):
+        """Returns the N x 2 points of part i.
+        """
+        return self.points[self.part_offsets[i]:self.part_offsets[i + 1]]
+
+    def get_parts(self, row):
+        """Returns the list of N x 2 points arrays of a record.
+        """
+        return [self.get_part(i)
+                for i in range(self.record_offsets[row],
+                               self.record_offsets[row + 1])]
+
+    def get_column(self, name):
+        """Returns the values of a field, one per record.
+        """
+        return self.columns[name]
+
+    def get_nbytes(self):
+        """Returns the memory held by the arrays of the table.
+        """
+        arrays = [self.points, self.part_offsets, self.record_offsets,
+                  self.records] + list(self.columns.values())
+        return sum(values.nbytes for values in arrays)
+
+    def with_points(self, points, part_offsets = None):
+        """Make a table with the same records and columns and new
+        points, with the same parts unless part_offsets is given.
+        Returns a FeatureTable.
+        """
+        if (part_offsets is None):
+            part_offsets = self.part_offsets
+        return FeatureTable(self.shape_type, points, part_offsets,
+                            self.record_offsets, self.records, self.columns)
+
+    def select(self, rows):
+        """Make a table of some of the records.
+        rows is an array of record rows or a boolean mask.
+        Returns a FeatureTable.
+        """
+        rows = np.arange(len(self))[rows]
+        first = self.record_offsets[rows]
+        last = self.record_offsets[rows + 1]
+        parts = expand_ranges(first, last)
+        begin, end = self.get_part_ranges()
+        columns = {name: values[rows] for name, values in self.columns.items()}
+        return build_feature_table(self.shape_type, self.points, begin[parts],
+                                   end[parts], np.repeat(np.arange(len(rows)),
+                                                         last - first),
+                                   len(rows), self.records[rows], columns)
+
+    def select_parts(self, parts):
+        """Make a table of some of the parts, keeping every record,
+        so records may be left without parts.
+        parts is an array of part numbers or a boolean mask.
+        Returns a FeatureTable.
+        """
+        parts = np.arange(self.get_num_parts())[parts]
+        begin, end = self.get_part_ranges()
+        return build_feature_table(self.shape_type, self.points, begin[parts],
+                                   end[parts], self.get_part_record()[parts],
+                                   len(self), self.records, self.columns)
+
+
+def build_feature_table(shape_type, points, begin, end, part_record,
+                        num_records, records = None, columns = None):
+    """Gather parts into a FeatureTable.
+    Part i is points[begin[i]:end[i]] and belongs to record row
+    part_record[i]; the parts must be sorted by record row.
+    Returns a FeatureTable.
+    """
+    begin = np.asarray(begin, dtype=np.intp)
+    end = np.asarray(end, dtype=np.intp)
+    part_offsets = np.concatenate(([0], np.cumsum(end - begin)))
+    record_offsets = np.concatenate(
+        ([0], np.cumsum(np.bincount(part_record, minlength=num_records))))
+    # Gather first, so only the points kept are converted.
+    points = np.asarray(points)[expand_ranges(begin, end)]
+    return FeatureTable(shape_type, points,
+                        part_offsets, record_offsets, records, columns)
+
+def table_from_parts(shape_type, parts, part_record, num_records,
+                     records = None, columns = None):
+    """Gather a list of N x 2 points arrays, sorted by the record
+    row part_record of each, into a FeatureTable.
+    Returns a FeatureTable.
+    """
+    count = np.array([len(points) for points in parts], dtype=np.intp)
+    if (len(parts) > 0):
+        points = np.concatenate([np.asarray(points, dtype=np.float64)
+                                 .reshape(-1, 2) for points in parts])
+    else:
+        points = np.zeros((0, 2))
+    part_offsets = np.concatenate(([0], np.cumsum(count)))
+    record_offsets = np.concatenate(
+        ([0], np.cumsum(np.bincount(np.asarray(part_record, dtype=np.intp),
+                                    minlength=num_records))))
+    return FeatureTable(shape_type, points, part_offsets, record_offsets,
+                        records, columns)
+
+def merge_parts(first, second):
+    """Make a table of the records of first with the parts of both
+    tables, which must have the same records.  The parts of a record
+    from first come before those from second.
+    Returns a FeatureTable.
+    """
+    begin, end = first.get_part_ranges()
+    second_begin, second_end = second.get_part_ranges()
+    offset = len(first.points)
+    part_record = np.concatenate((first.get_part_record(),
+                                  second.get_part_record()))
+    order = np.argsort(part_record, kind="stable")
+    return build_feature_table(
+        first.shape_type, np.concatenate((first.points, second.points)),
+        np.concatenate((begin, second_begin + offset))[order],
+        np.concatenate((end, second_end + offset))[order],
+        part_record[order], len(first), first.records, first.columns)
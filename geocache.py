@@ -0,0 +1,134 @@
+import hashlib
+import os
+import numpy as np
+
+
+# Default cache location and size; TRAVELMAP_GEOMETRY_CACHE
+# overrides the location.
+DEFAULT_CACHE_DIR = os.path.join("~", ".cache", "travelmap", "geometry")
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+POINTS_SUFFIX = ".xy.npy"
+OFFSETS_SUFFIX = ".offsets.npy"
+
+
+def geometry_key(*values):
+    """Make a cache key from values with stable reprs.
+    Returns a hex digest.
+    """
+    return hashlib.sha1(repr(values).encode()).hexdigest()
+
+
+class GeometryCache():
+    """On-disk cache of the projected geometry of map layers.
+
+    An entry is the list of shapes drawn for a layer, stored as one
+    N x 2 float64 .npy array of points in map coordinates and an
+    offsets .npy array (shape i is points[offsets[i]:offsets[i + 1]]),
+    named by a key covering everything the geometry depends on.  The
+    points are memory mapped when read.  The offsets file is written
+    last, so an entry is complete once it exists.  When the cache
+    grows past max_bytes the least recently used entries are removed.
+    """
+
+    GEOMETRY_VERSION = 1
+
+    def __init__(self, cache_dir = None, max_bytes = DEFAULT_MAX_BYTES):
+        if (cache_dir == None):
+            cache_dir = os.environ.get("TRAVELMAP_GEOMETRY_CACHE",
+                                       DEFAULT_CACHE_DIR)
+        self.cache_dir = os.path.abspath(os.path.expanduser(cache_dir))
+        self.max_bytes = max_bytes
+
+    def get_class_name(self):
+        return type(self).__name__
+
+    def __get_file_names(self, key):
+        base = os.path.join(self.cache_dir,
+                            geometry_key(self.GEOMETRY_VERSION, key))
+        return (base + POINTS_SUFFIX, base + OFFSETS_SUFFIX)
+
+    def get(self, key):
+        """Look up the geometry stored for key.
+        Returns (points, offsets), the points memory mapped, or None.
+        """
+        points_name, offsets_name = self.__get_file_names(key)
+        if (not os.path.exists(offsets_name)):
+            return None
+        try:
+            offsets = np.load(offsets_name)
+            points = np.load(points_name, mmap_mode="r")
+            # Mark the entry as recently used.
+            os.utime(offsets_name)
+        except (OSError, ValueError):
+            return None
+        if (len(offsets) == 0 or offsets[-1] != len(points)):
+            return None
+        return (points, offsets)
+
+    def put(self, key, points, offsets):
+        """Store the geometry for key.  If the files can not be
+        written the geometry is not cached.
+        """
+        points_name, offsets_name = self.__get_file_names(key)
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            for file_name, values in ((points_name, points),
+                                      (offsets_name, offsets)):
+                # Write to a temporary name so readers never see a
+                # partial file.
+                tmp_name = file_name + ".tmp" + str(os.getpid()) + ".npy"
+                np.save(tmp_name, values)
+                os.replace(tmp_name, file_name)
+        except OSError:
+            return
+        self.evict(keep=offsets_name)
+
+    def get_entries(self):
+        """Get the cache entries, least recently used first.
+        Returns a list of (offsets file, size in bytes) tuples.
+        """
+        if (not os.path.isdir(self.cache_dir)):
+            return []
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if (not name.endswith(OFFSETS_SUFFIX) or ".tmp" in name):
+                continue
+            offsets_name = os.path.join(self.cache_dir, name)
+            points_name = offsets_name[:-len(OFFSETS_SUFFIX)] + POINTS_SUFFIX
+            try:
+                size = (os.path.getsize(offsets_name) +
+                        os.path.getsize(points_name))
+                entries.append((os.path.getmtime(offsets_name),
+                                offsets_name, size))
+            except OSError:
+                continue
+        entries.sort()
+        return [(path, size) for mtime, path, size in entries]
+
+    def evict(self, keep = None):
+        """Remove least recently used entries until the cache fits
+        in max_bytes.  The entry keep (an offsets file) is never
+        removed.
+        """
+        entries = self.get_entries()
+        total = sum(size for path, size in entries)
+        for path, size in entries:
+            if (total <= self.max_bytes):
+                break
+            if (path == keep):
+                continue
+            for file_name in (path, path[:-len(OFFSETS_SUFFIX)] + POINTS_SUFFIX):
+                try:
+                    os.remove(file_name)
+                except OSError:
+                    pass
+            total -= size
+
+
+GEOMETRY_CACHE = GeometryCache()
+
+
+def get_geometry_cache():
+    """Returns the default GeometryCache.
+    """
+    return GEOMETRY_CACHE
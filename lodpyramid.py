@@ -0,0 +1,113 @@
+import numpy as np
+import shpcache
+import simplify
+
+
+class LodPyramid():
+    """Levels of detail for all parts of a shapefile.
+
+    Each level holds every part simplified with Douglas-Peucker in
+    geographic coordinates to one of TOLERANCES (degrees).  Parts
+    are stored in part table row order as float32 points plus an
+    offset array, so a level is read with a slice per part.  Level
+    None is the full resolution geometry of the shapefile itself.
+    """
+
+    PYRAMID_VERSION = 1
+    TOLERANCES = (0.005, 0.02, 0.08, 0.32)
+
+    def __init__(self):
+        self.tolerances = list(self.TOLERANCES)
+        self.points = []
+        self.offsets = []
+
+    def get_class_name(self):
+        return type(self).__name__
+
+    def build(self, points, begin, record, part, num_records, polygon):
+        """Simplify all parts to every level.
+        Takes the same arguments as parttable.PartTable.build.
+        """
+        begin = np.asarray(begin, dtype=np.intp)
+        end = np.append(begin[1:], len(points)).astype(np.intp)
+        self.points = []
+        self.offsets = []
+        for tolerance in self.tolerances:
+            if (len(begin) > 0):
+                keep = simplify.simplify_parts(points, begin, end,
+                                               tolerance, polygon)
+            else:
+                keep = np.zeros(0, dtype=bool)
+            counts = np.add.reduceat(keep, begin) if (len(begin) > 0) else []
+            offsets = np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+            self.points.append(points[keep].astype(np.float32))
+            self.offsets.append(offsets)
+
+    def choose_level(self, tolerance):
+        """Pick the coarsest level whose tolerance is within tolerance
+        (degrees).
+        Returns the level number, or None for full resolution.
+        """
+        return choose_level(self.tolerances, tolerance)
+
+    def get_part_points(self, level, row):
+        """Get the points of part table row row at a level.
+        Returns an N x 2 float64 array.
+        """
+        offsets = self.offsets[level]
+        return self.points[level][offsets[row]:offsets[row + 1]].astype(np.float64)
+
+    def get_level_size(self, level):
+        """Returns the number of points stored for a level.
+        """
+        return len(self.points[level])
+
+    def save(self, file_name, source_hash):
+        levels = {}
+        for i in range(len(self.tolerances)):
+            levels["points" + str(i)] = self.points[i]
+            levels["offsets" + str(i)] = self.offsets[i]
+        shpcache.save_npz(file_name,
+                          dict(version=np.array(self.PYRAMID_VERSION),
+                               source_hash=np.array(source_hash),
+                               tolerances=np.array(self.tolerances), **levels),
+                          compressed=True)
+
+    def load(self, file_name, source_hash):
+        """Load a saved pyramid.
+        Returns False if the file is for another version, source
+        or set of tolerances.
+        """
+        with np.load(file_name) as data:
+            if (int(data["version"]) != self.PYRAMID_VERSION or
+                str(data["source_hash"]) != source_hash or
+                data["tolerances"].tolist() != self.tolerances):
+                return False
+            self.points = [data["points" + str(i)]
+                           for i in range(len(self.tolerances))]
+            self.offsets = [data["offsets" + str(i)]
+                            for i in range(len(self.tolerances))]
+        return True
+
+
+def choose_level(tolerances, tolerance):
+    """Pick the coarsest of the increasing level tolerances that is
+    within tolerance.
+    Returns the level number, or None if no level is fine enough.
+    """
+    level = None
+    for i, level_tolerance in enumerate(tolerances):
+        if (level_tolerance <= tolerance):
+            level = i
+    return level
+
+
+def get_lod_pyramid(source, collect_parts):
+    """Load the LOD pyramid of a shapefile, or build and save it
+    (see shpcache.load_or_build).  source is the .zip or .shp file.
+    collect_parts is called to build a new pyramid and returns the
+    LodPyramid.build arguments.
+    Returns a LodPyramid.
+    """
+    return shpcache.load_or_build(source, ".lod.npz", LodPyramid,
+                                  collect_parts)
@@ -1,5 +1,14 @@
 
+import sys
+import copy
+import math
+import re
+import struct
+import zlib
+import numpy as np
 import svg
+from xml.sax.saxutils import quoteattr
+from spatialindex import expand_ranges
 
 
 class MapAttr():
@@ -34,28 +43,272 @@ class MapAttr():
         """
         self.area_fill = fill_type
 
+    def get_values(self):
+        """Returns the attribute values as a tuple, for comparing
+        attributes.
+        """
+        return (self.line_color, self.line_width, self.area_fill,
+                self.radius)
+
     
 class MapImage():
     """Base class for map images.
-    Currently, (and probably always) there is only one.
+    A map image shows the view box (in map units) scaled uniformly
+    and centered in an image of width x height pixels.
     """
 
     def __init__(self):
         pass
 
+    def get_view_box(self):
+        """Returns the view box (min_x, min_y, width, height).
+        """
+        pass
+
+    def get_image_size(self):
+        """Returns the image size (width, height) in pixels.
+        """
+        pass
+
+    def set_view_box(self, view_box):
+        """Set the view box (min_x, min_y, width, height).
+        """
+        pass
+
+    def get_pixel_size(self):
+        """Get the size of one pixel of the final image in map units.
+        The view box is scaled uniformly to fit the image.
+        """
+        min_x, min_y, vb_width, vb_height = self.get_view_box()
+        width, height = self.get_image_size()
+        scale = min(width / vb_width, height / vb_height)
+        return 1.0 / scale
+
+    def __get_view_transform(self):
+        """Get the mapping from view box units to image pixels.
+        The view box is scaled uniformly and centered in the image
+        (the SVG default, preserveAspectRatio="xMidYMid meet").
+        Returns the tuple (scale, x offset, y offset).
+        """
+        min_x, min_y, vb_width, vb_height = self.get_view_box()
+        width, height = self.get_image_size()
+        scale = 1.0 / self.get_pixel_size()
+        off_x = 0.5 * (width - vb_width * scale) - min_x * scale
+        off_y = 0.5 * (height - vb_height * scale) - min_y * scale
+        return (scale, off_x, off_y)
+
+    def pixel_to_map(self, pixels):
+        """Convert image pixel coordinates to map coordinates.
+        pixels is an N x 2 array (x right, y down).
+        Returns an N x 2 array in map units, ready for the
+        projection invert_array.
+        """
+        scale, off_x, off_y = self.__get_view_transform()
+        pixels = np.asarray(pixels, dtype=np.float64)
+        map_x = (pixels[:, 0] - off_x) / scale
+        # The top group flips the y axis.
+        map_y = -(pixels[:, 1] - off_y) / scale
+        return np.column_stack((map_x, map_y))
+
+    def map_to_pixel(self, map_xy):
+        """Convert map coordinates to image pixel coordinates.
+        map_xy is an N x 2 array in map units.
+        Returns an N x 2 array of pixels (x right, y down).
+        """
+        scale, off_x, off_y = self.__get_view_transform()
+        map_xy = np.asarray(map_xy, dtype=np.float64)
+        px = map_xy[:, 0] * scale + off_x
+        py = -map_xy[:, 1] * scale + off_y
+        return np.column_stack((px, py))
+
+    def get_map_bbox(self, margin = 0.0):
+        """Get the part of the map shown in the image: the view box
+        and the space left around it if the aspect ratios differ,
+        plus margin pixels on every side.
+        Returns [min_x, min_y, max_x, max_y] in map units.
+        """
+        width, height = self.get_image_size()
+        corners = self.pixel_to_map([[-margin, -margin],
+                                     [width + margin, height + margin]])
+        return [float(corners[:, 0].min()), float(corners[:, 1].min()),
+                float(corners[:, 0].max()), float(corners[:, 1].max())]
+
+    def get_map_length(self, length):
+        """Convert an SVG length to map units.
+        length is a number in map units or a percentage string of
+        the normalized view box diagonal, as for a circle radius.
+        Returns a float.
+        """
+        text = str(length).strip()
+        if (text.endswith("%")):
+            min_x, min_y, vb_width, vb_height = self.get_view_box()
+            diagonal = math.sqrt(0.5 * (vb_width ** 2 + vb_height ** 2))
+            return float(text[:-1]) / 100.0 * diagonal
+        return float(text)
+
     def add_polyline(self, pline):
         pass
 
+    def add_feature_table(self, table, closed = False, attr = None):
+        """Add all parts of a featuretable.FeatureTable in map units,
+        as polygons if closed is True and as polylines otherwise.
+        Each part is a view of the table's points array.
+        """
+        draw_function = self.add_polygon if (closed) else self.add_polyline
+        offsets = table.part_offsets.tolist()
+        for i in range(len(offsets) - 1):
+            draw_function(table.points[offsets[i]:offsets[i + 1]], attr)
+
     def print(self):
         pass
 
 
+def fit_view_box(map_xy):
+    """Get the view box that just holds points in map units.  The
+    top group flips the y axis, so the view box is flipped too.
+    Returns the view box (min_x, min_y, width, height).
+    """
+    map_xy = np.asarray(map_xy, dtype=np.float64)
+    lo = map_xy.min(axis=0)
+    hi = map_xy.max(axis=0)
+    return (float(lo[0]), float(-hi[1]), float(hi[0] - lo[0]),
+            float(hi[1] - lo[1]))
+
+def flat_coordinates(pline):
+    """Flatten a list of (x, y) tuples or an N x 2 array.
+    Returns a list of floats [x1, y1, x2, y2, ...].
+    """
+    return np.asarray(pline, dtype=np.float64).reshape(-1).tolist()
+
+def format_points(pline):
+    """Format points for an SVG "points" attribute.
+    pline is a list of (x, y) tuples or an N x 2 array.
+    Returns the string "x1 y1 x2 y2 ...".
+    """
+    return " ".join(map(repr, flat_coordinates(pline)))
+
+def format_subpath(pline, closed = False):
+    """Format points as SVG path data at full precision.
+    Returns the path data string "M x1 y1 L x2 y2 ...", closed
+    with z if closed is True.
+    """
+    coords = list(map(repr, flat_coordinates(pline)))
+    data = "M" + " ".join(coords[0:2])
+    if (len(coords) > 2):
+        data += "L" + " ".join(coords[2:])
+    if (closed):
+        data += "z"
+    return data
+
+def format_circles(points, radius, grid = None, decimals = 0):
+    """Format circles of one radius as SVG path data, each circle a
+    move and two arcs.  With grid the centers and radius are
+    snapped to the grid and written as by format_grid_numbers.
+    Returns the path data string.
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2).copy()
+    points[:, 0] -= radius
+    if (grid == None):
+        # The radius is repeated for every circle; six digits are
+        # far below a pixel.
+        r = "%.6g" % radius
+        d = "%.6g" % (2.0 * radius)
+        coords = list(map(repr, points.reshape(-1).tolist()))
+    else:
+        grid_r = np.rint(radius / grid)
+        r = format_grid_numbers([grid_r], grid, decimals)
+        d = format_grid_numbers([2 * grid_r], grid, decimals)
+        coords = format_grid_numbers(np.rint(points / grid).reshape(-1),
+                                     grid, decimals).split(" ")
+    arcs = ("a" + r + " " + r + " 0 1 0 " + d + " 0a" + r + " " + r +
+            " 0 1 0 -" + d + " 0z")
+    data = "".join(["M" + coords[i] + " " + coords[i + 1] + arcs
+                    for i in range(0, len(coords), 2)])
+    return data.replace(" -", "-")
+
+def get_symbol_id(gid, size_class):
+    """Get the id of the symbol of a size class in group gid.
+    """
+    return gid + "_r" + str(size_class)
+
+def get_path_key(kind, attr):
+    """Get the key deciding which shapes can share a merged path:
+    the element kind and the shape attributes.
+    """
+    if (attr == None):
+        return (kind, None)
+    return (kind, attr.get_values())
+
+# Fill rule of merged polygon paths, so that holes stay holes.
+MERGED_FILL_RULE = "evenodd"
+
+def quantize_points(pline, grid, closed = False):
+    """Snap points to a grid and drop the consecutive duplicates
+    this creates.  For closed rings the closing point is dropped
+    too, as the path is closed with z.
+    Returns an N x 2 integer array in grid units.
+    """
+    points = np.asarray(pline, dtype=np.float64).reshape(-1, 2)
+    grid_xy = np.rint(points / grid).astype(np.int64)
+    if (len(grid_xy) == 0):
+        return grid_xy
+    keep = np.ones(len(grid_xy), dtype=bool)
+    keep[1:] = np.any(grid_xy[1:] != grid_xy[:-1], axis=1)
+    grid_xy = grid_xy[keep]
+    if (closed and len(grid_xy) > 1 and np.all(grid_xy[-1] == grid_xy[0])):
+        grid_xy = grid_xy[:-1]
+    return grid_xy
+
+# Trailing zeros, a trailing decimal point, and the leading zero of
+# fractions, in numbers formatted with %f.
+TRAILING_ZEROS = re.compile(r"(\.\d*?)0+(?= |$)")
+TRAILING_POINT = re.compile(r"\.(?= |$)")
+LEADING_ZERO = re.compile(r"(?<!\d)0\.")
+
+def format_grid_numbers(values, grid, decimals):
+    """Format numbers in grid units as short decimals in map units.
+    Returns the numbers separated by spaces.
+    """
+    fmt = "%." + str(decimals) + "f"
+    text = " ".join(map(fmt.__mod__, (np.asarray(values) * grid).tolist()))
+    if (decimals > 0):
+        text = TRAILING_ZEROS.sub(r"\1", text)
+        text = TRAILING_POINT.sub("", text)
+        text = LEADING_ZERO.sub(".", text)
+    return text
+
+def format_path(grid_xy, grid, decimals, closed = False):
+    """Format quantized points as SVG path data: an absolute move
+    to the first point and relative lines to the others.  Negative
+    numbers need no separator.
+    Returns the path data string.
+    """
+    data = "M" + format_grid_numbers(grid_xy[0], grid, decimals)
+    if (len(grid_xy) > 1):
+        deltas = np.diff(grid_xy, axis=0).reshape(-1)
+        data += "l" + format_grid_numbers(deltas, grid, decimals)
+    if (closed):
+        data += "z"
+    return data.replace(" -", "-")
+
+
 class SvgImage(MapImage):
     """SVG Map Image.
+    The image is built as an svg.py element tree and written by
+    print(); see SvgStreamImage for writing shapes as they come.
+
+    Groups added with merge=True collect consecutive polygons (or
+    polylines) with the same shape attributes into one <path> with
+    a subpath per shape, instead of an element per shape.  Merged
+    polygon paths use the evenodd fill rule, so holes are not
+    filled.
     """
 
     def __init__(self):
         super().__init__()
+        self.merge = False
+        self.path_key = None
+        self.path_data = []
 
         self.svg = svg.SVG()
         self.curr_group = self.svg
@@ -80,6 +333,16 @@ class SvgImage(MapImage):
         self.top_group.transform = [ svg.Scale(1, -1) ]
         self.top_group.stroke_linecap = "round"
 
+    def get_view_box(self):
+        vbox = self.svg.viewBox
+        return (vbox.min_x, vbox.min_y, vbox.width, vbox.height)
+
+    def get_image_size(self):
+        return (self.svg.width, self.svg.height)
+
+    def set_view_box(self, view_box):
+        self.svg.viewBox = svg.ViewBoxSpec(*view_box)
+
     def __set_obj_attr(self, obj, attr):
         """Set attributes on an SVG object.
         obj is any SVG object that supports "stroke", "stroke_width", etc.
@@ -92,11 +355,14 @@ class SvgImage(MapImage):
         if (attr.area_fill != None):
             obj.fill = attr.area_fill
         
-    def add_group(self, gid, attr = None):
+    def add_group(self, gid, attr = None, merge = False):
         """Add a new SVG group ("g" element) to the top level group.
         gid is a Group ID string.
         attr is a MapAttr class object.
+        merge, if True, merges the shapes of the group into paths.
         """
+        self.__flush_path()
+        self.merge = merge
         new_group = svg.G()
         new_group.id = gid
         new_group.elements = []
@@ -126,15 +392,17 @@ class SvgImage(MapImage):
 
     def add_polyline(self, pline, attr = None):
         """Add a polyline (set of connected points) to the map image.
-        pline is a list of tuples
+        pline is a list of tuples or an N x 2 array
         attr is a MapAttr class object
         """
         """
         pyshp shape data consists of a list of tuples.
         svg Polyline needs a list of values "[x1 y1 x2 y2 ...]".
-        The following list comprehension performs the conversion.
         """
-        pts = [item for ltuple in pline for item in ltuple]
+        if (self.merge):
+            self.__add_subpath(pline, False, attr)
+            return
+        pts = flat_coordinates(pline)
         #pts = [0,0,100,200,200,0]
         sp = svg.Polyline(points = pts)
         self.curr_group.elements.append(sp)
@@ -143,21 +411,767 @@ class SvgImage(MapImage):
         """Add a polygon to the SVG map image.
         See add_polyline for additional information.
         """
-        pts = [item for ltuple in pline for item in ltuple]
+        if (self.merge):
+            self.__add_subpath(pline, True, attr)
+            return
+        pts = flat_coordinates(pline)
         sp = svg.Polygon(points = pts)
         self.curr_group.elements.append(sp)
 
+    def __add_subpath(self, pline, closed, attr):
+        """Add a shape to the merged path, starting a new path if the
+        kind of shape or its attributes changed.
+        """
+        if (len(pline) == 0):
+            return
+        key = get_path_key(closed, attr)
+        if (key != self.path_key):
+            self.__flush_path()
+            self.path_key = key
+        self.path_data.append(format_subpath(pline, closed))
+
+    def __flush_path(self):
+        """Add the merged path collected so far to the current group.
+        """
+        if (self.path_key == None):
+            return
+        sp = svg.Path(d = "".join(self.path_data))
+        if (self.path_key[0]):
+            sp.fill_rule = MERGED_FILL_RULE
+        self.curr_group.elements.append(sp)
+        self.path_key = None
+        self.path_data = []
+
     def add_points(self, point_list, attr = None):
         """Add a set of points to the map image.
         Points will be added as circles.
         """
-        for point in point_list:
+        self.__flush_path()
+        for point in np.asarray(point_list, dtype=np.float64).tolist():
             scir = svg.Circle(
                 cx = point[0],
                 cy = point[1],
                 r = attr.radius
             )
-        self.curr_group.elements.append(scir)
+            self.curr_group.elements.append(scir)
+
+    def add_symbols(self, points, classes, radii):
+        """Add many points drawn as circles of a few sizes.
+        points is an N x 2 array, classes the size class of each
+        point (an index into radii) and radii the circle radius of
+        each size class (see get_map_length).
+        In a merged group each size class is one path of circles,
+        the radius written in the path data; otherwise each size
+        class is a <symbol> and each point a <use> of it.
+        """
+        self.__flush_path()
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        classes = np.asarray(classes, dtype=np.intp)
+        used = np.unique(classes).tolist()
+        if (self.merge):
+            for k in used:
+                sp = svg.Path(d = format_circles(points[classes == k],
+                                                 self.get_map_length(radii[k])))
+                self.curr_group.elements.append(sp)
+            return
+        gid = self.curr_group.id
+        symbols = []
+        for k in used:
+            circle = svg.Circle(r = self.get_map_length(radii[k]))
+            symbols.append(svg.Symbol(id = get_symbol_id(gid, k),
+                                      overflow = "visible",
+                                      elements = [circle]))
+        if (len(symbols) > 0):
+            self.curr_group.elements.append(svg.Defs(elements = symbols))
+        for (x, y), k in zip(points.tolist(), classes.tolist()):
+            self.curr_group.elements.append(
+                svg.Use(href = "#" + get_symbol_id(gid, k), x = x, y = y))
 
     def print(self):
+        self.__flush_path()
         print(self.svg)
+
+
+class SvgStreamError(Exception):
+    """SVG stream exception.
+    """
+
+    def __init__(self, message):
+        self.message = message
+        super().__init__(self.message)
+
+
+class SvgStreamImage(MapImage):
+    """SVG Map Image written as the shapes are added.
+
+    Same drawing API as SvgImage and the same document, but every
+    shape is formatted straight from its coordinate array and written
+    to out, so memory use is bounded by the largest shape instead of
+    the whole map.  out is a file name or a writable text file; the
+    default is sys.stdout.  The header is written with the first
+    group, so width, height and view_box may be changed until then.
+    print() finishes the document.
+
+    With quantum (a fraction of a pixel) the output is compact:
+    coordinates are snapped to a grid of the largest power of ten
+    map units within quantum pixels, lines and polygons are written
+    as <path> data with relative moves, and the points made
+    duplicate by the snapping are dropped.  Shapes that collapse to
+    a single grid point are not written.
+
+    Groups added with merge=True merge their shapes into paths as
+    in SvgImage; the subpaths are written as they arrive.
+    """
+
+    def __init__(self, out = None, quantum = None):
+        super().__init__()
+        self.width = 1000
+        self.height = 750
+        self.view_box = (-2.5, -0.5, 5, 1)
+        self.quantum = quantum
+        self.grid = None
+        self.decimals = 0
+        self.own_file = isinstance(out, str)
+        if (self.own_file):
+            self.out = open(out, "w")
+        elif (out == None):
+            self.out = sys.stdout
+        else:
+            self.out = out
+        self.started = False
+        self.finished = False
+        # The current group is written with its first element, so
+        # groups without elements can be closed with />.
+        self.group_id = None
+        self.group_attr = None
+        self.group_open = False
+        self.merge = False
+        # Key of the merged path being written, see get_path_key.
+        self.path_key = None
+
+    def get_class_name(self):
+        return type(self).__name__
+
+    def get_view_box(self):
+        return self.view_box
+
+    def get_image_size(self):
+        return (self.width, self.height)
+
+    def set_view_box(self, view_box):
+        if (self.started):
+            raise SvgStreamError("View box set after the header")
+        self.view_box = tuple(view_box)
+
+    def __format_attr(self, attr):
+        """Format the attributes of a MapAttr, in the order svg.py
+        writes them.
+        Returns (stroke and stroke-width, fill) strings.
+        """
+        stroke = ""
+        if (attr.line_color != None):
+            stroke += " stroke=" + quoteattr(str(attr.line_color))
+        if (attr.line_width != None):
+            stroke += " stroke-width=" + quoteattr(str(attr.line_width))
+        fill = ""
+        if (attr.area_fill != None):
+            fill = " fill=" + quoteattr(str(attr.area_fill))
+        return (stroke, fill)
+
+    def __start(self):
+        if (self.finished):
+            raise SvgStreamError("Image already finished")
+        if (self.started):
+            return
+        self.started = True
+        if (self.quantum != None):
+            exponent = math.floor(math.log10(self.quantum *
+                                             self.get_pixel_size()))
+            self.grid = 10.0 ** exponent
+            self.decimals = max(0, -exponent)
+        view_box = " ".join(str(value) for value in self.view_box)
+        top_attr = MapAttr()
+        top_attr.set_default_attr()
+        stroke, fill = self.__format_attr(top_attr)
+        self.out.write('<svg xmlns="http://www.w3.org/2000/svg" viewBox="' +
+                       view_box + '" width="' + str(self.width) +
+                       '" height="' + str(self.height) + '"><g' + stroke +
+                       ' id="top_scale" transform="scale(1 -1)"' + fill +
+                       ' stroke-linecap="round">')
+
+    def __get_group_tag(self):
+        stroke, fill = self.__format_attr(self.group_attr)
+        return "<g" + stroke + " id=" + quoteattr(self.group_id) + fill
+
+    def __close_group(self):
+        self.__end_path()
+        if (self.group_open):
+            self.out.write("</g>")
+        elif (self.group_id != None):
+            self.out.write(self.__get_group_tag() + "/>")
+        self.group_id = None
+        self.group_open = False
+
+    def __write_element(self, text):
+        if (self.group_id == None):
+            raise SvgStreamError("Shapes must be added to a group")
+        if (not self.group_open):
+            self.out.write(self.__get_group_tag() + ">")
+            self.group_open = True
+        self.out.write(text)
+
+    def add_group(self, gid, attr = None, merge = False):
+        """Start a new SVG group ("g" element) in the top level group;
+        the previous group is finished.
+        gid is a Group ID string.
+        attr is a MapAttr class object.
+        merge, if True, merges the shapes of the group into paths.
+        """
+        self.__start()
+        self.__close_group()
+        self.merge = merge
+        if (attr == None):
+            attr = MapAttr()
+            attr.set_default_attr()
+        self.group_id = gid
+        self.group_attr = copy.copy(attr)
+
+    def set_group_attr(self, attr):
+        """Set attributes on the current SVG group element.
+        Only possible before the group's first element is written.
+        attr is a MapAttr class object.
+        """
+        if (self.group_id == None or self.group_open):
+            raise SvgStreamError("Group already written")
+        for name in ("line_color", "line_width", "area_fill"):
+            if (getattr(attr, name) != None):
+                setattr(self.group_attr, name, getattr(attr, name))
+
+    def add_polyline(self, pline, attr = None):
+        """Add a polyline (set of connected points) to the map image.
+        pline is a list of tuples or an N x 2 array
+        attr is a MapAttr class object
+        """
+        if (self.merge or self.grid != None):
+            self.__write_path(pline, False, attr)
+            return
+        self.__write_element('<polyline points="' + format_points(pline) +
+                             '"/>')
+
+    def add_polygon(self, pline, attr = None):
+        """Add a polygon to the SVG map image.
+        See add_polyline for additional information.
+        """
+        if (self.merge or self.grid != None):
+            self.__write_path(pline, True, attr)
+            return
+        self.__write_element('<polygon points="' + format_points(pline) +
+                             '"/>')
+
+    def __write_path(self, pline, closed, attr):
+        """Write a shape as a path, or as a subpath of the merged
+        path if the group is merged.
+        """
+        if (self.grid != None):
+            grid_xy = quantize_points(pline, self.grid, closed)
+            if (len(grid_xy) < 2):
+                return
+            data = format_path(grid_xy, self.grid, self.decimals, closed)
+        else:
+            if (len(pline) == 0):
+                return
+            data = format_subpath(pline, closed)
+        if (not self.merge):
+            self.__write_element('<path d="' + data + '"/>')
+            return
+        key = get_path_key(closed, attr)
+        if (key != self.path_key):
+            self.__end_path()
+            self.__write_element('<path d="')
+            self.path_key = key
+        self.out.write(data)
+
+    def __end_path(self):
+        """Finish the merged path being written.
+        """
+        if (self.path_key == None):
+            return
+        if (self.path_key[0]):
+            self.out.write('" fill-rule="' + MERGED_FILL_RULE + '"/>')
+        else:
+            self.out.write('"/>')
+        self.path_key = None
+
+    def add_points(self, point_list, attr = None):
+        """Add a set of points to the map image.
+        Points will be added as circles.
+        """
+        self.__end_path()
+        radius = quoteattr(str(attr.radius))
+        points = np.asarray(point_list, dtype=np.float64).reshape(-1, 2)
+        if (self.grid != None):
+            grid_xy = np.rint(points / self.grid)
+            coords = [format_grid_numbers(xy, self.grid, self.decimals).split()
+                      for xy in grid_xy]
+        else:
+            coords = [[repr(x), repr(y)] for x, y in points.tolist()]
+        for x, y in coords:
+            self.__write_element('<circle cx="' + x + '" cy="' + y +
+                                 '" r=' + radius + '/>')
+
+    def add_symbols(self, points, classes, radii):
+        """Add many points drawn as circles of a few sizes.
+        See SvgImage.add_symbols.
+        """
+        self.__end_path()
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        classes = np.asarray(classes, dtype=np.intp)
+        used = np.unique(classes).tolist()
+        if (self.merge):
+            for k in used:
+                data = format_circles(points[classes == k],
+                                      self.get_map_length(radii[k]),
+                                      self.grid, self.decimals)
+                self.__write_element('<path d="' + data + '"/>')
+            return
+        symbols = ""
+        for k in used:
+            radius = self.get_map_length(radii[k])
+            if (self.grid != None):
+                radius = format_grid_numbers([np.rint(radius / self.grid)],
+                                             self.grid, self.decimals)
+            else:
+                radius = repr(radius)
+            symbols += ('<symbol id=' +
+                        quoteattr(get_symbol_id(self.group_id, k)) +
+                        ' overflow="visible"><circle r="' + radius +
+                        '"/></symbol>')
+        if (len(symbols) > 0):
+            self.__write_element("<defs>" + symbols + "</defs>")
+        if (self.grid != None):
+            coords = format_grid_numbers(np.rint(points / self.grid).reshape(-1),
+                                         self.grid, self.decimals).split(" ")
+        else:
+            coords = list(map(repr, points.reshape(-1).tolist()))
+        hrefs = [quoteattr("#" + get_symbol_id(self.group_id, k))
+                 for k in range(max(used, default=-1) + 1)]
+        for i, k in enumerate(classes.tolist()):
+            self.__write_element('<use href=' + hrefs[k] + ' x="' +
+                                 coords[2 * i] + '" y="' +
+                                 coords[2 * i + 1] + '"/>')
+
+    def print(self):
+        """Finish the document, and close out if it was opened
+        from a file name.
+        """
+        self.__start()
+        self.__close_group()
+        self.out.write("</g></svg>\n")
+        self.finished = True
+        if (self.own_file):
+            self.out.close()
+        else:
+            self.out.flush()
+
+
+# SVG color keywords understood by PngImage, as RGB.
+COLORS = {
+    "black": (0, 0, 0), "white": (255, 255, 255), "red": (255, 0, 0),
+    "lime": (0, 255, 0), "green": (0, 128, 0), "blue": (0, 0, 255),
+    "yellow": (255, 255, 0), "brown": (165, 42, 42),
+    "orange": (255, 165, 0), "purple": (128, 0, 128),
+    "gray": (128, 128, 128), "grey": (128, 128, 128),
+    "silver": (192, 192, 192), "maroon": (128, 0, 0),
+    "olive": (128, 128, 0), "navy": (0, 0, 128), "teal": (0, 128, 128),
+    "aqua": (0, 255, 255), "cyan": (0, 255, 255),
+    "fuchsia": (255, 0, 255), "magenta": (255, 0, 255),
+}
+# Number of sides of the polygons standing in for circles and
+# round line joins.
+CIRCLE_SIDES = 16
+JOIN_SIDES = 8
+# Height in pixels of the bands spans are rasterized in.
+SPAN_BAND_PIXELS = 32
+
+
+class PngImageError(Exception):
+    """PNG image exception.
+    """
+
+    def __init__(self, message):
+        self.message = message
+        super().__init__(self.message)
+
+
+def parse_color(color):
+    """Parse an SVG color: a keyword, #rgb, #rrggbb, "transparent"
+    or "none".
+    Returns (r, g, b, a) floats from 0 to 1.
+    """
+    if (color == None):
+        return (0.0, 0.0, 0.0, 0.0)
+    text = str(color).strip().lower()
+    if (text in ("transparent", "none")):
+        return (0.0, 0.0, 0.0, 0.0)
+    if (text in COLORS):
+        rgb = COLORS[text]
+    elif (text.startswith("#") and len(text) == 4):
+        rgb = [17 * int(c, 16) for c in text[1:]]
+    elif (text.startswith("#") and len(text) == 7):
+        rgb = [int(text[i:i + 2], 16) for i in (1, 3, 5)]
+    else:
+        raise PngImageError("Unknown color: " + str(color))
+    return (rgb[0] / 255.0, rgb[1] / 255.0, rgb[2] / 255.0, 1.0)
+
+def edge_crossings(points, begin, end, height):
+    """Find where the edges of closed rings cross the sample rows,
+    whose centers are at y = row + 0.5 for rows 0 to height - 1.
+    An edge covers the rows with centers in [min y, max y), so a
+    vertex shared by two edges is counted once.
+    Returns (ring, row, x) arrays, one entry per crossing.
+    """
+    nxt = np.arange(1, len(points) + 1)
+    nxt[end - 1] = begin
+    ax, ay = points[:, 0], points[:, 1]
+    bx, by = ax[nxt], ay[nxt]
+    row0 = np.clip(np.ceil(np.minimum(ay, by) - 0.5), 0, height).astype(np.intp)
+    row1 = np.clip(np.ceil(np.maximum(ay, by) - 0.5), 0, height).astype(np.intp)
+    count = row1 - row0
+    edge = np.repeat(np.arange(len(points)), count)
+    row = expand_ranges(row0, row1)
+    t = (row + 0.5 - ay[edge]) / (by[edge] - ay[edge])
+    x = ax[edge] + t * (bx[edge] - ax[edge])
+    ring = np.repeat(np.arange(len(begin)), end - begin)[edge]
+    return (ring, row, x)
+
+def span_coverage(row, start, end, height, width, supersample):
+    """Rasterize spans: the samples whose centers lie in [start, end)
+    of a row are covered.  The rows are done in bands, so the work
+    arrays stay small.  height and width are in samples and must be
+    multiples of supersample.
+    Returns a float32 array of the covered fraction of each pixel.
+    """
+    s = supersample
+    col0 = np.clip(np.ceil(start - 0.5), 0, width).astype(np.intp)
+    col1 = np.clip(np.ceil(end - 0.5), 0, width).astype(np.intp)
+    order = np.argsort(row, kind="stable")
+    row, col0, col1 = row[order], col0[order], col1[order]
+    coverage = np.zeros((height // s, width // s), dtype=np.float32)
+    band = SPAN_BAND_PIXELS * s
+    for y in range(0, height, band):
+        i0, i1 = np.searchsorted(row, [y, y + band])
+        if (i0 == i1):
+            continue
+        rows = min(band, height - y)
+        base = (row[i0:i1] - y) * (width + 1)
+        size = rows * (width + 1)
+        diff = (np.bincount(base + col0[i0:i1], minlength=size) -
+                np.bincount(base + col1[i0:i1], minlength=size))
+        diff = diff.reshape(rows, width + 1)[:, :-1]
+        mask = np.cumsum(diff, axis=1) > 0
+        coverage[y // s:(y + rows) // s] = mask.reshape(
+            rows // s, s, width // s, s).mean(axis=(1, 3))
+    return coverage
+
+def fill_evenodd(points, begin, end, shape_id, height, width, supersample):
+    """Rasterize rings filled with the even-odd rule.  Rings with
+    the same shape_id form one shape; the result is the union of
+    the shapes.
+    Returns the pixel coverage (see span_coverage).
+    """
+    ring, row, x = edge_crossings(points, begin, end, height)
+    shape = np.asarray(shape_id)[ring]
+    order = np.lexsort((x, row, shape))
+    # Each closed shape crosses a row an even number of times.
+    row = row[order][0::2]
+    return span_coverage(row, x[order][0::2], x[order][1::2], height, width,
+                         supersample)
+
+def fill_convex(points, begin, end, height, width, supersample):
+    """Rasterize the union of convex polygons.
+    Returns the pixel coverage (see span_coverage).
+    """
+    ring, row, x = edge_crossings(points, begin, end, height)
+    if (len(x) == 0):
+        return span_coverage(row, x, x, height, width, supersample)
+    order = np.lexsort((row, ring))
+    ring, row, x = ring[order], row[order], x[order]
+    first = np.flatnonzero(np.concatenate(([True], (ring[1:] != ring[:-1]) |
+                                                   (row[1:] != row[:-1]))))
+    return span_coverage(row[first], np.minimum.reduceat(x, first),
+                         np.maximum.reduceat(x, first), height, width,
+                         supersample)
+
+def regular_polygons(centers, radius, sides):
+    """Make a regular polygon around every center.
+    Returns (points, begin, end) of the polygons.
+    """
+    angle = 2.0 * np.pi * np.arange(sides) / sides
+    offsets = radius * np.column_stack((np.cos(angle), np.sin(angle)))
+    points = (centers[:, None, :] + offsets[None, :, :]).reshape(-1, 2)
+    begin = np.arange(len(centers)) * sides
+    return (points, begin, begin + sides)
+
+def stroke_polygons(points, begin, end, closed, half_width):
+    """Cover lines of half_width with convex polygons: a quad per
+    segment and a regular polygon per vertex for round joins.
+    closed tells for each line if it is a ring.
+    Returns (points, begin, end) of the polygons.
+    """
+    nxt = np.arange(1, len(points) + 1)
+    nxt[end - 1] = np.where(closed, begin, end - 1)
+    a = points
+    b = points[nxt]
+    d = b - a
+    length = np.hypot(d[:, 0], d[:, 1])
+    seg = length > 0
+    a, b, d, length = a[seg], b[seg], d[seg], length[seg]
+    normal = half_width * np.column_stack((-d[:, 1], d[:, 0])) / length[:, None]
+    quads = np.stack((a + normal, b + normal, b - normal, a - normal), axis=1)
+    joins, join_begin, join_end = regular_polygons(points, half_width, JOIN_SIDES)
+    quad_begin = len(joins) + 4 * np.arange(len(quads))
+    return (np.concatenate((joins, quads.reshape(-1, 2))),
+            np.concatenate((join_begin, quad_begin)),
+            np.concatenate((join_end, quad_begin + 4)))
+
+def write_png(f, rgba):
+    """Write an RGBA image as PNG, compressed with zlib.
+    f is a binary file and rgba a height x width x 4 uint8 array.
+    """
+    def chunk(kind, data):
+        f.write(struct.pack(">I", len(data)) + kind + data +
+                struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff))
+
+    height, width = rgba.shape[0:2]
+    rows = rgba.reshape(height, width * 4)
+    # Filter type 1 (Sub): each byte minus the byte one pixel left.
+    filtered = np.empty((height, width * 4 + 1), dtype=np.uint8)
+    filtered[:, 0] = 1
+    filtered[:, 1:5] = rows[:, 0:4]
+    filtered[:, 5:] = rows[:, 4:] - rows[:, :-4]
+    f.write(b"\x89PNG\r\n\x1a\n")
+    chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0))
+    chunk(b"IDAT", zlib.compress(filtered.tobytes(), 6))
+    chunk(b"IEND", b"")
+
+
+class PngImage(MapImage):
+    """Raster Map Image written as PNG.
+
+    Same drawing API as SvgImage, with the same view box and image
+    size.  The shapes of a group are collected and rasterized
+    together when the group ends: polygons are filled with the
+    even-odd rule (over the whole group if merged, like a merged SVG
+    path), then all lines and outlines are stroked.  Each output
+    pixel averages supersample x supersample samples.  Strokes
+    thinner than a sample are drawn one sample wide with reduced
+    opacity.  out is a file name or a binary file; the default is
+    the standard output.  print() writes the PNG.
+    """
+
+    def __init__(self, out = None, supersample = 2):
+        super().__init__()
+        self.width = 1000
+        self.height = 750
+        self.view_box = (-2.5, -0.5, 5, 1)
+        self.out = out
+        self.supersample = supersample
+        # Premultiplied RGBA, allocated with the first group.
+        self.pixels = None
+        self.group_attr = None
+        self.merge = False
+        self.rings = []
+        self.ring_ids = []
+        self.lines = []
+        self.lines_closed = []
+        self.num_shapes = 0
+
+    def get_class_name(self):
+        return type(self).__name__
+
+    def get_view_box(self):
+        return self.view_box
+
+    def get_image_size(self):
+        return (self.width, self.height)
+
+    def set_view_box(self, view_box):
+        self.view_box = tuple(view_box)
+
+    def __to_samples(self, pline):
+        """Convert map coordinates to sample coordinates.
+        """
+        points = np.asarray(pline, dtype=np.float64).reshape(-1, 2)
+        return self.map_to_pixel(points) * self.supersample
+
+    def add_group(self, gid, attr = None, merge = False):
+        """Start a new group of shapes drawn with attr.
+        gid is a Group ID string (not used in the image).
+        attr is a MapAttr class object.
+        merge, if True, fills all polygons of the group as one
+        even-odd shape.
+        """
+        self.__flush()
+        if (self.pixels is None):
+            self.pixels = np.zeros((self.height, self.width, 4),
+                                   dtype=np.float32)
+        if (attr == None):
+            attr = MapAttr()
+            attr.set_default_attr()
+        self.group_attr = copy.copy(attr)
+        self.merge = merge
+
+    def set_group_attr(self, attr):
+        """Set attributes on the current group.
+        attr is a MapAttr class object.
+        """
+        for name in ("line_color", "line_width", "area_fill"):
+            if (getattr(attr, name) != None):
+                setattr(self.group_attr, name, getattr(attr, name))
+
+    def __check_group(self):
+        if (self.group_attr == None):
+            raise PngImageError("Shapes must be added to a group")
+
+    def add_polyline(self, pline, attr = None):
+        """Add a polyline (set of connected points) to the map image.
+        pline is a list of tuples or an N x 2 array
+        attr is a MapAttr class object
+        """
+        self.__check_group()
+        if (len(pline) > 0):
+            self.lines.append(self.__to_samples(pline))
+            self.lines_closed.append(False)
+
+    def add_polygon(self, pline, attr = None):
+        """Add a polygon to the map image.
+        See add_polyline for additional information.
+        """
+        self.__check_group()
+        if (len(pline) == 0):
+            return
+        points = self.__to_samples(pline)
+        self.rings.append(points)
+        self.ring_ids.append(0 if (self.merge) else self.num_shapes)
+        self.lines.append(points)
+        self.lines_closed.append(True)
+        self.num_shapes += 1
+
+    def __add_circles(self, centers, radius):
+        """Add circles as polygons, each a shape of its own.
+        """
+        if (len(centers) == 0):
+            return
+        radius = self.get_map_length(radius) * self.supersample / self.get_pixel_size()
+        points, begin, end = regular_polygons(self.__to_samples(centers),
+                                              radius, CIRCLE_SIDES)
+        for i in range(len(begin)):
+            self.rings.append(points[begin[i]:end[i]])
+            self.ring_ids.append(self.num_shapes)
+            self.lines.append(points[begin[i]:end[i]])
+            self.lines_closed.append(True)
+            self.num_shapes += 1
+
+    def add_points(self, point_list, attr = None):
+        """Add a set of points to the map image.
+        Points will be added as circles.
+        """
+        self.__check_group()
+        self.__add_circles(np.asarray(point_list, dtype=np.float64).reshape(-1, 2),
+                           attr.radius)
+
+    def add_symbols(self, points, classes, radii):
+        """Add many points drawn as circles of a few sizes.
+        See SvgImage.add_symbols.
+        """
+        self.__check_group()
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        classes = np.asarray(classes, dtype=np.intp)
+        for k in np.unique(classes).tolist():
+            self.__add_circles(points[classes == k], radii[k])
+
+    def __composite(self, fill_function, points, color, opacity = 1.0):
+        """Rasterize with fill_function(points, height, width) in the
+        window of the image covered by points, and paint color with
+        the resulting coverage.
+        """
+        s = self.supersample
+        if (color[3] == 0 or len(points) == 0):
+            return
+        lo = np.floor(points.min(axis=0) / s).astype(int)
+        hi = np.ceil(points.max(axis=0) / s).astype(int) + 1
+        x0, y0 = np.maximum(lo, 0).tolist()
+        x1 = min(hi[0], self.width)
+        y1 = min(hi[1], self.height)
+        if (x1 <= x0 or y1 <= y0):
+            return
+        coverage = fill_function(points - [x0 * s, y0 * s], (y1 - y0) * s,
+                                 (x1 - x0) * s)
+        alpha = (coverage * (color[3] * opacity)).astype(np.float32)[:, :, None]
+        window = self.pixels[y0:y1, x0:x1]
+        window *= 1.0 - alpha
+        window += alpha * np.array(color[0:3] + (1.0,), dtype=np.float32)
+
+    def __flush(self):
+        """Rasterize the shapes collected for the current group.
+        """
+        if (len(self.rings) > 0):
+            points = np.concatenate(self.rings)
+            lengths = [len(ring) for ring in self.rings]
+            end = np.cumsum(lengths)
+            begin = end - lengths
+            shape_id = np.array(self.ring_ids)
+            self.__composite(lambda p, h, w:
+                                 fill_evenodd(p, begin, end, shape_id, h, w,
+                                              self.supersample),
+                             points, parse_color(self.group_attr.area_fill))
+        if (len(self.lines) > 0):
+            width = self.get_map_length(self.group_attr.line_width)
+            width *= self.supersample / self.get_pixel_size()
+            if (width > 0):
+                # Thinner strokes are one sample wide and fainter.
+                opacity = min(width, 1.0)
+                points = np.concatenate(self.lines)
+                lengths = [len(line) for line in self.lines]
+                end = np.cumsum(lengths)
+                begin = end - lengths
+                polys = stroke_polygons(points, begin, end,
+                                        np.array(self.lines_closed),
+                                        0.5 * max(width, 1.0))
+                self.__composite(lambda p, h, w:
+                                     fill_convex(p, polys[1], polys[2], h, w,
+                                                 self.supersample),
+                                 polys[0],
+                                 parse_color(self.group_attr.line_color),
+                                 opacity)
+        self.rings = []
+        self.ring_ids = []
+        self.lines = []
+        self.lines_closed = []
+        self.num_shapes = 0
+
+    def get_rgba(self):
+        """Get the image as it is drawn so far.
+        Returns a height x width x 4 uint8 RGBA array.
+        """
+        self.__flush()
+        if (self.pixels is None):
+            return np.zeros((self.height, self.width, 4), dtype=np.uint8)
+        alpha = self.pixels[:, :, 3:4]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            rgb = np.where(alpha > 0, self.pixels[:, :, 0:3] / alpha, 0.0)
+        rgba = np.concatenate((rgb, alpha), axis=2)
+        return np.rint(np.clip(rgba, 0.0, 1.0) * 255).astype(np.uint8)
+
+    def print(self):
+        """Write the PNG.
+        """
+        rgba = self.get_rgba()
+        if (isinstance(self.out, str)):
+            with open(self.out, "wb") as f:
+                write_png(f, rgba)
+        elif (self.out == None):
+            write_png(sys.stdout.buffer, rgba)
+            sys.stdout.buffer.flush()
+        else:
+            write_png(self.out, rgba)
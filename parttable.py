@@ -0,0 +1,203 @@
+import math
+import numpy as np
+import shpcache
+
+
+DEG_TO_RAD = math.pi / 180.0
+AREA_SPHERE = 4.0 * math.pi
+
+
+def spherical_ring_areas(lam, phi, begin, end):
+    """Calculate the area of rings on the unit sphere, with great
+    circle edges, for all rings at once.
+    lam, phi are the concatenated ring coordinates in radians and
+    begin, end the index range of each ring; rings are closed
+    implicitly.  Each edge adds the signed area of the triangle it
+    forms with the south pole.
+    Returns the area of each ring in steradians; for rings whose
+    sign is ambiguous the smaller side is taken.
+    """
+    nxt = np.arange(1, len(lam) + 1)
+    nxt[end - 1] = begin
+    dlam = lam[nxt] - lam
+    sign = np.where(dlam >= 0, 1.0, -1.0)
+    adlam = sign * dlam
+    # Colatitude from the south pole, halved.
+    half = 0.5 * phi + 0.25 * math.pi
+    cos0 = np.cos(half)
+    sin0 = np.sin(half)
+    k = sin0 * sin0[nxt]
+    u = cos0 * cos0[nxt] + k * np.cos(adlam)
+    v = k * sign * np.sin(adlam)
+    total = 2.0 * np.add.reduceat(np.arctan2(v, u), begin)
+    area = np.abs(total) % AREA_SPHERE
+    return np.minimum(area, AREA_SPHERE - area)
+
+def planar_centroids(x, y, begin, end):
+    """Calculate the area weighted centroid of rings in the plane
+    of their coordinates, for all rings at once.  Rings without
+    area (and lines) use the mean of their points.
+    Returns (cx, cy) arrays.
+    """
+    nxt = np.arange(1, len(x) + 1)
+    nxt[end - 1] = begin
+    cross = x * y[nxt] - x[nxt] * y
+    area2 = np.add.reduceat(cross, begin)
+    sum_x = np.add.reduceat((x + x[nxt]) * cross, begin)
+    sum_y = np.add.reduceat((y + y[nxt]) * cross, begin)
+    count = end - begin
+    mean_x = np.add.reduceat(x, begin) / count
+    mean_y = np.add.reduceat(y, begin) / count
+    scale = np.add.reduceat(np.abs(cross), begin)
+    flat = (np.abs(area2) <= 1e-12 * scale) | (scale == 0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cx = np.where(flat, mean_x, sum_x / (3.0 * area2))
+        cy = np.where(flat, mean_y, sum_y / (3.0 * area2))
+    return (cx, cy)
+
+
+class PartTable():
+    """Columnar table of metrics for every part of a shapefile,
+    one row per part:
+
+    record, part  - record number and part number within the record
+    bbox          - [min_x, min_y, max_x, max_y] in degrees
+    num_points    - number of points
+    area          - spherical area as a fraction of the whole earth
+                    (NaN for parts of non-polygon shapefiles)
+    bbox_area     - spherical area of the bbox as a fraction of the
+                    whole earth
+    centroid      - [x, y] in degrees
+
+    Filters over all parts become array masks.
+    """
+
+    TABLE_VERSION = 1
+    COLUMNS = ("record", "part", "bbox", "num_points", "area",
+               "bbox_area", "centroid")
+
+    def __init__(self):
+        self.num_records = 0
+        self.record = np.zeros(0, dtype=np.intp)
+        self.part = np.zeros(0, dtype=np.intp)
+        self.bbox = np.zeros((0, 4))
+        self.num_points = np.zeros(0, dtype=np.intp)
+        self.area = np.zeros(0)
+        self.bbox_area = np.zeros(0)
+        self.centroid = np.zeros((0, 2))
+
+    def get_class_name(self):
+        return type(self).__name__
+
+    def __len__(self):
+        return len(self.record)
+
+    def build(self, points, begin, record, part, num_records, polygon):
+        """Calculate the table.
+        points is the N x 2 array of all part coordinates in degrees,
+        begin the start index of each part in it, record and part the
+        record and part numbers of each part.  polygon tells if the
+        parts are polygon rings.
+        """
+        self.num_records = num_records
+        self.record = np.asarray(record, dtype=np.intp)
+        self.part = np.asarray(part, dtype=np.intp)
+        begin = np.asarray(begin, dtype=np.intp)
+        if (len(begin) == 0):
+            return
+        end = np.append(begin[1:], len(points))
+        x = points[:, 0]
+        y = points[:, 1]
+        self.num_points = end - begin
+        self.bbox = np.empty((len(begin), 4))
+        self.bbox[:, 0:2] = np.minimum.reduceat(points, begin, axis=0)
+        self.bbox[:, 2:4] = np.maximum.reduceat(points, begin, axis=0)
+        dlam = (self.bbox[:, 2] - self.bbox[:, 0]) * DEG_TO_RAD
+        self.bbox_area = dlam * (np.sin(self.bbox[:, 3] * DEG_TO_RAD) -
+                                 np.sin(self.bbox[:, 1] * DEG_TO_RAD))
+        self.bbox_area /= AREA_SPHERE
+        if (polygon):
+            self.area = spherical_ring_areas(x * DEG_TO_RAD, y * DEG_TO_RAD,
+                                             begin, end) / AREA_SPHERE
+        else:
+            self.area = np.full(len(begin), np.nan)
+        cx, cy = planar_centroids(x, y, begin, end)
+        self.centroid = np.column_stack((cx, cy))
+
+    def get_size_estimate(self):
+        """Get the size of each part for size thresholds: the area for
+        polygons, the bbox area otherwise.
+        Returns an array of fractions of the whole earth.
+        """
+        return np.where(np.isnan(self.area), self.bbox_area, self.area)
+
+    def select(self, bbox = None, min_area = None):
+        """Build a mask over the parts.
+        bbox, if given, keeps the parts whose bbox overlaps it.
+        min_area, if given, keeps parts at least that size (see
+        get_size_estimate).
+        Returns a boolean array.
+        """
+        keep = np.ones(len(self), dtype=bool)
+        if (bbox != None):
+            keep &= ((self.bbox[:, 0] <= bbox[2]) &
+                     (self.bbox[:, 2] >= bbox[0]) &
+                     (self.bbox[:, 1] <= bbox[3]) &
+                     (self.bbox[:, 3] >= bbox[1]))
+        if (min_area != None):
+            keep &= self.get_size_estimate() >= min_area
+        return keep
+
+    def get_record_bboxes(self):
+        """Get the bbox of each record from its parts.
+        Records without parts have NaN boxes.
+        Returns a num_records x 4 array.
+        """
+        boxes = np.full((self.num_records, 4), np.nan)
+        if (len(self) > 0):
+            lo = np.full((self.num_records, 2), np.inf)
+            hi = np.full((self.num_records, 2), -np.inf)
+            np.minimum.at(lo, self.record, self.bbox[:, 0:2])
+            np.maximum.at(hi, self.record, self.bbox[:, 2:4])
+            has_parts = np.isfinite(lo[:, 0])
+            boxes[has_parts, 0:2] = lo[has_parts]
+            boxes[has_parts, 2:4] = hi[has_parts]
+        return boxes
+
+    def get_index_arrays(self):
+        """Get the arrays for building a spatialindex.ShapefileIndex.
+        Returns (record bboxes, part bboxes, part record numbers,
+        part numbers).
+        """
+        return (self.get_record_bboxes(), self.bbox, self.record, self.part)
+
+    def save(self, file_name, source_hash):
+        columns = {name: getattr(self, name) for name in self.COLUMNS}
+        shpcache.save_npz(file_name, dict(version=np.array(self.TABLE_VERSION),
+                                          source_hash=np.array(source_hash),
+                                          num_records=np.array(self.num_records),
+                                          **columns))
+
+    def load(self, file_name, source_hash):
+        """Load a saved table.
+        Returns False if the file is for another version or source.
+        """
+        with np.load(file_name) as data:
+            if (int(data["version"]) != self.TABLE_VERSION or
+                str(data["source_hash"]) != source_hash):
+                return False
+            self.num_records = int(data["num_records"])
+            for name in self.COLUMNS:
+                setattr(self, name, data[name])
+        return True
+
+
+def get_part_table(source, collect_parts):
+    """Load the sidecar part table of a shapefile, or build and save
+    it (see shpcache.load_or_build).  source is the .zip or .shp
+    file.  collect_parts is called to build a new table and returns
+    the PartTable.build arguments.
+    Returns a PartTable.
+    """
+    return shpcache.load_or_build(source, ".parts.npz", PartTable,
+                                  collect_parts)
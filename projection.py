@@ -1,11 +1,191 @@
 
+import hashlib
 import math
+import os
+import numpy as np
+import shpcache
 
 DEG_TO_RAD = math.pi / 180.0
+RAD_TO_DEG = 180.0 / math.pi
 TWO_DIV_PI = 2.0 / math.pi
 PI_DIV_TWO = math.pi / 2.0
 
 
+class NewtonStats():
+    """Iteration statistics for newton_solve.
+    A point is counted as slow when it needs more than slow_iterations
+    steps, and as singular when it stops on a zero derivative (the
+    poles of Mollweide).
+    """
+
+    def __init__(self, slow_iterations = 5):
+        self.slow_iterations = slow_iterations
+        self.reset()
+
+    def reset(self):
+        self.calls = 0
+        self.points = 0
+        self.passes = 0
+        self.max_iterations = 0
+        self.slow_points = 0
+        self.singular_points = 0
+        # histogram[n] is the number of points that took n steps.
+        self.histogram = np.zeros(1, dtype=np.int64)
+
+    def add(self, counts, singular, passes):
+        """Add the results of one solver call.
+        counts is the array of steps taken by each point.
+        singular is the number of points stopped by a zero derivative.
+        passes is the number of vectorized iterations.
+        """
+        self.calls += 1
+        self.points += len(counts)
+        self.passes += passes
+        self.singular_points += singular
+        if (len(counts) == 0):
+            return
+        self.max_iterations = max(self.max_iterations, int(counts.max()))
+        self.slow_points += int(np.count_nonzero(counts > self.slow_iterations))
+        hist = np.bincount(counts)
+        if (len(hist) > len(self.histogram)):
+            hist[:len(self.histogram)] += self.histogram
+            self.histogram = hist
+        else:
+            self.histogram[:len(hist)] += hist
+
+    def __str__(self):
+        mean = 0.0
+        if (self.points > 0):
+            mean = np.dot(np.arange(len(self.histogram)), self.histogram) / self.points
+        return ("calls={} points={} passes={} mean_iterations={:.2f} "
+                "max_iterations={} slow_points={} singular_points={}".format(
+                    self.calls, self.points, self.passes, mean,
+                    self.max_iterations, self.slow_points,
+                    self.singular_points))
+
+
+def newton_solve(func, target, theta, eps, stats = None, max_iter = 1000):
+    """Solve func(theta) = target for whole arrays with Newton-Raphson.
+    func(theta) returns the tuple (value, derivative) for an array.
+    target is the array of right hand side values.
+    theta is the array of initial guesses; it is not modified.
+    Each element retires from the active set once its step is smaller
+    than eps, or when its derivative is zero.
+    stats is an optional NewtonStats object.
+    Returns the array of solutions.
+    """
+    theta = np.array(theta, dtype=np.float64)
+    counts = np.zeros(len(theta), dtype=np.int64)
+    active = np.arange(len(theta))
+    singular = 0
+    passes = 0
+    for loop in range(max_iter):
+        if (len(active) == 0):
+            break
+        passes += 1
+        value, deriv = func(theta[active])
+        num = value - target[active]
+        moving = (deriv != 0.0)
+        singular += len(active) - int(np.count_nonzero(moving))
+        active = active[moving]
+        diff = num[moving] / deriv[moving]
+        theta[active] -= diff
+        counts[active] += 1
+        active = active[np.abs(diff) >= eps]
+    #
+    if (stats != None):
+        stats.add(counts, singular, passes)
+    return theta
+
+
+def unit_clip(value, eps = 1.0E-12):
+    """Clip values that are beyond [-1, 1] only by rounding error, so
+    they can be passed to arcsin or arccos.
+    Values further out are left alone and produce NaN.
+    """
+    outside = (np.abs(value) > 1.0) & (np.abs(value) <= 1.0 + eps)
+    return np.where(outside, np.sign(value), value)
+
+
+def polar_seed(phi, power, coefs):
+    """Initial guess for the auxiliary angle of Mollweide and EckertIV.
+    Near the poles the angle behaves like pi/2 - c * u with
+    u = (1 - |sin(phi)|) ** power; coefs is a polynomial fit of that
+    distance in u (lowest order first, no constant term).
+    Returns the array of initial guesses.
+    """
+    u = (1.0 - np.abs(np.sin(phi))) ** power
+    dist = np.zeros(len(phi))
+    for coef in reversed(coefs):
+        dist = u * (coef + dist)
+    return np.copysign(PI_DIV_TWO - dist, phi)
+
+
+class LatitudeCache():
+    """Memo of the latitude factors of a separable projection.
+    The latitudes seen so far are kept in a sorted array together with
+    their factors.  A lookup reduces its input to unique latitudes,
+    finds them with np.searchsorted and only computes the missing ones.
+    Batches whose latitudes hardly repeat (more than max_unique of
+    them unique) are computed directly and not added, and NaN
+    latitudes are never added.  When the memo would grow past
+    max_size it restarts with the latitudes of the latest lookup.
+    """
+
+    def __init__(self, factor_func, max_size = 1 << 16, max_unique = 0.25):
+        # factor_func(phi) returns the arrays (f, g) for the array phi.
+        self.factor_func = factor_func
+        self.max_size = max_size
+        self.max_unique = max_unique
+        self.clear()
+
+    def clear(self):
+        self.phi = np.empty(0)
+        # Rows of (f, g), one per latitude of phi.
+        self.factors = np.empty((0, 2))
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, phi):
+        """Get the factors for an array of latitudes in RADIANS.
+        Returns the tuple of arrays (f, g), same length as phi.
+        """
+        uphi, inverse = np.unique(phi, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        if (len(uphi) > self.max_unique * len(phi)):
+            return self.factor_func(phi)
+        # np.unique sorts NaN last; they are computed but not kept.
+        valid = int(np.searchsorted(uphi, np.inf, side="right"))
+        pos = np.searchsorted(self.phi, uphi[:valid])
+        found = np.zeros(len(uphi), dtype=bool)
+        if (len(self.phi) > 0):
+            found[:valid] = (self.phi[np.minimum(pos, len(self.phi) - 1)] ==
+                             uphi[:valid])
+        missing = ~found
+
+        ufactors = np.empty((len(uphi), 2))
+        ufactors[found] = self.factors[pos[found[:valid]]]
+        mf, mg = self.factor_func(uphi[missing])
+        ufactors[missing, 0] = mf
+        ufactors[missing, 1] = mg
+
+        add = np.flatnonzero(missing[:valid])
+        self.hits += len(uphi) - int(np.count_nonzero(missing))
+        self.misses += int(np.count_nonzero(missing))
+        if (len(add) > 0):
+            if (len(self.phi) + len(add) > self.max_size):
+                self.phi = uphi[:valid]
+                self.factors = ufactors[:valid]
+            else:
+                # uphi is sorted, so the insert positions keep the
+                # memo sorted; one insert moves both factors.
+                self.phi = np.insert(self.phi, pos[add], uphi[add])
+                self.factors = np.insert(self.factors, pos[add],
+                                         ufactors[add], axis=0)
+        ufactors = ufactors[inverse]
+        return (ufactors[:, 0], ufactors[:, 1])
+
+
 class ProjectionBase():
 
     def __init__(self):
@@ -14,6 +194,23 @@ class ProjectionBase():
     def get_class_name(self):
         return type(self).__name__
 
+    def get_params(self):
+        """Returns a tuple of (name, value) pairs holding the numeric
+        parameters of the projection.
+        """
+        params = []
+        for name, value in sorted(vars(self).items()):
+            if (isinstance(value, (int, float)) and
+                not isinstance(value, bool)):
+                params.append((name, value))
+        return tuple(params)
+
+    def get_cache_key(self):
+        """Returns a string identifying the projection and its
+        parameters, for use in cache keys.
+        """
+        return self.get_class_name() + repr(self.get_params())
+
     def deg_to_rad(self, value):
         """Convert a value from degrees to radians.
         Returns the converted value in radian value.
@@ -22,15 +219,35 @@ class ProjectionBase():
 
     def project_points(self, points):
         """Transform a list of geographic coordinate system tuples.
-        points is a list of coordinate tuples in degrees.
-        Returns a list of cartesian coordinates tuples in the
+        points is a list of coordinate tuples (or an N x 2 array)
+        in degrees.
+        Returns a list of cartesian coordinates [x, y] in the
         selected map projection.
         """
-        pcs_points = []
-        for gcs_pt in points:
-            pcs_pt = self.project_point(gcs_pt)
-            pcs_points.append(pcs_pt)
-        return pcs_points
+        gcs_array = np.asarray(points, dtype=np.float64)
+        if (len(gcs_array) == 0):
+            return []
+        pcs_array = self.project_array(gcs_array[:, 0:2])
+        return pcs_array.tolist()
+
+    def project_array(self, xy):
+        """Transform an N x 2 array of coordinates.
+        This fallback calls project_point for each row; subclasses
+        provide a vectorized version.
+        Returns a new N x 2 array in the map projection.
+        """
+        pcs_array = np.empty((len(xy), 2), dtype=np.float64)
+        for idx in range(len(xy)):
+            pcs_array[idx] = self.project_point((xy[idx, 0], xy[idx, 1]))
+        return pcs_array
+
+    def project_table(self, table):
+        """Transform all points of a featuretable.FeatureTable with
+        one project_array call.
+        Returns a new FeatureTable in the map projection, sharing the
+        offsets and columns of table.
+        """
+        return table.with_points(self.project_array(table.points))
 
     def project_point(self, gcs_coord):
         """Transform an x,y tuple according to the projection.
@@ -39,12 +256,71 @@ class ProjectionBase():
         """
         return gcs_coord
 
+    def get_central_meridian(self):
+        """Get the longitude at the middle of the map; the map is cut
+        at the antimeridian 180 degrees from it.
+        Returns the longitude in degrees.
+        """
+        return 0.0
+
+    def estimate_scale(self, bbox = None, samples = 33):
+        """Estimate the largest scale of the projection over a region.
+        The projection is differentiated numerically on a grid of
+        samples x samples points over bbox ([min_x, min_y, max_x,
+        max_y] in degrees, default the whole world; latitudes are
+        limited to +-89).
+        Returns the largest distance in map units that a one degree
+        offset (in any direction) can move a point.
+        """
+        if (bbox == None):
+            bbox = [-180.0, -90.0, 180.0, 90.0]
+        step = 0.01
+        lon = np.linspace(max(bbox[0], -180.0), min(bbox[2], 180.0) - step,
+                          samples)
+        lat = np.linspace(max(bbox[1], -89.0), min(bbox[3], 89.0) - step,
+                          samples)
+        lon, lat = np.meshgrid(lon, lat)
+        gcs_array = np.column_stack((lon.ravel(), lat.ravel()))
+        origin = self.project_array(gcs_array)
+        d_lon = (self.project_array(gcs_array + [step, 0.0]) - origin) / step
+        d_lat = (self.project_array(gcs_array + [0.0, step]) - origin) / step
+        # The Frobenius norm bounds the stretch of any offset.
+        norm = np.sqrt((d_lon ** 2).sum(axis=1) + (d_lat ** 2).sum(axis=1))
+        return float(np.nanmax(norm))
+
     def has_inverse(self):
         return False
 
     def invert(self, pcs_coord):
+        """Invert a cartesian coordinate tuple.
+        Projections with an inverse return the GCS coordinate tuple
+        in degrees.
+        """
         pass
 
+    def invert_points(self, points):
+        """Invert a list of cartesian coordinate tuples.
+        points is a list of coordinate tuples (or an N x 2 array)
+        in the map projection.
+        Returns a list of coordinates [x, y] in degrees.
+        """
+        pcs_array = np.asarray(points, dtype=np.float64)
+        if (len(pcs_array) == 0):
+            return []
+        gcs_array = self.invert_array(pcs_array[:, 0:2])
+        return gcs_array.tolist()
+
+    def invert_array(self, xy):
+        """Invert an N x 2 array of cartesian coordinates.
+        This fallback calls invert for each row; subclasses
+        provide a vectorized version.
+        Returns a new N x 2 array; GCS coordinates are in degrees.
+        """
+        gcs_array = np.empty((len(xy), 2), dtype=np.float64)
+        for idx in range(len(xy)):
+            gcs_array[idx] = self.invert((xy[idx, 0], xy[idx, 1]))
+        return gcs_array
+
 
 class TransformBase(ProjectionBase):
     """Base class for cartesian transformations.
@@ -52,6 +328,71 @@ class TransformBase(ProjectionBase):
     def __init__(self):
         super().__init__()
 
+    def has_matrix(self):
+        """Specify if get_matrix gives the transformation as an
+        affine matrix.  Compound fuses only such transformations.
+        """
+        return False
+
+    def get_matrix(self):
+        """Returns the transformation as a 3x3 affine matrix
+        acting on column vectors [x, y, 1].
+        Transformations that are affine override this and has_matrix.
+        """
+        raise NotImplementedError(self.get_class_name() +
+                                  " has no affine matrix")
+
+    def has_inverse(self):
+        return True
+
+    def invert(self, pcs_coord):
+        xy = np.array([[pcs_coord[0], pcs_coord[1]]], dtype=np.float64)
+        inv = self.invert_array(xy)
+        return (inv[0, 0], inv[0, 1])
+
+    def invert_array(self, xy):
+        """Invert an N x 2 array using the inverse matrix.
+        """
+        inv = np.linalg.inv(self.get_matrix())
+        return xy @ inv[0:2, 0:2].T + inv[0:2, 2]
+
+
+class Affine(TransformBase):
+    """A general affine transformation.
+    Compound uses this to hold a fused run of transformations.
+    """
+
+    def __init__(self, matrix, steps = None):
+        # matrix - 3x3 affine matrix
+        # steps  - list of the transformations folded into matrix
+        #
+        self.matrix = np.array(matrix, dtype=np.float64)
+        self.steps = steps if (steps != None) else []
+        super().__init__()
+
+    def has_matrix(self):
+        return True
+
+    def get_matrix(self):
+        return self.matrix
+
+    def get_params(self):
+        return (("matrix", tuple(self.matrix.ravel().tolist())),)
+
+    def project_point(self, gcs_coord):
+        """Transform the coordinate.
+        """
+        m = self.matrix
+        x, y = gcs_coord
+        xp = m[0, 0] * x + m[0, 1] * y + m[0, 2]
+        yp = m[1, 0] * x + m[1, 1] * y + m[1, 2]
+        return (xp, yp)
+
+    def project_array(self, xy):
+        """Transform an N x 2 array of coordinates.
+        """
+        return xy @ self.matrix[0:2, 0:2].T + self.matrix[0:2, 2]
+
 
 class Resize(TransformBase):
 
@@ -69,6 +410,20 @@ class Resize(TransformBase):
         return (gcs_coord[0] * self.cx,
                 gcs_coord[1] * self.cy)
 
+    def project_array(self, xy):
+        """Resize an N x 2 array of coordinates.
+        """
+        return xy * np.array([self.cx, self.cy])
+
+    def has_matrix(self):
+        return True
+
+    def get_matrix(self):
+        return np.diag([self.cx, self.cy, 1.0])
+
+    def invert_array(self, xy):
+        return xy / np.array([self.cx, self.cy])
+
 
 class Rotate(TransformBase):
 
@@ -88,6 +443,30 @@ class Rotate(TransformBase):
         yp =  x * self.sin_a + y * self.cos_a
         return (xp, yp)
 
+    def project_array(self, xy):
+        """Rotate an N x 2 array of coordinates.
+        """
+        x = xy[:, 0]
+        y = xy[:, 1]
+        xp =  x * self.cos_a - y * self.sin_a
+        yp =  x * self.sin_a + y * self.cos_a
+        return np.column_stack((xp, yp))
+
+    def has_matrix(self):
+        return True
+
+    def get_matrix(self):
+        return np.array([[self.cos_a, -self.sin_a, 0.0],
+                         [self.sin_a,  self.cos_a, 0.0],
+                         [0.0,         0.0,        1.0]])
+
+    def invert_array(self, xy):
+        x = xy[:, 0]
+        y = xy[:, 1]
+        xp =  x * self.cos_a + y * self.sin_a
+        yp = -x * self.sin_a + y * self.cos_a
+        return np.column_stack((xp, yp))
+
 
 class Translate(TransformBase):
 
@@ -105,6 +484,22 @@ class Translate(TransformBase):
         return (gcs_coord[0] + self.cx,
                 gcs_coord[1] + self.cy)
 
+    def project_array(self, xy):
+        """Translate an N x 2 array of coordinates.
+        """
+        return xy + np.array([self.cx, self.cy])
+
+    def has_matrix(self):
+        return True
+
+    def get_matrix(self):
+        return np.array([[1.0, 0.0, self.cx],
+                         [0.0, 1.0, self.cy],
+                         [0.0, 0.0, 1.0]])
+
+    def invert_array(self, xy):
+        return xy - np.array([self.cx, self.cy])
+
 
 class Rect(Resize):
 
@@ -115,6 +510,11 @@ class Rect(Resize):
 
 class GcsBase(ProjectionBase):
 
+    # Separable projections can keep their factors in a
+    # LatitudeCache.  It only pays off when the latitudes of a batch
+    # repeat, as on a graticule, so it is off by default.
+    CACHE_LATITUDES = False
+
     def __init__(self):
         super().__init__()
 
@@ -138,6 +538,83 @@ class GcsBase(ProjectionBase):
     def project_radian_point(self, rad_coord):
         return rad_coord
 
+    def project_array(self, xy):
+        """Transform an N x 2 array of GCS coordinates in degrees.
+        Returns a new N x 2 array in the map projection.
+        """
+        return self.project_radian_array(xy * DEG_TO_RAD)
+
+    def invert(self, pcs_coord):
+        """Invert a cartesian coordinate tuple.
+        Returns the GCS coordinate tuple in degrees.
+        """
+        rad_coord = self.invert_radian_point(pcs_coord)
+        return (rad_coord[0] * RAD_TO_DEG, rad_coord[1] * RAD_TO_DEG)
+
+    def invert_radian_point(self, pcs_coord):
+        """Invert a cartesian coordinate tuple.
+        This fallback calls invert_radian_array for one row.
+        Returns the GCS coordinate tuple in RADIANS.
+        """
+        xy = np.array([[pcs_coord[0], pcs_coord[1]]], dtype=np.float64)
+        rad_xy = self.invert_radian_array(xy)
+        return (rad_xy[0, 0], rad_xy[0, 1])
+
+    def invert_array(self, xy):
+        """Invert an N x 2 array of cartesian coordinates.
+        Returns a new N x 2 array of GCS coordinates in degrees;
+        points outside the map are NaN.
+        """
+        return self.invert_radian_array(xy) * RAD_TO_DEG
+
+    def invert_radian_array(self, xy):
+        """Invert an N x 2 array of cartesian coordinates.
+        Returns a new N x 2 array in RADIANS.
+        """
+        return xy.copy()
+
+    def is_separable(self):
+        """Specify if the projection has the form
+        x = lambda * f(phi), y = g(phi).
+        Separable projections implement lat_factors.
+        """
+        return False
+
+    def lat_factors(self, phi):
+        """Calculate the factors of a separable projection.
+        phi is an array of latitudes in RADIANS.
+        Returns the tuple of arrays (f, g).
+        """
+        return (np.ones(len(phi)), phi)
+
+    def get_latitude_cache(self):
+        """Returns the LatitudeCache of a separable projection.
+        """
+        if (getattr(self, "lat_cache", None) == None):
+            self.lat_cache = LatitudeCache(self.lat_factors)
+        return self.lat_cache
+
+    def project_radian_array(self, rad_xy):
+        """Transform an N x 2 array of coordinates in RADIANS.
+        Separable projections compute their latitude factors and
+        broadcast them across the longitudes; with CACHE_LATITUDES
+        the factors are computed once per unique latitude.
+        Otherwise this fallback calls project_radian_point for each
+        row; subclasses provide a vectorized version.
+        """
+        if (self.is_separable()):
+            if (self.CACHE_LATITUDES):
+                f, g = self.get_latitude_cache().lookup(rad_xy[:, 1])
+            else:
+                f, g = self.lat_factors(rad_xy[:, 1])
+            return np.column_stack((rad_xy[:, 0] * f, g))
+
+        pcs_array = np.empty((len(rad_xy), 2), dtype=np.float64)
+        for idx in range(len(rad_xy)):
+            pcs_array[idx] = self.project_radian_point(
+                (rad_xy[idx, 0], rad_xy[idx, 1]))
+        return pcs_array
+
 
 # Albers Projection
 #
@@ -188,31 +665,53 @@ class Albers(GcsBase):
         yp = self.rho0 - rho * math.cos(theta)
         return (xp, yp)
 
-    def has_inverse(self):
-        # Not verified since port, so return False.
-        return False
+    def project_radian_array(self, rad_xy):
+        """
+        rad_xy is an N x 2 array in RADIANS.
+        """
+        x = rad_xy[:, 0]
+        y = rad_xy[:, 1]
+        theta = self.n * (x - self.ref_lam)
+        temp_sqrt = np.sqrt(self.C - self.n2 * np.sin(y))
+        rho = self.nin * temp_sqrt
+        xp = rho * np.sin(theta)
+        yp = self.rho0 - rho * np.cos(theta)
+        return np.column_stack((xp, yp))
 
-    def invert(self, pcs_coord):
-        x, y = pcs_coord
-        theta = math.atan2(x, self.rho0 - y)
-        lambdav = self.nin * theta + self.ref_lam
+    def get_central_meridian(self):
+        return self.ref_lam * RAD_TO_DEG
 
-        rho = (self.rho0 - y) / math.cos(theta)
-        rn2 = rho * self.n
-        rn2 = rn2 * rn2
-        phi = math.asin((self.C - rn2) / self.n2)
+    def has_inverse(self):
+        return True
 
-        xp = lambdav
-        yp = phi
-        return (xp, yp)
+    def invert_radian_array(self, xy):
+        """
+        xy is an N x 2 array in the map projection.
+        A negative n (southern standard parallels) flips the
+        direction of rho.
+        """
+        sign = math.copysign(1.0, self.n)
+        x = xy[:, 0] * sign
+        rho0_y = (self.rho0 - xy[:, 1]) * sign
+        theta = np.arctan2(x, rho0_y)
+        lam = self.nin * theta + self.ref_lam
+        rn = np.hypot(x, rho0_y) * self.n
+        phi = np.arcsin(unit_clip((self.C - rn * rn) / self.n2))
+        return np.column_stack((lam, phi))
 
 
 class EckertIV(GcsBase):
 
+    # Fit of pi/2 - theta in u = sqrt(1 - |sin(phi)|).
+    SEED_POWER = 0.5
+    SEED_COEFS = (1.882622, -1.067439, 1.335414, -0.929294, 0.349504)
+
     def __init__(self):
         self.cx = 2.0 / math.sqrt(4 * math.pi + math.pi * math.pi)
         self.cy = 2.0 * math.sqrt(math.pi / (4 + math.pi))
         self.EPS = 1.0E-11
+        self.solver_stats = NewtonStats()
+        super().__init__()
 
     def __solve_theta(self, phi):
         theta = phi
@@ -229,6 +728,31 @@ class EckertIV(GcsBase):
         #
         return theta
 
+    def __theta_func(self, theta):
+        sin_t = np.sin(theta)
+        cos_t = np.cos(theta)
+        value = theta + sin_t * cos_t + 2.0 * sin_t
+        deriv = 2.0 * cos_t + np.cos(2.0 * theta) + 1
+        return (value, deriv)
+
+    def __solve_theta_array(self, phi):
+        """Array version of __solve_theta.
+        Starts from polar_seed, so typical points converge in
+        three or four passes.  The results match __solve_theta to
+        1e-12 map units, except within about 0.02 degrees of a pole,
+        where the equation is ill-conditioned and they differ by up
+        to 2e-8.
+        """
+        target = (2.0 + PI_DIV_TWO) * np.sin(phi)
+        seed = polar_seed(phi, self.SEED_POWER, self.SEED_COEFS)
+        return newton_solve(self.__theta_func, target, seed,
+                            self.EPS, self.solver_stats)
+
+    def get_solver_stats(self):
+        """Returns the NewtonStats of the array solver.
+        """
+        return self.solver_stats
+
     def project_radian_point(self, rad_coord):
         """
         rad_coord is a coordinate tuple in RADIANS.
@@ -242,11 +766,22 @@ class EckertIV(GcsBase):
         yp = self.cy * math.sin(theta)
         return (xp, yp)
 
+    def is_separable(self):
+        return True
+
+    def lat_factors(self, phi):
+        """
+        phi is an array of latitudes in RADIANS.
+        """
+        theta = self.__solve_theta_array(phi)
+        f = self.cx * (1 + np.cos(theta))
+        g = self.cy * np.sin(theta)
+        return (f, g)
+
     def has_inverse(self):
-        # Not verified since port.
-        return False
+        return True
 
-    def invert(self, pcs_coord):
+    def invert_radian_point(self, pcs_coord):
         x, y = pcs_coord
         theta = math.asin(y / self.cy)
         yp = math.asin((theta
@@ -256,11 +791,22 @@ class EckertIV(GcsBase):
         xp = x / self.cx / (1 + math.cos(theta))
         return (xp, yp)
 
+    def invert_radian_array(self, xy):
+        """
+        xy is an N x 2 array in the map projection.
+        """
+        theta = np.arcsin(unit_clip(xy[:, 1] / self.cy))
+        sin_t = np.sin(theta)
+        phi = np.arcsin(unit_clip((theta + sin_t * np.cos(theta) + 2.0 * sin_t)
+                                  / (2.0 + PI_DIV_TWO)))
+        lam = xy[:, 0] / self.cx / (1 + np.cos(theta))
+        return np.column_stack((lam, phi))
+
 
 class GallPeters(GcsBase):
 
     def __init__(self):
-        pass
+        super().__init__()
 
     def project_radian_point(self, rad_coord):
         """
@@ -273,20 +819,42 @@ class GallPeters(GcsBase):
         yp = 2.0 * math.sin(y)
         return (xp, yp)
 
+    def is_separable(self):
+        return True
+
+    def lat_factors(self, phi):
+        """
+        phi is an array of latitudes in RADIANS.
+        """
+        return (np.ones(len(phi)), 2.0 * np.sin(phi))
+
     def has_inverse(self):
-        return False
+        return True
 
-    def invert(self, pcs_coord):
+    def invert_radian_point(self, pcs_coord):
         x, y = pcs_coord
         xp = x
         yp = math.asin(y/ 2.0)
         return (xp, yp)
 
+    def invert_radian_array(self, xy):
+        """
+        xy is an N x 2 array in the map projection.
+        """
+        phi = np.arcsin(unit_clip(xy[:, 1] / 2.0))
+        return np.column_stack((xy[:, 0], phi))
+
 
 class Mollweide(GcsBase):
 
+    # Fit of pi/2 - theta in u = cbrt(1 - |sin(phi)|).
+    SEED_POWER = 1.0 / 3.0
+    SEED_COEFS = (1.343324, -0.136404, 0.646030, -0.726100, 0.443275)
+
     def __init__(self):
         self.EPS = 1.0E-11
+        self.solver_stats = NewtonStats()
+        super().__init__()
 
     def __solve_theta(self, phi):
         pi_sin_phi = math.pi * math.sin(phi)
@@ -304,6 +872,31 @@ class Mollweide(GcsBase):
         #
         return theta
 
+    def __theta_func(self, theta):
+        two_t = 2.0 * theta
+        value = two_t + np.sin(two_t)
+        deriv = 2 + 2.0 * np.cos(two_t)
+        return (value, deriv)
+
+    def __solve_theta_array(self, phi):
+        """Array version of __solve_theta.
+        Starts from polar_seed, so typical points converge in
+        three or four passes instead of up to twenty near the poles.
+        The results match __solve_theta to 1e-11 map units, except
+        within about 0.02 degrees of a pole, where the equation is
+        ill-conditioned and they differ by up to 4e-6 (both roots
+        have a zero floating-point residual).
+        """
+        pi_sin_phi = math.pi * np.sin(phi)
+        seed = polar_seed(phi, self.SEED_POWER, self.SEED_COEFS)
+        return newton_solve(self.__theta_func, pi_sin_phi, seed,
+                            self.EPS, self.solver_stats)
+
+    def get_solver_stats(self):
+        """Returns the NewtonStats of the array solver.
+        """
+        return self.solver_stats
+
     def project_radian_point(self, rad_coord):
         """
         rad_coord is a coordinate tuple in RADIANS.
@@ -314,12 +907,34 @@ class Mollweide(GcsBase):
         yp = math.sin(theta)
         return (xp, yp)
 
+    def is_separable(self):
+        return True
+
+    def lat_factors(self, phi):
+        """
+        phi is an array of latitudes in RADIANS.
+        """
+        theta = self.__solve_theta_array(phi)
+        f = TWO_DIV_PI * np.cos(theta)
+        g = np.sin(theta)
+        return (f, g)
+
     def has_inverse(self):
-        return False
+        return True
 
-    def invert(self, pcs_coord):
-        x, y = pcs_coord
-        return (xp, yp)
+    def invert_radian_array(self, xy):
+        """
+        xy is an N x 2 array in the map projection.
+        Longitude is undefined at the poles and returned as 0.
+        """
+        theta = np.arcsin(unit_clip(xy[:, 1]))
+        two_t = 2.0 * theta
+        phi = np.arcsin(unit_clip((two_t + np.sin(two_t)) / math.pi))
+        cos_t = np.cos(theta)
+        at_pole = (cos_t == 0.0)
+        lam = xy[:, 0] / (TWO_DIV_PI * np.where(at_pole, 1.0, cos_t))
+        lam[at_pole] = 0.0
+        return np.column_stack((lam, phi))
 
 
 class NaturalEarth2(GcsBase):
@@ -341,7 +956,10 @@ class NaturalEarth2(GcsBase):
         self.C2 = 11 * self.B2
         self.C3 = 13 * self.B3
         self.EPS = 1e-11
-        self.MAX_Y = 0.84719 * 0.5351175 * math.pi
+        super().__init__()
+        # y at the pole; the rounded constant 0.84719 * 0.5351175 * pi
+        # is slightly smaller and cut off the last 0.0004 degrees.
+        self.MAX_Y = self.project_radian_point((0.0, PI_DIV_TWO))[1]
 
     def project_radian_point(self, rad_coord):
         """
@@ -355,10 +973,40 @@ class NaturalEarth2(GcsBase):
         yp = y * (self.B0 + phi4 * phi4 * (self.B1 + self.B2 * phi2 + self.B3 * phi4))
         return (xp, yp)
 
+    def is_separable(self):
+        return True
+
+    def lat_factors(self, phi):
+        """
+        phi is an array of latitudes in RADIANS.
+        The polynomials are the same as project_radian_point.
+        """
+        return self.project_radian_point((np.ones(len(phi)), phi))
+
     def has_inverse(self):
-        return False
+        return True
 
-    def invert(self, pcs_coord):
+    def __y_func(self, phi):
+        """Returns the y polynomial and its derivative.
+        """
+        phi2 = phi * phi
+        phi4 = phi2 * phi2
+        phi8 = phi4 * phi4
+        value = phi * (self.B0 + phi8 * (self.B1 + self.B2 * phi2 + self.B3 * phi4))
+        deriv = self.C0 + phi8 * (self.C1 + self.C2 * phi2 + self.C3 * phi4)
+        return (value, deriv)
+
+    def invert_radian_array(self, xy):
+        """
+        xy is an N x 2 array in the map projection.
+        Same Newton-Raphson iteration as invert, on whole arrays.
+        """
+        y = np.clip(xy[:, 1], -self.MAX_Y, self.MAX_Y)
+        phi = newton_solve(self.__y_func, y, y, self.EPS)
+        f, g = self.lat_factors(phi)
+        return np.column_stack((xy[:, 0] / f, phi))
+
+    def invert_radian_point(self, pcs_coord):
         x, y = pcs_coord
         # Make sure y is inside valid range
         if (y > self.MAX_Y):
@@ -411,7 +1059,9 @@ class NaturalEarth(GcsBase):
         self.C3 = (9 * self.B3)
         self.C4 = (11 * self.B4)
         self.EPS = 1e-11
-        self.MAX_Y = (0.8707 * 0.52 * math.pi)
+        super().__init__()
+        # y at the pole, rather than the rounded 0.8707 * 0.52 * pi.
+        self.MAX_Y = self.project_radian_point((0.0, PI_DIV_TWO))[1]
 
     def project_radian_point(self, rad_coord):
         """
@@ -426,10 +1076,39 @@ class NaturalEarth(GcsBase):
 
         return (xp, yp)
 
+    def is_separable(self):
+        return True
+
+    def lat_factors(self, phi):
+        """
+        phi is an array of latitudes in RADIANS.
+        The polynomials are the same as project_radian_point.
+        """
+        return self.project_radian_point((np.ones(len(phi)), phi))
+
     def has_inverse(self):
-        return False
+        return True
 
-    def invert(self, pcs_coord):
+    def __y_func(self, phi):
+        """Returns the y polynomial and its derivative.
+        """
+        phi2 = phi * phi
+        phi4 = phi2 * phi2
+        value = phi * (self.B0 + phi2 * (self.B1 + phi4 * (self.B2 + self.B3 * phi2 + self.B4 * phi4)))
+        deriv = self.C0 + phi2 * (self.C1 + phi4 * (self.C2 + self.C3 * phi2 + self.C4 * phi4))
+        return (value, deriv)
+
+    def invert_radian_array(self, xy):
+        """
+        xy is an N x 2 array in the map projection.
+        Same Newton-Raphson iteration as invert, on whole arrays.
+        """
+        y = np.clip(xy[:, 1], -self.MAX_Y, self.MAX_Y)
+        phi = newton_solve(self.__y_func, y, y, self.EPS)
+        f, g = self.lat_factors(phi)
+        return np.column_stack((xy[:, 0] / f, phi))
+
+    def invert_radian_point(self, pcs_coord):
         x, y = pcs_coord
 
         # Make sure y is inside valid range.
@@ -466,6 +1145,9 @@ class Patterson(GcsBase):
         self.C2 =  0.23185
         self.C3 = -0.14499
         self.C4 =  0.02406
+        self.EPS = 1e-11
+        super().__init__()
+        self.MAX_Y = self.project_radian_point((0.0, PI_DIV_TWO))[1]
 
     def project_radian_point(self, rad_coord):
         """
@@ -478,12 +1160,36 @@ class Patterson(GcsBase):
         yp = phi * (self.C1 + phi2 * phi2 * (self.C2 + phi2 * (self.C3 + phi2 * self.C4)))
         return (xp, yp)
 
+    def is_separable(self):
+        return True
+
+    def lat_factors(self, phi):
+        """
+        phi is an array of latitudes in RADIANS.
+        The polynomials are the same as project_radian_point.
+        """
+        return self.project_radian_point((np.ones(len(phi)), phi))
+
     def has_inverse(self):
-        return False
+        return True
 
-    def invert(self, pcs_coord):
-        x, y = pcs_coord
-        return (xp, yp)
+    def __y_func(self, phi):
+        """Returns the y polynomial and its derivative.
+        """
+        phi2 = phi * phi
+        phi4 = phi2 * phi2
+        value = phi * (self.C1 + phi4 * (self.C2 + phi2 * (self.C3 + phi2 * self.C4)))
+        deriv = self.C1 + phi4 * (5 * self.C2 + phi2 * (7 * self.C3 + phi2 * 9 * self.C4))
+        return (value, deriv)
+
+    def invert_radian_array(self, xy):
+        """
+        xy is an N x 2 array in the map projection.
+        Latitude by Newton-Raphson on whole arrays.
+        """
+        y = np.clip(xy[:, 1], -self.MAX_Y, self.MAX_Y)
+        phi = newton_solve(self.__y_func, y, y / self.C1, self.EPS)
+        return np.column_stack((xy[:, 0], phi))
 
 
 class Robinson(GcsBase):
@@ -495,6 +1201,9 @@ class Robinson(GcsBase):
         self.A3 = -0.0013
         self.A4 = -0.0104
         self.A5 = -0.0129
+        self.EPS = 1e-11
+        super().__init__()
+        self.MAX_Y = self.project_radian_point((0.0, PI_DIV_TWO))[1]
 
     def project_radian_point(self, rad_coord):
         """
@@ -506,12 +1215,36 @@ class Robinson(GcsBase):
         yp = y * (self.A1 + phi2 * (self.A3 + phi2 * self.A5))
         return (xp, yp)
 
+    def is_separable(self):
+        return True
+
+    def lat_factors(self, phi):
+        """
+        phi is an array of latitudes in RADIANS.
+        The polynomials are the same as project_radian_point.
+        """
+        return self.project_radian_point((np.ones(len(phi)), phi))
+
     def has_inverse(self):
-        return False
+        return True
 
-    def invert(self, pcs_coord):
-        x, y = pcs_coord
-        return (xp, yp)
+    def __y_func(self, phi):
+        """Returns the y polynomial and its derivative.
+        """
+        phi2 = phi * phi
+        value = phi * (self.A1 + phi2 * (self.A3 + phi2 * self.A5))
+        deriv = self.A1 + phi2 * (3 * self.A3 + phi2 * 5 * self.A5)
+        return (value, deriv)
+
+    def invert_radian_array(self, xy):
+        """
+        xy is an N x 2 array in the map projection.
+        Latitude by Newton-Raphson on whole arrays.
+        """
+        y = np.clip(xy[:, 1], -self.MAX_Y, self.MAX_Y)
+        phi = newton_solve(self.__y_func, y, y / self.A1, self.EPS)
+        f, g = self.lat_factors(phi)
+        return np.column_stack((xy[:, 0] / f, phi))
 
 
 class VanDerGrinten(GcsBase):
@@ -568,10 +1301,107 @@ class VanDerGrinten(GcsBase):
 
         return (xp, yp)
 
+    def project_radian_array(self, rad_xy):
+        """
+        rad_xy is an N x 2 array in RADIANS.
+        The special cases of project_radian_point are handled
+        with index masks.
+        """
+        pcs_array = rad_xy.copy()
+        lam = rad_xy[:, 0]
+        phi = rad_xy[:, 1]
+
+        # Points on the equator are returned unchanged.
+        off_equator = (phi != 0.0)
+        theta = np.zeros(len(phi))
+        theta[off_equator] = np.arcsin(np.abs(2.0 * phi[off_equator] / math.pi))
+
+        # Central meridian and poles.
+        axis = off_equator & ((lam == 0.0)
+                              | (np.abs(PI_DIV_TWO - np.abs(phi)) < self.EPS))
+        yp = math.pi * np.tan(theta[axis] / 2)
+        pcs_array[axis, 0] = 0
+        pcs_array[axis, 1] = np.where(phi[axis] < 0.0, -yp, yp)
+
+        gen = off_equator & ~axis
+        lam = lam[gen]
+        phi = phi[gen]
+        theta = theta[gen]
+
+        A = 0.5 * np.abs(math.pi / lam - lam / math.pi)
+        G = np.cos(theta) / (np.sin(theta) + np.cos(theta) - 1)
+        P = G * (2.0 / np.sin(theta) - 1)
+        Q = A * A + G
+
+        A2 = A * A
+        G2 = G * G
+        P2 = P * P
+        Q2 = Q * Q
+        P2A2 = P2 + A2
+
+        GmP2 = G - P2
+        t1 = A * GmP2
+        t2 = A2 * GmP2 * GmP2
+        t3 = P2A2 * (G2 - P2)
+
+        xp = math.pi * (t1 + np.sqrt(t2 - t3)) / P2A2
+        pcs_array[gen, 0] = np.where(lam < 0.0, -xp, xp)
+
+        t1 = P * Q
+        t2 = (A2 + 1) * P2A2
+
+        yp = math.pi * np.abs(t1 - A * np.sqrt(t2 - Q2)) / P2A2
+        pcs_array[gen, 1] = np.where(phi < 0.0, -yp, yp)
+
+        return pcs_array
+
     def has_inverse(self):
-        return False
+        return True
 
-    def invert(self, pcs_coord):
+    def invert_radian_array(self, xy):
+        """
+        xy is an N x 2 array in the map projection.
+        The same closed form as invert, on whole arrays.
+        """
+        x = xy[:, 0] / math.pi
+        y = xy[:, 1] / math.pi
+
+        # The origin gives 0/0 below; it is patched at the end.
+        origin = (x == 0.0) & (y == 0.0)
+        y = np.where(origin, 1.0, y)
+
+        x2 = x * x
+        y2 = y * y
+        x2py2 = x2 + y2
+        x2my2 = x2 - y2
+
+        c1 = - np.abs(y) * (1 + x2 + y2)
+        c2 = c1 - 2.0 * y2 + x2
+        c3 = -2.0 * c1 + 1 + 2.0 * y2 + x2py2 * x2py2
+        c2_2 = c2 * c2
+        c2_3 = c2_2 * c2
+        c3_2 = c3 * c3
+        c3_3 = c3_2 * c3
+
+        t1 = 2 * c2_3 / c3_3
+        t2 = 9 * c1 * c2 / c3_2
+        d = y2 / c3 + (1/27)*(t1 - t2)
+        a1 = (1/c3) * (c1 - c2_2 / (3 * c3))
+        m1 = 2 * np.sqrt((-1/3) * a1)
+        theta = (1/3) * np.arccos(unit_clip(3 * d / (a1 * m1)))
+
+        phi = math.pi * (-m1 * np.cos(theta + (1/3)*math.pi) - (c2 / (3 * c3)))
+        phi = np.where(y < 0.0, -phi, phi)
+
+        t1 = 1 + 2 * x2my2 + x2py2 * x2py2
+        on_axis = (x == 0.0)
+        lam = math.pi * (x2py2 - 1 + np.sqrt(t1)) / (2 * np.where(on_axis, 1.0, x))
+        lam[on_axis] = 0.0
+
+        phi[origin] = 0.0
+        return np.column_stack((lam, phi))
+
+    def invert_radian_point(self, pcs_coord):
         x, y = pcs_coord
 
         x = x / math.pi
@@ -622,17 +1452,406 @@ class Compound(ProjectionBase):
     def __init__(self):
         super().__init__()
         self.projection_list = []
+        # The steps that are actually executed.  Consecutive
+        # transformations are folded into a single Affine step.
+        self.pipeline = []
 
     def add_projection(self, proj):
         """Add a projection to the list.
+        A transformation with an affine matrix that follows another
+        one is fused with it, using the parameters it has now.
         """
         self.projection_list.append(proj)
 
+        last = None
+        if (len(self.pipeline) > 0):
+            last = self.pipeline[-1]
+        if (isinstance(proj, TransformBase) and proj.has_matrix() and
+            isinstance(last, TransformBase) and last.has_matrix()):
+            if (isinstance(last, Affine)):
+                steps = last.steps + [proj]
+            else:
+                steps = [last, proj]
+            matrix = proj.get_matrix() @ last.get_matrix()
+            self.pipeline[-1] = Affine(matrix, steps)
+        else:
+            self.pipeline.append(proj)
+
     def project_point(self, gcs_coord):
         """Calculate the projection of the coordinate through each
-        projection in the list.
+        step of the pipeline.
         """
         coord = gcs_coord
-        for proj in self.projection_list:
+        for proj in self.pipeline:
             coord = proj.project_point(coord)
         return coord
+
+    def project_array(self, xy):
+        """Calculate the projection of an N x 2 array through each
+        step of the pipeline.
+        """
+        pcs_array = xy
+        for proj in self.pipeline:
+            pcs_array = proj.project_array(pcs_array)
+        return pcs_array
+
+    def get_central_meridian(self):
+        """The central meridian of the first step, which takes the
+        geographic coordinates.
+        """
+        if (len(self.pipeline) == 0):
+            return 0.0
+        return self.pipeline[0].get_central_meridian()
+
+    def has_inverse(self):
+        for proj in self.pipeline:
+            if (not proj.has_inverse()):
+                return False
+        return True
+
+    def invert(self, pcs_coord):
+        """Invert the coordinate through each step of the pipeline,
+        last step first.
+        Returns the GCS coordinate tuple in degrees.
+        """
+        coord = pcs_coord
+        for proj in reversed(self.pipeline):
+            coord = proj.invert(coord)
+        return coord
+
+    def invert_array(self, xy):
+        """Invert an N x 2 array through each step of the pipeline,
+        last step first.
+        """
+        gcs_array = xy
+        for proj in reversed(self.pipeline):
+            gcs_array = proj.invert_array(gcs_array)
+        return gcs_array
+
+    def get_cache_key(self):
+        keys = [proj.get_cache_key() for proj in self.projection_list]
+        return self.get_class_name() + "(" + ", ".join(keys) + ")"
+
+    def explain(self):
+        """Print the pipeline that is executed for each point.
+        """
+        print("Compound: {} projections in {} steps".format(
+            len(self.projection_list), len(self.pipeline)))
+        for idx, proj in enumerate(self.pipeline):
+            if (isinstance(proj, Affine)):
+                names = [step.get_class_name() for step in proj.steps]
+                print("  {}. Affine({})".format(idx + 1, ", ".join(names)))
+                for row in proj.get_matrix():
+                    print("       [{:12.6g} {:12.6g} {:12.6g}]".format(*row))
+            else:
+                print("  {}. {}".format(idx + 1, proj.get_class_name()))
+
+
+class Approximate(ProjectionBase):
+    """Interpolated approximation of a GCS projection.
+
+    The projection is sampled once on a (lambda, phi) grid covering
+    the whole globe and points are evaluated by vectorized bilinear
+    interpolation.  The grid starts at 10 degrees and rows and columns
+    are split until the interpolation error, measured at test points
+    on the edges and inside each cell, is below max_error (in output
+    units).
+    Cells that still miss the bound after max_nodes or max_rounds,
+    and points outside the grid, use the exact projection.
+
+    A pixel size suitable for max_error is SvgImage.get_pixel_size().
+    With cache_dir, the grid is saved to and loaded from a .npz file
+    keyed by the projection and its parameters.
+    """
+
+    GRID_VERSION = 1
+    BLOCK_SIZE = 32768
+
+    def __init__(self, proj, max_error,
+                 cache_dir = None, max_nodes = 2000000, max_rounds = 40):
+        # proj      - GcsBase projection to approximate
+        # max_error - maximum error in output units
+        #
+        super().__init__()
+        self.proj = proj
+        self.max_error = max_error
+        self.max_nodes = max_nodes
+        self.max_rounds = max_rounds
+        self.cache_file = None
+        if (cache_dir != None):
+            key = "{}:{}:{}:{}:{}".format(self.GRID_VERSION,
+                                          proj.get_cache_key(), max_error,
+                                          max_nodes, max_rounds)
+            digest = hashlib.sha1(key.encode()).hexdigest()[0:16]
+            self.cache_file = os.path.join(
+                cache_dir, "{}-{}.npz".format(proj.get_class_name(), digest))
+
+        if (self.cache_file != None and os.path.exists(self.cache_file)):
+            self.load_grid(self.cache_file)
+        else:
+            self.build_grid()
+            if (self.cache_file != None):
+                self.save_grid(self.cache_file)
+
+    def get_cache_key(self):
+        return "{}({}, {})".format(self.get_class_name(),
+                                   self.proj.get_cache_key(), self.max_error)
+
+    def get_central_meridian(self):
+        return self.proj.get_central_meridian()
+
+    def load_grid(self, file_name):
+        with np.load(file_name) as data:
+            self.lam = data["lam"]
+            self.phi = data["phi"]
+            self.values = data["values"]
+            self.exact_cells = data["exact_cells"]
+        self.__make_lookup()
+
+    def save_grid(self, file_name):
+        shpcache.save_npz(file_name, dict(lam=self.lam, phi=self.phi,
+                                          values=self.values,
+                                          exact_cells=self.exact_cells))
+
+    def __make_lookup(self):
+        """Prepare the cell lookup tables and the flattened values.
+        """
+        self.lam_index = self.__make_axis_index(self.lam)
+        self.phi_index = self.__make_axis_index(self.phi)
+        self.flat_values = [self.values[:, :, axis].ravel() for axis in (0, 1)]
+        self.any_exact = bool(self.exact_cells.any())
+
+    def __make_axis_index(self, nodes):
+        """Build a uniform bucket table over the grid nodes of an axis.
+        table[b] is the cell holding the start of bucket b, and
+        crowded[b] is set when the bucket holds more than one node.
+        """
+        nbuckets = 4 * len(nodes)
+        scale = nbuckets / (nodes[-1] - nodes[0])
+        starts = nodes[0] + np.arange(nbuckets + 1) / scale
+        table = np.searchsorted(nodes, starts, side="right") - 1
+        table = np.clip(table, 0, len(nodes) - 2)
+        # Nodes strictly inside each bucket.
+        inner = np.searchsorted(nodes, starts[1:], side="left") - (table[:-1] + 1)
+        crowded = np.append(inner > 1, False)
+        return (nodes[0], scale, table, crowded)
+
+    def __locate(self, x, nodes, index):
+        """Find the grid cell of each value in x.
+        Returns the array of cell indices, clipped to the grid.
+        """
+        x0, scale, table, crowded = index
+        pos = np.clip((x - x0) * scale, 0, len(table) - 1)
+        bucket = np.nan_to_num(pos).astype(np.intp)
+        cell = table[bucket]
+        # One step covers a bucket holding a single node.
+        cell += (x >= nodes[np.minimum(cell + 1, len(nodes) - 1)]) & (cell < len(nodes) - 2)
+        slow = crowded[bucket]
+        if (slow.any()):
+            cell[slow] = np.clip(np.searchsorted(nodes, x[slow], side="right") - 1,
+                                 0, len(nodes) - 2)
+        return cell
+
+    def __project_grid(self, lam, phi):
+        """Project the grid nodes lam x phi (RADIANS).
+        Returns an array of shape (len(phi), len(lam), 2).
+        """
+        glam, gphi = np.meshgrid(lam, phi)
+        rad_xy = np.column_stack((glam.ravel(), gphi.ravel()))
+        pcs = self.proj.project_radian_array(rad_xy)
+        return pcs.reshape(len(phi), len(lam), 2)
+
+    def __error(self, lam, phi, values):
+        """Measure the bilinear interpolation error of the grid.
+        The edges are tested at 1/4, 1/2 and 3/4 of their length and
+        the interior at its centre and the four quarter points.
+        Returns the arrays (err_x, err_y, inner) of shape (ny-1, nx-1):
+        the error of each cell on its edges along lambda, along phi,
+        and in its interior.
+        """
+        dlam = lam[1:] - lam[:-1]
+        dphi = phi[1:] - phi[:-1]
+        fractions = (0.25, 0.5, 0.75)
+
+        edge_x = 0.0
+        edge_y = 0.0
+        for t in fractions:
+            # Edges along lambda, on each node row.
+            exact = self.__project_grid(lam[:-1] + t * dlam, phi)
+            interp = (1.0 - t) * values[:, :-1] + t * values[:, 1:]
+            edge_x = np.maximum(edge_x, np.hypot(*(exact - interp).transpose(2, 0, 1)))
+            # Edges along phi, on each node column.
+            exact = self.__project_grid(lam, phi[:-1] + t * dphi)
+            interp = (1.0 - t) * values[:-1, :] + t * values[1:, :]
+            edge_y = np.maximum(edge_y, np.hypot(*(exact - interp).transpose(2, 0, 1)))
+
+        inner = 0.0
+        for tx, ty in ((0.5, 0.5), (0.25, 0.25), (0.25, 0.75),
+                       (0.75, 0.25), (0.75, 0.75)):
+            exact = self.__project_grid(lam[:-1] + tx * dlam,
+                                        phi[:-1] + ty * dphi)
+            interp = ((1.0 - ty) * ((1.0 - tx) * values[:-1, :-1] + tx * values[:-1, 1:])
+                      + ty * ((1.0 - tx) * values[1:, :-1] + tx * values[1:, 1:]))
+            inner = np.maximum(inner, np.hypot(*(exact - interp).transpose(2, 0, 1)))
+
+        err_x = np.maximum(edge_x[:-1], edge_x[1:])
+        err_y = np.maximum(edge_y[:, :-1], edge_y[:, 1:])
+        return (np.nan_to_num(err_x, nan=np.inf),
+                np.nan_to_num(err_y, nan=np.inf),
+                np.nan_to_num(inner, nan=np.inf))
+
+    def build_grid(self):
+        """Sample the projection and refine the grid until the
+        interpolation error is below max_error.
+        """
+        # The tests can underestimate the error between them,
+        # so keep a safety factor.
+        tol = 0.5 * self.max_error
+        lam = np.linspace(-math.pi, math.pi, 37)
+        phi = np.linspace(-PI_DIV_TWO, PI_DIV_TWO, 19)
+        for loop in range(self.max_rounds):
+            values = self.__project_grid(lam, phi)
+            err_x, err_y, inner = self.__error(lam, phi, values)
+            bad_x = (err_x > tol)
+            bad_y = (err_y > tol)
+            bad = bad_x | bad_y | (inner > tol)
+            if (not bad.any() or loop == self.max_rounds - 1):
+                break
+            # Split along the axis whose edges miss the bound, or along
+            # both when only the interior does.
+            only_inner = bad & ~bad_x & ~bad_y
+            split_cols = np.unique(np.nonzero(bad_x | only_inner)[1])
+            split_rows = np.unique(np.nonzero(bad_y | only_inner)[0])
+            new_size = (len(lam) + len(split_cols)) * (len(phi) + len(split_rows))
+            if (new_size > self.max_nodes):
+                break
+            lam = np.sort(np.concatenate(
+                (lam, 0.5 * (lam[split_cols] + lam[split_cols + 1]))))
+            phi = np.sort(np.concatenate(
+                (phi, 0.5 * (phi[split_rows] + phi[split_rows + 1]))))
+        #
+        self.lam = lam
+        self.phi = phi
+        self.values = values
+        self.exact_cells = bad
+        self.__make_lookup()
+
+    def has_inverse(self):
+        return self.proj.has_inverse()
+
+    def invert(self, pcs_coord):
+        """The inverse uses the exact projection.
+        Returns the GCS coordinate tuple in degrees.
+        """
+        xy = np.array([[pcs_coord[0], pcs_coord[1]]], dtype=np.float64)
+        gcs = self.invert_array(xy)
+        return (gcs[0, 0], gcs[0, 1])
+
+    def invert_array(self, xy):
+        return self.proj.invert_array(xy)
+
+    def get_grid_size(self):
+        """Returns the tuple (columns, rows, exact cells) of the grid.
+        """
+        return (len(self.lam), len(self.phi),
+                int(np.count_nonzero(self.exact_cells)))
+
+    def project_point(self, gcs_coord):
+        xy = np.array([[gcs_coord[0], gcs_coord[1]]], dtype=np.float64)
+        pcs = self.project_array(xy)
+        return (pcs[0, 0], pcs[0, 1])
+
+    def project_array(self, xy):
+        """Interpolate an N x 2 array of GCS coordinates in degrees.
+        Large arrays are processed in blocks so the temporaries
+        stay in cache.
+        """
+        if (len(xy) <= self.BLOCK_SIZE):
+            return self.__interpolate(xy)
+        pcs_array = np.empty((len(xy), 2))
+        for start in range(0, len(xy), self.BLOCK_SIZE):
+            stop = start + self.BLOCK_SIZE
+            pcs_array[start:stop] = self.__interpolate(xy[start:stop])
+        return pcs_array
+
+    def __interpolate(self, xy):
+        rad_xy = xy * DEG_TO_RAD
+        x = rad_xy[:, 0]
+        y = rad_xy[:, 1]
+
+        ix = self.__locate(x, self.lam, self.lam_index)
+        iy = self.__locate(y, self.phi, self.phi_index)
+        exact = ~((x >= self.lam[0]) & (x <= self.lam[-1]) &
+                  (y >= self.phi[0]) & (y <= self.phi[-1]))
+        if (self.any_exact):
+            exact |= self.exact_cells[iy, ix]
+
+        tx = (x - self.lam[ix]) / (self.lam[ix + 1] - self.lam[ix])
+        ty = (y - self.phi[iy]) / (self.phi[iy + 1] - self.phi[iy])
+
+        # Gather the cell corners from the flattened grid; np.take
+        # on 1-D arrays is much faster than 2-D fancy indexing.
+        nx = len(self.lam)
+        k00 = iy * nx + ix
+        k10 = k00 + nx
+        pcs_array = np.empty((len(xy), 2))
+        for axis in (0, 1):
+            v = self.flat_values[axis]
+            v0 = np.take(v, k00)
+            v0 += tx * (np.take(v, k00 + 1) - v0)
+            v1 = np.take(v, k10)
+            v1 += tx * (np.take(v, k10 + 1) - v1)
+            pcs_array[:, axis] = v0 + ty * (v1 - v0)
+
+        if (exact.any()):
+            pcs_array[exact] = self.proj.project_radian_array(rad_xy[exact])
+        return pcs_array
+
+
+def check_round_trip(proj, gcs_array):
+    """Project and invert an N x 2 array of GCS coordinates in degrees.
+    Returns the largest round trip error in degrees; the longitude
+    error is scaled by cos(latitude) and ignored at the poles.
+    """
+    inv = proj.invert_array(proj.project_array(gcs_array))
+    dlon = (inv[:, 0] - gcs_array[:, 0] + 180.0) % 360.0 - 180.0
+    lat = gcs_array[:, 1]
+    dlon = np.where(np.abs(lat) == 90.0, 0.0, dlon * np.cos(lat * DEG_TO_RAD))
+    err = np.hypot(dlon, inv[:, 1] - lat)
+    return float(np.max(err))
+
+
+def make_round_trip_points():
+    """Make GCS coordinates to check the inverse projections on: a
+    0.5 degree grid plus random points.
+    Returns an N x 2 array in degrees.
+    """
+    lon, lat = np.meshgrid(np.linspace(-180, 180, 721),
+                           np.linspace(-90, 90, 361))
+    rng = np.random.default_rng(1)
+    return np.vstack((np.column_stack((lon.ravel(), lat.ravel())),
+                      np.column_stack((rng.uniform(-180, 180, 100000),
+                                       rng.uniform(-90, 90, 100000)))))
+
+def make_round_trip_compound():
+    """Make a Compound of a projection and two transforms to check
+    the inverse of a chain on.
+    Returns a Compound.
+    """
+    compound = Compound()
+    compound.add_projection(NaturalEarth2())
+    compound.add_projection(Rotate(45))
+    compound.add_projection(Translate(0.5, -0.25))
+    return compound
+
+
+if __name__ == "__main__":
+    # Round trip accuracy of the inverse projections on a 0.5 degree
+    # grid plus random points.
+    gcs_array = make_round_trip_points()
+    for proj in [Albers(45.5, 29.5, -96, 37.5), EckertIV(), GallPeters(),
+                 Mollweide(), NaturalEarth(), NaturalEarth2(), Patterson(),
+                 Robinson(), VanDerGrinten(), Rect(3.1 / 180.0),
+                 make_round_trip_compound()]:
+        print("{:14s} max round trip error {:.3g} degrees".format(
+            proj.get_class_name(), check_round_trip(proj, gcs_array)))
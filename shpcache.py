@@ -0,0 +1,300 @@
+import hashlib
+import json
+import os
+import shutil
+import zipfile
+import numpy as np
+
+
+# Default cache location and size; TRAVELMAP_CACHE overrides the
+# location.
+DEFAULT_CACHE_DIR = os.path.join("~", ".cache", "travelmap", "shapefiles")
+DEFAULT_MAX_BYTES = 2 * 1024 * 1024 * 1024
+SHAPEFILE_MEMBERS = (".shp", ".shx", ".dbf", ".cpg", ".prj")
+CHECKSUM_FILE = "checksums.json"
+
+
+class ShpCacheError(Exception):
+    """Error extracting a shapefile into the cache.
+    """
+
+    def __init__(self, message):
+        self.message = message
+        super().__init__(self.message)
+
+
+def file_hash(file_name):
+    """Returns the SHA-1 hex digest of the file contents.
+    """
+    digest = hashlib.sha1()
+    with open(file_name, "rb") as f:
+        while True:
+            block = f.read(1 << 20)
+            if (len(block) == 0):
+                break
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ShapefileCache():
+    """On-disk cache of extracted shapefiles.
+    Each zip file is extracted once into a directory named by its
+    SHA-1 checksum.  The checksums of source files are remembered
+    with their size and modification time, so a warm lookup does
+    not read the zip again.  When the cache grows past max_bytes
+    the least recently used entries are removed.
+    """
+
+    def __init__(self, cache_dir = None, max_bytes = DEFAULT_MAX_BYTES):
+        if (cache_dir == None):
+            cache_dir = os.environ.get("TRAVELMAP_CACHE", DEFAULT_CACHE_DIR)
+        self.cache_dir = os.path.abspath(os.path.expanduser(cache_dir))
+        self.max_bytes = max_bytes
+        self.checksums = None
+
+    def get_class_name(self):
+        return type(self).__name__
+
+    def __load_checksums(self):
+        if (self.checksums != None):
+            return
+        self.checksums = {}
+        try:
+            with open(os.path.join(self.cache_dir, CHECKSUM_FILE)) as f:
+                self.checksums = json.load(f)
+        except (OSError, ValueError):
+            pass
+
+    def __save_checksums(self):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        file_name = os.path.join(self.cache_dir, CHECKSUM_FILE)
+        # Write to a temporary name so readers never see a partial file.
+        tmp_name = file_name + ".tmp" + str(os.getpid())
+        with open(tmp_name, "w") as f:
+            json.dump(self.checksums, f)
+        os.replace(tmp_name, file_name)
+
+    def get_checksum(self, file_name):
+        """Get the SHA-1 checksum of a file, remembered by path,
+        size and modification time.
+        Returns the hex digest.
+        """
+        self.__load_checksums()
+        path = os.path.abspath(file_name)
+        stat = os.stat(path)
+        entry = self.checksums.get(path)
+        if (entry != None and entry[0] == stat.st_size and
+            entry[1] == stat.st_mtime_ns):
+            return entry[2]
+        checksum = file_hash(path)
+        self.checksums[path] = [stat.st_size, stat.st_mtime_ns, checksum]
+        try:
+            self.__save_checksums()
+        except OSError:
+            pass
+        return checksum
+
+    def extract(self, zip_name):
+        """Get the extracted shapefile for a zip file, extracting it
+        on first use.  A zip file holding several shapefiles must
+        have one named like the zip file; that one is used.
+        Returns the base path (no suffix) of the extracted .shp file.
+        """
+        entry_dir = os.path.join(self.cache_dir,
+                                 self.get_checksum(zip_name)[0:16])
+        if (not os.path.isdir(entry_dir)):
+            self.__extract_entry(zip_name, entry_dir)
+            self.evict(keep=entry_dir)
+        else:
+            # Mark the entry as recently used.
+            os.utime(entry_dir)
+        roots = sorted(os.path.splitext(name)[0]
+                       for name in os.listdir(entry_dir)
+                       if os.path.splitext(name)[1].lower() == ".shp")
+        if (len(roots) == 0):
+            raise ShpCacheError("No .shp file in " + zip_name)
+        if (len(roots) > 1):
+            # Several shapefiles: use the one named like the zip file.
+            base = os.path.splitext(os.path.basename(zip_name))[0]
+            if (base not in roots):
+                raise ShpCacheError("Several .shp files in " + zip_name +
+                                    ": " + ", ".join(roots))
+            roots = [base]
+        return os.path.join(entry_dir, roots[0])
+
+    def get_sidecar_name(self, source, suffix):
+        """Get the name of a file derived from a shapefile, such as
+        its index, in the cache entry keyed by the checksum of source
+        (the .zip or .shp file), so the file is evicted with the entry
+        and never written to the data directory.  Zip files are
+        extracted first and the file is put next to the extracted
+        shapefile.
+        Returns the base name of the shapefile plus suffix.
+        """
+        root, ext = os.path.splitext(source)
+        if (ext.lower() == ".zip"):
+            return self.extract(source) + suffix
+        entry_dir = os.path.join(self.cache_dir,
+                                 self.get_checksum(source)[0:16])
+        try:
+            os.makedirs(entry_dir, exist_ok=True)
+            # Mark the entry as recently used.
+            os.utime(entry_dir)
+        except OSError:
+            # The file will not be written; it is only kept in memory.
+            pass
+        return os.path.join(entry_dir, os.path.basename(root)) + suffix
+
+    def __extract_entry(self, zip_name, entry_dir):
+        """Extract the shapefile members of the zip file.
+        The files are written to a temporary directory which is then
+        renamed, so a partial extraction is never used.
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_dir = entry_dir + ".tmp" + str(os.getpid())
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        with zipfile.ZipFile(zip_name) as zf:
+            for name in zf.namelist():
+                if (os.path.splitext(name)[1].lower() not in SHAPEFILE_MEMBERS):
+                    continue
+                target = os.path.join(tmp_dir, os.path.basename(name))
+                with zf.open(name) as src, open(target, "wb") as dst:
+                    shutil.copyfileobj(src, dst, 1 << 20)
+        try:
+            os.rename(tmp_dir, entry_dir)
+        except OSError:
+            # Another process extracted the same file first.
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    def get_entries(self):
+        """Get the cache entries, least recently used first.
+        Returns a list of (path, size in bytes) tuples.
+        """
+        if (not os.path.isdir(self.cache_dir)):
+            return []
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if (not os.path.isdir(path) or ".tmp" in name):
+                continue
+            size = sum(os.path.getsize(os.path.join(path, f))
+                       for f in os.listdir(path))
+            entries.append((os.path.getmtime(path), path, size))
+        entries.sort()
+        return [(path, size) for mtime, path, size in entries]
+
+    def evict(self, keep = None):
+        """Remove least recently used entries until the cache fits
+        in max_bytes.  The entry keep is never removed.
+        """
+        entries = self.get_entries()
+        total = sum(size for path, size in entries)
+        for path, size in entries:
+            if (total <= self.max_bytes):
+                break
+            if (path == keep):
+                continue
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+
+
+class ReaderRegistry():
+    """Shared shapefile readers, one per file and reader class.
+    The readers are treated as read-only, so every layer drawing
+    from the same file uses the same reader, along with its memory
+    maps, spatial index and DBF columns.
+    """
+
+    def __init__(self):
+        self.readers = {}
+
+    def get_class_name(self):
+        return type(self).__name__
+
+    def get_reader(self, sf_name, reader_class):
+        """Get the shared reader_class reader for sf_name,
+        opening it on first use.
+        """
+        key = (os.path.abspath(sf_name), reader_class)
+        reader = self.readers.get(key)
+        if (reader == None):
+            reader = reader_class(sf_name)
+            self.readers[key] = reader
+        return reader
+
+    def clear(self):
+        """Forget all readers.
+        """
+        self.readers = {}
+
+
+SHAPEFILE_CACHE = ShapefileCache()
+READER_REGISTRY = ReaderRegistry()
+
+
+def get_cache():
+    """Returns the default ShapefileCache.
+    """
+    return SHAPEFILE_CACHE
+
+def get_reader(sf_name, reader_class):
+    """Get a shared reader from the default ReaderRegistry.
+    """
+    return READER_REGISTRY.get_reader(sf_name, reader_class)
+
+def sidecar_file_name(source, suffix):
+    """Get the name of a file derived from a shapefile in the default
+    cache (see ShapefileCache.get_sidecar_name).
+    """
+    return get_cache().get_sidecar_name(source, suffix)
+
+def save_npz(file_name, arrays, compressed = False):
+    """Save a dict of arrays to a .npz file, compressed if asked.
+    The file is written to a temporary name unique to the process
+    and then renamed, so readers never see a partial file and two
+    processes writing the same file never mix their writes.
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(file_name)), exist_ok=True)
+    tmp_name = file_name + ".tmp" + str(os.getpid()) + ".npz"
+    if (compressed):
+        np.savez_compressed(tmp_name, **arrays)
+    else:
+        np.savez(tmp_name, **arrays)
+    os.replace(tmp_name, file_name)
+
+def load_or_build(source, suffix, cls, collect):
+    """Load a file derived from a shapefile, such as its index, or
+    build and save it.  The file is stored in the cache entry of
+    source (the .zip or .shp file, see sidecar_file_name) and keyed
+    by its checksum, so it is rebuilt when the file changes.
+    cls() makes an empty object with build(*collect()),
+    save(file_name, source_hash) and load(file_name, source_hash),
+    which returns False for a file of another version or source.
+    If the file can not be written the object is only kept in
+    memory.
+    Returns a cls object.
+    """
+    source_hash = get_cache().get_checksum(source)
+    file_name = sidecar_file_name(source, suffix)
+    obj = cls()
+    if (os.path.exists(file_name) and obj.load(file_name, source_hash)):
+        return obj
+    obj.build(*collect())
+    try:
+        obj.save(file_name, source_hash)
+    except OSError:
+        pass
+    return obj
+
+def extract_shapefile(sf_name):
+    """Get the base path (no suffix) of a shapefile on disk.
+    Zip files are extracted into the default cache; .shp files and
+    base names are returned as they are.
+    """
+    root, ext = os.path.splitext(sf_name)
+    if (ext.lower() == ".zip"):
+        return get_cache().extract(sf_name)
+    if (ext.lower() in SHAPEFILE_MEMBERS):
+        return root
+    return sf_name
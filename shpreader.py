@@ -1,76 +1,711 @@
 
 import shapefile
-import copy
+import shpcache
+import spatialindex
+import parttable
+import lodpyramid
+import topology
+import dbfcolumns
+import featuretable
+import numpy as np
+import mmap
+import os
 
-class ShpReader(shapefile.Reader):
+class SidecarMixin():
+    """Data derived from a shapefile for a reader: the spatial index,
+    part table, LOD pyramid and arc topology, each loaded from (or
+    built and saved to) a file in the shapefile cache on first use,
+    and the feature tables read with them.  Only uses file_name,
+    shapeType and iterShapes() of the reader.
+    """
+
+    spatial_index = None
+    part_table = None
+    lod_pyramid = None
+    topology = None
+
+    def get_spatial_index(self):
+        """Get the spatial index of the records and parts.
+        Loaded from (or built and saved to) a sidecar file in the
+        shapefile cache.
+        Returns a spatialindex.ShapefileIndex.
+        """
+        if (self.spatial_index == None):
+            self.spatial_index = spatialindex.get_shapefile_index(
+                index_source(self.file_name),
+                lambda: self.get_part_table().get_index_arrays())
+        return self.spatial_index
+
+    def get_part_table(self):
+        """Get the table of per-part metrics.
+        Loaded from (or built and saved to) a sidecar file in the
+        shapefile cache.
+        Returns a parttable.PartTable.
+        """
+        if (self.part_table == None):
+            polygon = self.shapeType in POLYGON_TYPES
+            self.part_table = parttable.get_part_table(
+                index_source(self.file_name),
+                lambda: collect_parts(self.iterShapes(), polygon))
+        return self.part_table
+
+    def get_lod_pyramid(self):
+        """Get the levels of detail of the parts.
+        Loaded from (or built and saved to) a file in the
+        shapefile cache.
+        Returns a lodpyramid.LodPyramid.
+        """
+        if (self.lod_pyramid == None):
+            polygon = self.shapeType in POLYGON_TYPES
+            self.lod_pyramid = lodpyramid.get_lod_pyramid(
+                index_source(self.file_name),
+                lambda: collect_parts(self.iterShapes(), polygon))
+        return self.lod_pyramid
+
+    def get_topology(self):
+        """Get the arc topology of the parts.
+        Loaded from (or built and saved to) a file in the
+        shapefile cache.
+        Returns a topology.Topology.
+        """
+        if (self.topology == None):
+            polygon = self.shapeType in POLYGON_TYPES
+            self.topology = topology.get_topology(
+                index_source(self.file_name),
+                lambda: collect_parts(self.iterShapes(), polygon))
+        return self.topology
+
+    def get_feature_table(self, fields=None, bbox=None, where=None,
+                          min_area=None, lod_level=None):
+        """Read the selected parts into a featuretable.FeatureTable
+        (see read_feature_table).
+        """
+        return read_feature_table(self, fields, bbox, where, min_area,
+                                  lod_level)
+
+    def get_arc_table(self, fields=None, bbox=None, where=None,
+                      min_area=None, lod_level=None):
+        """Read the selected parts, joined from the arcs of the
+        topology, into a featuretable.FeatureTable (see
+        read_arc_table).
+        """
+        return read_arc_table(self, fields, bbox, where, min_area,
+                              lod_level)
+
+
+class PartReaderMixin():
+    """Reading one part at a time, for readers with SidecarMixin.
+    """
+
+    def iterShapeParts(self, fields=None, bbox=None, where=None,
+                       min_area=None, lod_level=None, arcs=False):
+        """Return ShapePart objects one part at a time.
+        bbox, if given, is [min_x, min_y, max_x, max_y] and only parts
+        whose bounding box overlaps it are returned.  where, if given,
+        is a list of dbfcolumns.FieldPredicate the records must match.
+        min_area, if given, drops parts smaller than that fraction
+        of the earth (see parttable.PartTable.get_size_estimate).
+        lod_level, if given, reads the points from that level of
+        the LOD pyramid.  arcs joins the parts from the arcs of the
+        topology instead (see iter_arc_parts).
+        """
+        if (bbox == None and not where and min_area == None and
+            lod_level == None and not arcs):
+            return iter_shape_parts(super().iterShapeRecords(fields))
+        return iter_selected_parts(self, fields, bbox, where, min_area,
+                                   lod_level, arcs)
+
+    def iterShapeRecords(self, fields=None, bbox=None, where=None,
+                         min_area=None, lod_level=None, arcs=False):
+        """Return shapefile records one part at a time.
+        Same as iterShapeParts.
+        """
+        return self.iterShapeParts(fields, bbox, where, min_area, lod_level,
+                                   arcs)
+
+
+class ShpReader(SidecarMixin, shapefile.Reader):
+    """pyshp Reader; zip files are read from the extracted copy in
+    the shapefile cache instead of being inflated on every open.
+    """
 
     def __init__(self, sf_name = None):
-        super().__init__(sf_name)
+        self.base_name = None
+        if (sf_name != None):
+            self.base_name = shpcache.extract_shapefile(sf_name)
+        super().__init__(self.base_name)
         self.file_name = sf_name
+        self.dbf_columns = None
 
     def get_class_name(self):
         return type(self).__name__
 
+    def get_dbf_columns(self):
+        """Get the column-wise reader of the .dbf attributes.
+        Returns a dbfcolumns.DbfColumns.
+        """
+        if (self.dbf_columns == None):
+            self.dbf_columns = dbfcolumns.DbfColumns(
+                self.dbf, self.dbf_reader.encoding)
+        return self.dbf_columns
+
+    def iterShapeRecords(self, fields=None, bbox=None, where=None):
+        """Return shapefile ShapeRecords.
+        bbox, if given, is [min_x, min_y, max_x, max_y] and only
+        records whose bounding box overlaps it are read, found with
+        the spatial index.  where, if given, is a list of
+        dbfcolumns.FieldPredicate and only records matching all of
+        them are read.
+        """
+        if (bbox == None and not where):
+            return super().iterShapeRecords(fields)
+        return iter_selected_records(self, fields, bbox, where)
+
+
+class PartShape():
+    """Shape geometry for a single part of a shapefile record.
+    points is a view (offset, length) into the coordinate array
+    shared by all parts of the record.  Parts read from an LOD
+    pyramid level or joined from arcs have their own points and no
+    offset.  arcs holds the topology.Topology arc references of
+    parts joined from arcs.
+    """
+
+    def __init__(self, shape_type, points, offset, bbox, arcs = None):
+        self.shapeType = shape_type
+        self.points = points
+        self.parts = [0]
+        self.offset = offset
+        self.bbox = bbox
+        self.arcs = arcs
+
+    def __len__(self):
+        return len(self.points)
+
+
+class ShapePart():
+    """One part of a shapefile ShapeRecord.
+    Has the same shape and record attributes as a ShapeRecord,
+    so it can be used wherever a single part ShapeRecord is.
+    part is the index of the part within the record.
+    """
+
+    def __init__(self, record, shape, part):
+        self.record = record
+        self.shape = shape
+        self.part = part
+
+
+def calc_part_bbox(part_pts):
+    """Calculate the bounding box for the shape part.
+    Returns [x_lo, y_lo, x_hi, y_hi].
+    """
+    pts = np.asarray(part_pts, dtype=np.float64)
+    lo = pts.min(axis=0)
+    hi = pts.max(axis=0)
+    return [float(lo[0]), float(lo[1]), float(hi[0]), float(hi[1])]
+
+def calc_part_bboxes(points, begin):
+    """Calculate the bounding boxes of all parts at once.
+    points is the N x 2 coordinate array of the record and
+    begin holds the start index of each (non-empty) part.
+    Returns a P x 4 array of [x_lo, y_lo, x_hi, y_hi] rows.
+    """
+    bboxes = np.empty((len(begin), 4))
+    bboxes[:, 0:2] = np.minimum.reduceat(points, begin, axis=0)
+    bboxes[:, 2:4] = np.maximum.reduceat(points, begin, axis=0)
+    return bboxes
+
+def split_shape(shape):
+    """Split the points of a shape into parts.
+    Empty parts are dropped.
+    Returns (points, begin, end, bboxes): the N x 2 coordinate array
+    (not copied if it already is one), the begin and end index of
+    each part and the P x 4 part bounding boxes.
+    """
+    if (shape == None or len(shape.points) == 0):
+        empty = np.zeros(0, dtype=np.intp)
+        return (np.zeros((0, 2)), empty, empty, np.zeros((0, 4)))
+    points = np.asarray(shape.points, dtype=np.float64)[:, 0:2]
+    # shape.parts holds the start index of each part.
+    begin = np.asarray(shape.parts, dtype=np.intp)
+    if (len(begin) == 0):
+        begin = np.zeros(1, dtype=np.intp)
+    end = np.append(begin[1:], len(points))
+    keep = end > begin
+    begin = begin[keep]
+    end = end[keep]
+    return (points, begin, end, calc_part_bboxes(points, begin))
+
+def iter_shape_parts(shape_records, part_filter=None):
+    """Split shape records into ShapePart objects.
+    Every part references a slice of the record's coordinate array,
+    so nothing is copied per part and the yielded objects are never
+    reused.  part_filter, if given, holds a set of part numbers
+    for each record to restrict the output to.
+    """
+    for i, shrec in enumerate(shape_records):
+        shape = shrec.shape
+        if (len(shape.points) == 0):
+            # Null shape, nothing to split.
+            if (part_filter == None):
+                yield ShapePart(shrec.record, shape, 0)
+            continue
+        points, begin, end, bboxes = split_shape(shape)
+        for j in range(len(begin)):
+            if (part_filter != None and j not in part_filter[i]):
+                continue
+            part_shape = PartShape(shape.shapeType,
+                                   points[begin[j]:end[j]],
+                                   int(begin[j]),
+                                   bboxes[j].tolist())
+            yield ShapePart(shrec.record, part_shape, j)
+
+def collect_parts(shapes, polygon):
+    """Collect the parts of all shapes for building a
+    parttable.PartTable.
+    Returns the PartTable.build arguments: (points, part begin
+    indices, part record numbers, part numbers, number of records,
+    polygon).
+    """
+    all_points = []
+    all_begin = []
+    part_record = []
+    part_number = []
+    total = 0
+    num_records = 0
+    for i, shape in enumerate(shapes):
+        num_records += 1
+        points, begin, end, bboxes = split_shape(shape)
+        if (len(begin) == 0):
+            continue
+        # Keep only the points of the non-empty parts.
+        keep = spatialindex.expand_ranges(begin, end)
+        all_points.append(points[keep])
+        all_begin.append(np.cumsum(end - begin) - (end - begin) + total)
+        total += len(keep)
+        part_record.append(np.full(len(begin), i, dtype=np.intp))
+        part_number.append(np.arange(len(begin), dtype=np.intp))
+    if (len(all_points) == 0):
+        empty = np.zeros(0, dtype=np.intp)
+        return (np.zeros((0, 2)), empty, empty, empty, num_records, polygon)
+    return (np.concatenate(all_points), np.concatenate(all_begin),
+            np.concatenate(part_record), np.concatenate(part_number),
+            num_records, polygon)
+
+def select_records(reader, bbox=None, where=None):
+    """Find the records overlapping bbox and matching all the where
+    predicates.  The predicates are evaluated column-wise on the
+    .dbf and the bbox with the spatial index, so no geometry is
+    decoded.
+    Returns a sorted array of record numbers.
+    """
+    if (where):
+        records = reader.get_dbf_columns().select(where)
+    else:
+        records = np.arange(len(reader))
+    if (bbox != None):
+        in_bbox = reader.get_spatial_index().query_records(bbox)
+        records = np.intersect1d(records, in_bbox, assume_unique=True)
+    return records
+
+def iter_selected_records(reader, fields, bbox, where):
+    """Return the shape records chosen by select_records,
+    decoding only those.
+    """
+    for i in select_records(reader, bbox, where):
+        yield reader.shapeRecord(int(i), fields)
+
+def select_part_rows(reader, bbox=None, where=None, min_area=None):
+    """Find the parts whose bounding box overlaps bbox (with the
+    spatial index), of records matching the where predicates (on the
+    .dbf columns), of at least min_area size (from the part table,
+    see PartTable.get_size_estimate).  Only array masks are used.
+    Returns a sorted array of part table rows (file order).
+    """
+    table = reader.get_part_table()
+    if (bbox != None):
+        rows = reader.get_spatial_index().query_part_rows(bbox)
+    else:
+        rows = np.arange(len(table))
+    if (where):
+        selected = reader.get_dbf_columns().select(where)
+        rows = rows[np.isin(table.record[rows], selected)]
+    if (min_area != None):
+        rows = rows[table.get_size_estimate()[rows] >= min_area]
+    return rows
+
+def iter_selected_parts(reader, fields, bbox, where, min_area=None,
+                        lod_level=None, arcs=False):
+    """Return ShapePart objects for the parts chosen by
+    select_part_rows.  At full resolution only the records holding
+    them are decoded; with lod_level the points come from that level
+    of the reader's LOD pyramid and only the DBF records are read.
+    With arcs the parts are joined from the reader's topology (at
+    lod_level of its arcs, if given).
+    """
+    if (bbox == None and min_area == None and lod_level == None and
+        not arcs):
+        return iter_shape_parts(iter_selected_records(reader, fields,
+                                                      None, where))
+    rows = select_part_rows(reader, bbox, where, min_area)
+    if (arcs):
+        return iter_arc_parts(reader, fields, rows, lod_level)
+    if (lod_level != None):
+        return iter_lod_parts(reader, fields, rows, lod_level)
+    table = reader.get_part_table()
+    records = table.record[rows]
+    parts = table.part[rows]
+    record_list, first = np.unique(records, return_index=True)
+    last = np.append(first[1:], len(records))
+    part_filter = [set(parts[first[k]:last[k]].tolist())
+                   for k in range(len(record_list))]
+    shape_records = (reader.shapeRecord(int(i), fields) for i in record_list)
+    return iter_shape_parts(shape_records, part_filter)
+
+def iter_lod_parts(reader, fields, rows, level):
+    """Return ShapePart objects for part table rows, with the points
+    of an LOD pyramid level.  Each part keeps its full resolution
+    bbox.
+    """
+    table = reader.get_part_table()
+    pyramid = reader.get_lod_pyramid()
+    record_num = -1
+    record = None
+    for row in rows.tolist():
+        if (table.record[row] != record_num):
+            record_num = int(table.record[row])
+            record = reader.record(record_num, fields)
+        part_shape = PartShape(reader.shapeType,
+                               pyramid.get_part_points(level, row),
+                               None, table.bbox[row].tolist())
+        yield ShapePart(record, part_shape, int(table.part[row]))
+
+def iter_arc_parts(reader, fields, rows, level=None):
+    """Return ShapePart objects for part table rows, joined from the
+    arcs of the reader's topology at an LOD level of the arcs, or at
+    full resolution.  The parts carry their arc references.
+    """
+    table = reader.get_part_table()
+    topo = reader.get_topology()
+    record_num = -1
+    record = None
+    for row in rows.tolist():
+        if (table.record[row] != record_num):
+            record_num = int(table.record[row])
+            record = reader.record(record_num, fields)
+        part_shape = PartShape(reader.shapeType,
+                               topo.get_part_points(row, level), None,
+                               table.bbox[row].tolist(),
+                               topo.get_part_refs(row))
+        yield ShapePart(record, part_shape, int(table.part[row]))
+
+def read_feature_table(reader, fields=None, bbox=None, where=None,
+                       min_area=None, lod_level=None):
+    """Read the parts chosen by select_part_rows into one
+    featuretable.FeatureTable, with the .dbf fields listed in fields
+    (all if None) as columns read with the reader's DbfColumns.
+    With lod_level the points are gathered from that level of the
+    LOD pyramid; at full resolution only the records holding the
+    parts are decoded.  No Python object is made per point or part.
+    Returns a FeatureTable with one row per record that has parts.
+    """
+    rows = select_part_rows(reader, bbox, where, min_area)
+    table = reader.get_part_table()
+    part_records = table.record[rows]
+    records, first = np.unique(part_records, return_index=True)
+    part_record = np.repeat(np.arange(len(records)),
+                            np.diff(np.append(first, len(rows))))
+    if (lod_level != None):
+        pyramid = reader.get_lod_pyramid()
+        offsets = pyramid.offsets[lod_level]
+        points = pyramid.points[lod_level]
+        begin = offsets[rows]
+        end = offsets[rows + 1]
+    else:
+        pieces = []
+        last = np.append(first[1:], len(rows))
+        for k, i in enumerate(records.tolist()):
+            points, begin, end, bboxes = split_shape(reader.shape(i))
+            parts = table.part[rows[first[k]:last[k]]]
+            pieces.append(points[spatialindex.expand_ranges(begin[parts],
+                                                            end[parts])])
+        points = (np.concatenate(pieces) if (len(pieces) > 0)
+                  else np.zeros((0, 2)))
+        end = np.cumsum(table.num_points[rows])
+        begin = end - table.num_points[rows]
+    return featuretable.build_feature_table(reader.shapeType, points, begin,
+                                            end, part_record, len(records),
+                                            records,
+                                            read_columns(reader, records,
+                                                         fields))
+
+def read_arc_table(reader, fields=None, bbox=None, where=None,
+                   min_area=None, lod_level=None):
+    """Read the parts chosen by select_part_rows into one
+    featuretable.FeatureTable, joined from the arcs of the reader's
+    topology at an LOD level of the arcs, or at full resolution.
+    Unlike read_feature_table, every part is a row of its own, so
+    each row can be drawn from the arc references of its part table
+    row (see topology.Topology.get_part_refs).
+    Returns (FeatureTable, array of the part table row of each
+    table row).
+    """
+    rows = select_part_rows(reader, bbox, where, min_area)
+    records = reader.get_part_table().record[rows]
+    points, begin, end = reader.get_topology().get_parts_points(rows,
+                                                                lod_level)
+    table = featuretable.build_feature_table(reader.shapeType, points, begin,
+                                             end, np.arange(len(rows)),
+                                             len(rows), records,
+                                             read_columns(reader, records,
+                                                          fields))
+    return (table, rows)
+
+def read_columns(reader, records, fields=None):
+    """Read .dbf fields of some records with the reader's DbfColumns.
+    records is an array of record numbers and fields the field
+    names (all if None).
+    Returns a dict of arrays, one per field, for
+    featuretable.FeatureTable columns.
+    """
+    if (fields == None):
+        fields = [field[0] for field in reader.fields
+                  if field[0] != "DeletionFlag"]
+    columns = {}
+    if (len(fields) > 0):
+        dbf = reader.get_dbf_columns()
+        for name in fields:
+            columns[name] = dbf.get_column(name)[records]
+    return columns
+
+def index_source(sf_name):
+    """The file a shapefile index is keyed by: the .zip or .shp file.
+    """
+    if (os.path.isfile(sf_name)):
+        return sf_name
+    return sf_name + ".shp"
 
-class ShpPartReader(ShpReader):
+
+class ShpPartReader(PartReaderMixin, ShpReader):
 
     def __init__(self, sf_name = None):
         super().__init__(sf_name)
 
     def calc_part_bbox(self, part_pts):
         """Calculate the bounding box for the shape part.
-        Loop through the set of points and pick the largest
-        and smallest.
-        """
-        x_lo =  180.0
-        y_lo =   90.0
-        x_hi = -180.0
-        y_hi =  -90.0
-        for coord in part_pts:
-            # x
-            if (coord[0] < x_lo):
-                x_lo = coord[0]
-            elif (coord[0] > x_hi):
-                x_hi = coord[0]
-            # y
-            if (coord[1] < y_lo):
-                y_lo = coord[1]
-            elif (coord[1] > y_hi):
-                y_hi = coord[1]
-        #
-        return [x_lo, y_lo, x_hi, y_hi]
-        
-    def iterShapeRecords(self, fields=None, bbox=None):
-        """Return shapefile ShapeRecord one part at a time.
-        """
-        for shrec in super().iterShapeRecords(fields, bbox):
-            plen = len(shrec.shape.parts)
-            if (plen <= 1):
-                # If there is only one part, return it.
-                #
-                yield shrec
-            else:
-                # Loop through multiple shape parts.
-                # shrec.shape.parts holds the start index of each part.
-                # Create a begin and end index list and loop through
-                # the values.
-                #
-                begin_list = shrec.shape.parts
-                end_list = begin_list[1:len(begin_list)]
-                end_list.append(len(shrec.shape.points))
-                #
-                # Make a copy of the original points so we can
-                # overwrite the values in shrec.
-                #
-                orig_pts = copy.deepcopy(shrec.shape.points)
-                #
-                for i in range(len(begin_list)):
-                    bidx = begin_list[i]
-                    eidx = end_list[i]
-                    part_pts = orig_pts[bidx:eidx]
-                    shrec.shape.points = part_pts
-                    shrec.shape.parts = [0]
-                    shrec.shape.bbox = self.calc_part_bbox(part_pts)
-                    yield shrec
+        Returns [x_lo, y_lo, x_hi, y_hi].
+        """
+        return calc_part_bbox(part_pts)
+
+
+# Shapefile shape types that ShpArrayReader decodes.  The Z and M
+# variants share the x, y layout of the base type; only x and y are
+# returned.
+NULL_TYPES = (0,)
+POINT_TYPES = (1, 11, 21)
+POLY_TYPES = (3, 5, 13, 15, 23, 25)
+POLYGON_TYPES = (5, 15, 25)
+MULTIPOINT_TYPES = (8, 18, 28)
+SHP_HEADER_SIZE = 100
+SHP_FILE_CODE = 9994
+
+
+class ShpArrayError(Exception):
+    """Error decoding a shapefile with ShpArrayReader.
+    """
+
+    def __init__(self, message):
+        self.message = message
+        super().__init__(self.message)
+
+
+class ArrayShape():
+    """Shape geometry decoded straight from the .shp file.
+    points is an N x 2 float64 array viewing the memory mapped file,
+    parts is an int32 array with the start index of each part.
+    """
+
+    def __init__(self, shape_type, points, parts, bbox):
+        self.shapeType = shape_type
+        self.points = points
+        self.parts = parts
+        self.bbox = bbox
+
+    def __len__(self):
+        return len(self.points)
+
 
+class ArrayShapeRecord():
+    """Shape and DBF record pair returned by ShpArrayReader.
+    """
 
+    def __init__(self, record, shape):
+        self.record = record
+        self.shape = shape
+
+
+class ShpArrayReader(SidecarMixin):
+    """Shapefile reader that decodes geometry into NumPy arrays.
+    The .shp file is memory mapped and the .shx offsets give random
+    access to each record, so points are never turned into Python
+    objects.  Zipped shapefiles are read from the shapefile cache.
+    The DBF attributes are still read with pyshp.
+    """
+
+    def __init__(self, sf_name = None):
+        self.file_name = sf_name
+        self.base_name = shpcache.extract_shapefile(sf_name)
+        with open(self.base_name + ".shx", "rb") as shx:
+            shx_data = shx.read()
+        # Offset and content length of each record, in 16-bit words.
+        index = np.frombuffer(shx_data, dtype=">i4", offset=SHP_HEADER_SIZE)
+        index = index.reshape(-1, 2).astype(np.int64) * 2
+        self.rec_offsets = index[:, 0]
+        self.rec_lengths = index[:, 1]
+        self.shp_file = open(self.base_name + ".shp", "rb")
+        self.shp_map = mmap.mmap(self.shp_file.fileno(), 0,
+                                 access=mmap.ACCESS_READ)
+        header = np.frombuffer(self.shp_map, dtype=">i4", count=1)
+        if (header[0] != SHP_FILE_CODE):
+            raise ShpArrayError("Not a shapefile: " + self.base_name + ".shp")
+        self.shapeType = int(np.frombuffer(self.shp_map, dtype="<i4",
+                                           count=1, offset=32)[0])
+        self.bbox = np.frombuffer(self.shp_map, dtype="<f8", count=4,
+                                  offset=36).tolist()
+        self.dbf_file = open(self.base_name + ".dbf", "rb")
+        self.dbf = shapefile.Reader(dbf=self.dbf_file)
+        self.shape_bboxes = self.__calc_shape_bboxes()
+        self.dbf_columns = None
+
+    def get_class_name(self):
+        return type(self).__name__
+
+    def __len__(self):
+        return len(self.rec_offsets)
+
+    @property
+    def fields(self):
+        return self.dbf.fields
+
+    def close(self):
+        """Release the memory map and open files.
+        If decoded point arrays still view the memory map it stays
+        open until they are garbage collected.
+        """
+        self.dbf.close()
+        self.dbf_file.close()
+        try:
+            self.shp_map.close()
+        except BufferError:
+            pass
+        self.shp_file.close()
+
+    def __read(self, dtype, count, offset):
+        return np.frombuffer(self.shp_map, dtype=dtype, count=count,
+                             offset=offset)
+
+    def get_dbf_columns(self):
+        """Get the column-wise reader of the .dbf attributes.
+        Returns a dbfcolumns.DbfColumns.
+        """
+        if (self.dbf_columns == None):
+            self.dbf_columns = dbfcolumns.DbfColumns(
+                self.base_name + ".dbf", self.dbf.dbf_reader.encoding)
+        return self.dbf_columns
+
+    def get_shape_bboxes(self):
+        """Get the bounding boxes of all records.
+        Points have a zero size box; null shapes have NaN boxes.
+        Returns an N x 4 array of [x_lo, y_lo, x_hi, y_hi] rows.
+        """
+        return self.shape_bboxes
+
+    def __calc_shape_bboxes(self):
+        """Read the bounding boxes of all records with one gather
+        from the memory mapped file.
+        """
+        data = np.frombuffer(self.shp_map, dtype=np.uint8)
+        content = self.rec_offsets + 8
+        types = data[content[:, None] + np.arange(4)].copy().view("<i4")[:, 0]
+        # Null shapes hold only their type, so they have no box to read.
+        bboxes = np.full((len(content), 4), np.nan)
+        shapes = content[types != 0]
+        if (self.shapeType in POINT_TYPES):
+            idx = shapes[:, None] + 4 + np.arange(16)
+            xy = data[idx].copy().view("<f8")
+            bboxes[types != 0] = np.hstack((xy, xy))
+        else:
+            idx = shapes[:, None] + 4 + np.arange(32)
+            bboxes[types != 0] = data[idx].copy().view("<f8")
+        return bboxes
+
+    def shape(self, i):
+        """Decode shape number i.
+        Returns an ArrayShape whose points view the .shp file.
+        """
+        offset = int(self.rec_offsets[i]) + 8
+        shape_type = int(self.__read("<i4", 1, offset)[0])
+        if (shape_type in NULL_TYPES):
+            return ArrayShape(shape_type, np.empty((0, 2)),
+                              np.zeros(0, dtype=np.int32), [])
+        if (shape_type in POINT_TYPES):
+            points = self.__read("<f8", 2, offset + 4).reshape(1, 2)
+            x, y = points[0].tolist()
+            return ArrayShape(shape_type, points,
+                              np.zeros(1, dtype=np.int32), [x, y, x, y])
+        bbox = self.__read("<f8", 4, offset + 4).tolist()
+        if (shape_type in MULTIPOINT_TYPES):
+            num_points = int(self.__read("<i4", 1, offset + 36)[0])
+            points = self.__read("<f8", 2 * num_points, offset + 40)
+            return ArrayShape(shape_type, points.reshape(-1, 2),
+                              np.zeros(1, dtype=np.int32), bbox)
+        if (shape_type in POLY_TYPES):
+            num_parts, num_points = self.__read("<i4", 2, offset + 36).tolist()
+            parts = self.__read("<i4", num_parts, offset + 44)
+            points = self.__read("<f8", 2 * num_points,
+                                 offset + 44 + 4 * num_parts)
+            return ArrayShape(shape_type, points.reshape(-1, 2), parts, bbox)
+        raise ShpArrayError("Unsupported shape type " + str(shape_type))
+
+    def record(self, i, fields=None):
+        """Get DBF record number i.
+        """
+        return self.dbf.record(i, fields=fields)
+
+    def shapeRecord(self, i, fields=None):
+        """Get shape and record number i.
+        """
+        return ArrayShapeRecord(self.dbf.record(i, fields=fields),
+                                self.shape(i))
+
+    def iterShapes(self, bbox=None):
+        for i in self.__select(bbox):
+            yield self.shape(i)
+
+    def iterShapeRecords(self, fields=None, bbox=None, where=None):
+        """Return ArrayShapeRecord objects one record at a time.
+        bbox, if given, is [min_x, min_y, max_x, max_y] and only shapes
+        whose bounding box overlaps it are returned.  where, if given,
+        is a list of dbfcolumns.FieldPredicate the records must match.
+        """
+        for i in self.__select(bbox, where):
+            yield ArrayShapeRecord(self.dbf.record(i, fields=fields),
+                                   self.shape(i))
+
+    def __select(self, bbox, where=None):
+        """Get the record numbers selected by bbox and where.
+        Returns a range or a list of record numbers.
+        """
+        if (bbox == None and not where):
+            return range(len(self))
+        return select_records(self, bbox, where).tolist()
+
+
+class ShpArrayPartReader(PartReaderMixin, ShpArrayReader):
+    """ShpArrayReader that returns one part at a time,
+    like ShpPartReader.
+    """
+
+    def __init__(self, sf_name = None):
+        super().__init__(sf_name)
@@ -0,0 +1,222 @@
+import numpy as np
+from spatialindex import expand_ranges
+
+
+class SimplifyError(Exception):
+    """Simplify exception.
+    """
+
+    def __init__(self, message):
+        self.message = message
+        super().__init__(self.message)
+
+
+def segment_distance2(p, a, b):
+    """Squared distance from points p to the segments a-b.
+    p, a, b are N x 2 arrays; a segment with a == b is a point.
+    Returns an array of squared distances.
+    """
+    ab = b - a
+    ap = p - a
+    len2 = np.einsum("ij,ij->i", ab, ab)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        t = np.einsum("ij,ij->i", ap, ab) / len2
+    t = np.clip(np.nan_to_num(t), 0.0, 1.0)
+    d = ap - t[:, None] * ab
+    return np.einsum("ij,ij->i", d, d)
+
+def group_argmax(values, begin, end):
+    """Find the position of the first maximum of each group
+    values[begin[i]:end[i]]; groups must not be empty.
+    Returns an array of indices into values.
+    """
+    group = np.repeat(np.arange(len(begin)), end - begin)
+    vmax = np.maximum.reduceat(values, begin)
+    at_max = np.flatnonzero(values == vmax[group])
+    return at_max[np.unique(group[at_max], return_index=True)[1]]
+
+def part_anchors(points, begin, end, closed):
+    """Pick the points that are always kept when simplifying many
+    parts at once: the ends of every part and, for closed rings of
+    more than four points, the point farthest from the first point
+    and the point farthest from the line through those two, so the
+    simplified ring stays a polygon.
+    Returns a sorted array of indices.
+    """
+    anchors = [begin, end - 1]
+    rings = (end - begin) > 4
+    if (closed and rings.any()):
+        count = end[rings] - begin[rings]
+        group_end = np.cumsum(count)
+        group_begin = group_end - count
+        idx = expand_ranges(begin[rings], end[rings])
+        first = points[np.repeat(begin[rings], count)]
+        d0 = points[idx] - first
+        far = idx[group_argmax(np.einsum("ij,ij->i", d0, d0),
+                               group_begin, group_end)]
+        d1 = segment_distance2(points[idx], first,
+                               points[np.repeat(far, count)])
+        third = idx[group_argmax(d1, group_begin, group_end)]
+        anchors += [far, third]
+    return np.unique(np.concatenate(anchors))
+
+def simplify_parts(points, begin, end, tolerance, closed,
+                   method = "douglas-peucker"):
+    """Simplify many lines or rings in one call.
+    points holds all parts, part i being points[begin[i]:end[i]].
+    Rings of four points or fewer are kept as they are.
+    Returns a boolean mask of the points to keep.
+    """
+    anchors = part_anchors(points, begin, end, closed)
+    if (closed):
+        # Keep small rings whole.
+        small = (end - begin) <= 4
+        anchors = np.union1d(anchors, expand_ranges(begin[small], end[small]))
+    if (method == "douglas-peucker"):
+        return douglas_peucker(points, tolerance, anchors)
+    return visvalingam_whyatt(points, tolerance ** 2, anchors)
+
+def douglas_peucker(points, tolerance, anchors = None):
+    """Douglas-Peucker line simplification.
+    All pending segments are split at once in each pass, so the
+    number of passes is the depth of the recursion.
+    points is an N x 2 array and tolerance the largest distance
+    from the simplified line.  anchors are indices always kept.
+    Returns a boolean mask of the points to keep.
+    """
+    n = len(points)
+    keep = np.zeros(n, dtype=bool)
+    keep[[0, n - 1]] = True
+    if (anchors is not None):
+        keep[anchors] = True
+    start = np.flatnonzero(keep)
+    end = start[1:]
+    start = start[:-1]
+    tol2 = tolerance * tolerance
+    while (len(start) > 0):
+        inner = end - start > 1
+        start = start[inner]
+        end = end[inner]
+        if (len(start) == 0):
+            break
+        idx = expand_ranges(start + 1, end)
+        count = end - start - 1
+        seg = np.repeat(np.arange(len(start)), count)
+        d2 = segment_distance2(points[idx], points[start[seg]],
+                               points[end[seg]])
+        first = np.cumsum(count) - count
+        dmax = np.maximum.reduceat(d2, first)
+        # Position of the first maximum of each segment.
+        at_max = np.flatnonzero(d2 == dmax[seg])
+        at_max = at_max[np.unique(seg[at_max], return_index=True)[1]]
+        split = dmax > tol2
+        mid = idx[at_max[split]]
+        keep[mid] = True
+        start, end = (np.concatenate((start[split], mid)),
+                      np.concatenate((mid, end[split])))
+    return keep
+
+def visvalingam_whyatt(points, min_area, anchors = None):
+    """Visvalingam-Whyatt line simplification.
+    Removes points whose triangle with their neighbors has less
+    than min_area.  Each pass removes every point that is a local
+    minimum of the area (ties broken by a fixed pseudo random
+    order), which approximates the smallest-first order of the
+    heap based algorithm.
+    points is an N x 2 array.  anchors are indices always kept.
+    Returns a boolean mask of the points to keep.
+    """
+    n = len(points)
+    fixed = np.zeros(n, dtype=bool)
+    fixed[[0, n - 1]] = True
+    if (anchors is not None):
+        fixed[anchors] = True
+    idx = np.arange(n)
+    order = (idx * 2654435761) % 4294967296
+    while (len(idx) > 2):
+        p = points[idx]
+        d1 = p[1:-1] - p[:-2]
+        d2 = p[2:] - p[:-2]
+        area = 0.5 * np.abs(d1[:, 0] * d2[:, 1] - d1[:, 1] * d2[:, 0])
+        area[fixed[idx[1:-1]]] = np.inf
+        rank = order[idx[1:-1]]
+        left = np.concatenate(([np.inf], area[:-1]))
+        right = np.concatenate((area[1:], [np.inf]))
+        left_rank = np.concatenate(([0], rank[:-1]))
+        right_rank = np.concatenate((rank[1:], [0]))
+        below_left = (area < left) | ((area == left) & (rank < left_rank))
+        below_right = (area < right) | ((area == right) & (rank < right_rank))
+        remove = (area < min_area) & below_left & below_right
+        if (not remove.any()):
+            break
+        idx = idx[np.concatenate(([True], ~remove, [True]))]
+    keep = np.zeros(n, dtype=bool)
+    keep[idx] = True
+    return keep
+
+
+class Simplifier():
+    """Simplify projected lines and polygon rings to a tolerance in
+    map units, and count the vertices going in and out.
+    method is "douglas-peucker" (tolerance is the largest distance
+    from the original line) or "visvalingam-whyatt" (points making
+    a triangle smaller than tolerance squared are removed).
+    """
+
+    METHODS = ("douglas-peucker", "visvalingam-whyatt")
+
+    def __init__(self, tolerance, method = "douglas-peucker"):
+        if (method not in self.METHODS):
+            raise SimplifyError("Unknown simplification method: " + str(method))
+        self.tolerance = tolerance
+        self.method = method
+        self.points_in = 0
+        self.points_out = 0
+
+    def get_class_name(self):
+        return type(self).__name__
+
+    def simplify(self, points, closed = False):
+        """Simplify a line, or a polygon ring if closed is True.
+        Rings keep at least three distinct points.
+        Returns the simplified N x 2 array.
+        """
+        points = np.asarray(points, dtype=np.float64)
+        self.points_in += len(points)
+        if (len(points) > 2):
+            keep = simplify_parts(points, np.array([0]),
+                                  np.array([len(points)]),
+                                  self.tolerance, closed, self.method)
+            points = points[keep]
+        self.points_out += len(points)
+        return points
+
+    def simplify_parts(self, points, begin, end, closed = False):
+        """Simplify many lines, or rings if closed is True, at once;
+        see simplify_parts.
+        Returns a boolean mask of the points to keep.
+        """
+        keep = simplify_parts(points, begin, end, self.tolerance, closed,
+                              self.method)
+        self.points_in += len(points)
+        self.points_out += int(np.count_nonzero(keep))
+        return keep
+
+    def simplify_table(self, table, closed = False):
+        """Simplify all lines, or rings if closed is True, of a
+        featuretable.FeatureTable in map units at once.
+        Returns a FeatureTable.
+        """
+        begin, end = table.get_part_ranges()
+        full = (end - begin) > 0
+        if (not full.any()):
+            return table
+        keep = self.simplify_parts(table.points, begin[full], end[full],
+                                   closed)
+        offsets = np.concatenate(([0], np.cumsum(keep)))[table.part_offsets]
+        return table.with_points(table.points[keep], offsets)
+
+    def __str__(self):
+        percent = 100.0 * self.points_out / max(self.points_in, 1)
+        return "{} vertices in, {} out ({:.1f}%)".format(
+            self.points_in, self.points_out, percent)
@@ -0,0 +1,231 @@
+import shpcache
+import numpy as np
+
+
+def boxes_overlap(boxes, bbox):
+    """Test which boxes overlap bbox (touching counts).
+    boxes is an N x 4 array of [min_x, min_y, max_x, max_y] rows.
+    Returns a boolean array.  NaN boxes never overlap.
+    """
+    return ((boxes[:, 0] <= bbox[2]) & (boxes[:, 2] >= bbox[0]) &
+            (boxes[:, 1] <= bbox[3]) & (boxes[:, 3] >= bbox[1]))
+
+
+def expand_ranges(start, end):
+    """Concatenate the integer ranges [start[i], end[i]).
+    Returns an array of indices.
+    """
+    lengths = end - start
+    total = int(lengths.sum())
+    if (total == 0):
+        return np.zeros(0, dtype=np.intp)
+    offsets = np.cumsum(lengths) - lengths
+    return np.repeat(start - offsets, lengths) + np.arange(total)
+
+
+class PackedRTree():
+    """Static R-tree over a set of bounding boxes, packed with the
+    Sort-Tile-Recursive (STR) algorithm.
+
+    Level 0 holds the item boxes in packed order.  Each node of a
+    higher level covers the contiguous range [start, end) of the
+    level below, and every level is STR ordered, so a query visits
+    only the nodes along the paths to the results.  NaN boxes (null
+    shapes) are kept but never match.
+    """
+
+    def __init__(self, node_size = 16):
+        self.node_size = node_size
+        self.item_ids = np.zeros(0, dtype=np.intp)
+        self.boxes = []
+        self.starts = []
+        self.ends = []
+
+    def get_class_name(self):
+        return type(self).__name__
+
+    def __len__(self):
+        return len(self.item_ids)
+
+    def str_order(self, boxes):
+        """Sort-Tile-Recursive order of the boxes.
+        Sort by x center into vertical slices of about
+        sqrt(number of nodes) nodes each, then by y center within
+        each slice.
+        Returns the permutation as an index array.
+        """
+        count = len(boxes)
+        if (count == 0):
+            return np.zeros(0, dtype=np.intp)
+        num_nodes = -(-count // self.node_size)
+        num_slices = max(1, int(np.ceil(np.sqrt(num_nodes))))
+        slice_size = self.node_size * int(-(-num_nodes // num_slices))
+        cx = np.nan_to_num(boxes[:, 0] + boxes[:, 2])
+        cy = np.nan_to_num(boxes[:, 1] + boxes[:, 3])
+        by_x = np.argsort(cx, kind="stable")
+        slice_id = np.empty(count, dtype=np.intp)
+        slice_id[by_x] = np.arange(count) // slice_size
+        return np.lexsort((cy, slice_id))
+
+    def build(self, bboxes):
+        """Pack the tree.
+        bboxes is an N x 4 array of [min_x, min_y, max_x, max_y] rows;
+        queries return row numbers.
+        """
+        bboxes = np.asarray(bboxes, dtype=np.float64).reshape(-1, 4)
+        order = self.str_order(bboxes)
+        self.item_ids = order
+        self.boxes = [bboxes[order]]
+        self.starts = [np.zeros(0, dtype=np.intp)]
+        self.ends = [np.zeros(0, dtype=np.intp)]
+        while (len(self.boxes[-1]) > 1):
+            below = self.boxes[-1]
+            # Group consecutive entries of the level below.
+            start = np.arange(0, len(below), self.node_size, dtype=np.intp)
+            end = np.minimum(start + self.node_size, len(below))
+            boxes = np.empty((len(start), 4))
+            with np.errstate(invalid="ignore"):
+                boxes[:, 0:2] = np.fmin.reduceat(below[:, 0:2], start, axis=0)
+                boxes[:, 2:4] = np.fmax.reduceat(below[:, 2:4], start, axis=0)
+            if (len(start) > 1):
+                # Reorder the new nodes; their children stay in place.
+                order = self.str_order(boxes)
+                boxes = boxes[order]
+                start = start[order]
+                end = end[order]
+            self.boxes.append(boxes)
+            self.starts.append(start)
+            self.ends.append(end)
+
+    def query(self, bbox):
+        """Find the items whose box overlaps bbox.
+        bbox is [min_x, min_y, max_x, max_y].
+        Returns a sorted array of item row numbers.
+        """
+        if (len(self.item_ids) == 0):
+            return np.zeros(0, dtype=np.intp)
+        top = len(self.boxes) - 1
+        nodes = np.arange(len(self.boxes[top]), dtype=np.intp)
+        for level in range(top, 0, -1):
+            hit = nodes[boxes_overlap(self.boxes[level][nodes], bbox)]
+            nodes = expand_ranges(self.starts[level][hit],
+                                  self.ends[level][hit])
+        hit = nodes[boxes_overlap(self.boxes[0][nodes], bbox)]
+        return np.sort(self.item_ids[hit])
+
+    def get_arrays(self, prefix):
+        """Get the tree as a dictionary of arrays for saving.
+        """
+        sizes = np.array([len(b) for b in self.boxes], dtype=np.intp)
+        return {prefix + "node_size": np.array(self.node_size),
+                prefix + "item_ids": self.item_ids,
+                prefix + "sizes": sizes,
+                prefix + "boxes": np.concatenate(self.boxes),
+                prefix + "starts": np.concatenate(self.starts),
+                prefix + "ends": np.concatenate(self.ends)}
+
+    def set_arrays(self, data, prefix):
+        """Restore the tree from arrays made by get_arrays.
+        """
+        self.node_size = int(data[prefix + "node_size"])
+        self.item_ids = data[prefix + "item_ids"]
+        sizes = data[prefix + "sizes"]
+        bounds = np.concatenate(([0], np.cumsum(sizes)))
+        # Level 0 has no children, so its start and end are empty.
+        link_bounds = np.concatenate(([0], np.cumsum(sizes[1:])))
+        boxes = data[prefix + "boxes"]
+        starts = data[prefix + "starts"]
+        ends = data[prefix + "ends"]
+        self.boxes = [boxes[bounds[i]:bounds[i + 1]]
+                      for i in range(len(sizes))]
+        self.starts = [np.zeros(0, dtype=np.intp)]
+        self.ends = [np.zeros(0, dtype=np.intp)]
+        for i in range(1, len(sizes)):
+            self.starts.append(starts[link_bounds[i - 1]:link_bounds[i]])
+            self.ends.append(ends[link_bounds[i - 1]:link_bounds[i]])
+
+
+class ShapefileIndex():
+    """Spatial index over the records and parts of a shapefile.
+    part_record and part_number give the record and the part within
+    the record of each indexed part.
+    """
+
+    INDEX_VERSION = 1
+    NODE_SIZE = 16
+
+    def __init__(self):
+        self.record_bboxes = np.zeros((0, 4))
+        self.part_bboxes = np.zeros((0, 4))
+        self.part_record = np.zeros(0, dtype=np.intp)
+        self.part_number = np.zeros(0, dtype=np.intp)
+        self.record_tree = PackedRTree(self.NODE_SIZE)
+        self.part_tree = PackedRTree(self.NODE_SIZE)
+
+    def get_class_name(self):
+        return type(self).__name__
+
+    def build(self, record_bboxes, part_bboxes, part_record, part_number):
+        self.record_bboxes = np.asarray(record_bboxes, dtype=np.float64)
+        self.part_bboxes = np.asarray(part_bboxes, dtype=np.float64)
+        self.part_record = np.asarray(part_record, dtype=np.intp)
+        self.part_number = np.asarray(part_number, dtype=np.intp)
+        self.record_tree.build(self.record_bboxes)
+        self.part_tree.build(self.part_bboxes)
+
+    def query_records(self, bbox):
+        """Find the records whose bounding box overlaps bbox.
+        Returns a sorted array of record numbers.
+        """
+        return self.record_tree.query(bbox)
+
+    def query_part_rows(self, bbox):
+        """Find the parts whose bounding box overlaps bbox.
+        Returns a sorted array of rows into the part arrays.
+        """
+        return self.part_tree.query(bbox)
+
+    def query_parts(self, bbox):
+        """Find the parts whose bounding box overlaps bbox.
+        Returns (record numbers, part numbers) arrays in file order.
+        """
+        hit = self.part_tree.query(bbox)
+        return (self.part_record[hit], self.part_number[hit])
+
+    def save(self, file_name, source_hash):
+        arrays = self.record_tree.get_arrays("record_")
+        arrays.update(self.part_tree.get_arrays("part_"))
+        shpcache.save_npz(file_name, dict(version=np.array(self.INDEX_VERSION),
+                                          source_hash=np.array(source_hash),
+                                          record_bboxes=self.record_bboxes,
+                                          part_bboxes=self.part_bboxes,
+                                          part_record=self.part_record,
+                                          part_number=self.part_number,
+                                          **arrays))
+
+    def load(self, file_name, source_hash):
+        """Load a saved index.
+        Returns False if the file is for another version or source.
+        """
+        with np.load(file_name) as data:
+            if (int(data["version"]) != self.INDEX_VERSION or
+                str(data["source_hash"]) != source_hash):
+                return False
+            self.record_bboxes = data["record_bboxes"]
+            self.part_bboxes = data["part_bboxes"]
+            self.part_record = data["part_record"]
+            self.part_number = data["part_number"]
+            self.record_tree.set_arrays(data, "record_")
+            self.part_tree.set_arrays(data, "part_")
+        return True
+
+
+def get_shapefile_index(source, collect_bboxes):
+    """Load the sidecar index of a shapefile, or build and save it
+    (see shpcache.load_or_build).  source is the .zip or .shp file.
+    collect_bboxes is called to build a new index and returns
+    (record bboxes, part bboxes, part record numbers, part numbers).
+    Returns a ShapefileIndex.
+    """
+    return shpcache.load_or_build(source, ".sidx.npz", ShapefileIndex,
+                                  collect_bboxes)
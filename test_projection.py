@@ -0,0 +1,35 @@
+import pytest
+import projection
+
+
+# Largest round trip error allowed, in degrees.  The closed form
+# inverses of Albers and VanDerGrinten lose more to rounding than the
+# others: Albers through asin near the poles, VanDerGrinten through
+# its cubic near the central meridian.
+ROUND_TRIP_TOLERANCES = [
+    (lambda: projection.Albers(45.5, 29.5, -96, 37.5), 5.0E-6),
+    (projection.EckertIV, 1.0E-9),
+    (projection.GallPeters, 1.0E-9),
+    (projection.Mollweide, 1.0E-9),
+    (projection.NaturalEarth, 1.0E-9),
+    (projection.NaturalEarth2, 1.0E-9),
+    (projection.Patterson, 1.0E-9),
+    (projection.Robinson, 1.0E-9),
+    (projection.VanDerGrinten, 2.0E-5),
+    (lambda: projection.Rect(3.1 / 180.0), 1.0E-9),
+    (projection.make_round_trip_compound, 1.0E-9),
+]
+
+
+@pytest.fixture(scope="module")
+def gcs_array():
+    return projection.make_round_trip_points()
+
+
+@pytest.mark.parametrize("make_proj, tolerance", ROUND_TRIP_TOLERANCES)
+def test_round_trip(gcs_array, make_proj, tolerance):
+    proj = make_proj()
+    assert proj.has_inverse()
+    err = projection.check_round_trip(proj, gcs_array)
+    assert err <= tolerance, "{} round trip error {:.3g} degrees".format(
+        proj.get_class_name(), err)
@@ -0,0 +1,334 @@
+import numpy as np
+import shpcache
+import simplify
+import lodpyramid
+from spatialindex import expand_ranges
+
+
+def simplify_arcs(simplifier, points, begin, end):
+    """Simplify arcs with a simplify.Simplifier.  The ends of every
+    arc are kept, so arcs shared by two rings still meet after
+    simplification; arcs that end where they begin are simplified as
+    rings.
+    Returns a boolean mask of the points to keep.
+    """
+    keep = np.zeros(len(points), dtype=bool)
+    closed = np.all(points[begin] == points[end - 1], axis=1)
+    for is_closed in (False, True):
+        select = (closed == is_closed)
+        if (not select.any()):
+            continue
+        idx = expand_ranges(begin[select], end[select])
+        count = end[select] - begin[select]
+        sub_begin = np.cumsum(count) - count
+        keep[idx] = simplifier.simplify_parts(points[idx], sub_begin,
+                                              sub_begin + count, is_closed)
+    return keep
+
+def join_arcs(arcs, refs):
+    """Join arcs into a ring or line.
+    arcs maps arc numbers to N x 2 arrays and refs holds the arc
+    numbers, ~arc for an arc used in reverse.  The point shared by
+    consecutive arcs is only used once.
+    Returns an N x 2 array.
+    """
+    pieces = []
+    for ref in refs:
+        if (ref >= 0):
+            points = arcs[ref]
+        else:
+            points = arcs[~ref][::-1]
+        pieces.append(points if (len(pieces) == 0) else points[1:])
+    if (len(pieces) == 0):
+        return np.zeros((0, 2))
+    return np.concatenate(pieces)
+
+
+class Topology():
+    """Arc topology of the parts of a shapefile, like TopoJSON.
+
+    Rings (or lines) are cut into arcs at junctions, the points
+    where the neighbors of a shared point differ, and every arc is
+    stored once.  Each part, in part table row order, is a list of
+    arc references: arc number, or ~arc for an arc used in reverse.
+    Borders shared by two polygons are one arc, so they can be
+    projected and simplified once and the neighbors still meet.
+
+    Like lodpyramid.LodPyramid, the arcs are also simplified in
+    degrees to TOLERANCES; a level keeps a subset of the arc points.
+    """
+
+    TOPOLOGY_VERSION = 1
+    TOLERANCES = lodpyramid.LodPyramid.TOLERANCES
+
+    def __init__(self):
+        self.tolerances = list(self.TOLERANCES)
+        self.arc_points = np.zeros((0, 2))
+        self.arc_offsets = np.zeros(1, dtype=np.int64)
+        self.part_arcs = np.zeros(0, dtype=np.int64)
+        self.part_offsets = np.zeros(1, dtype=np.int64)
+        self.level_keep = []
+
+    def get_class_name(self):
+        return type(self).__name__
+
+    def __len__(self):
+        return len(self.part_offsets) - 1
+
+    def get_num_arcs(self):
+        return len(self.arc_offsets) - 1
+
+    def build(self, points, begin, record, part, num_records, polygon):
+        """Build the arcs.
+        Takes the same arguments as parttable.PartTable.build.
+        """
+        begin = np.asarray(begin, dtype=np.intp)
+        end = np.append(begin[1:], len(points)).astype(np.intp)
+        if (len(begin) > 0):
+            self.__build_arcs(points, begin, end, polygon)
+        self.level_keep = []
+        for tolerance in self.tolerances:
+            simplifier = simplify.Simplifier(tolerance)
+            self.level_keep.append(simplify_arcs(simplifier, self.arc_points,
+                                                 self.arc_offsets[:-1],
+                                                 self.arc_offsets[1:]))
+
+    def __build_arcs(self, points, begin, end, polygon):
+        if (polygon):
+            # The closing point of a ring is the first point again.
+            closing = (np.all(points[begin] == points[end - 1], axis=1) &
+                       (end - begin > 1))
+            end = end - closing
+        count = end - begin
+        first = np.cumsum(count) - count
+        last = first + count - 1
+        # Number the distinct points; adding 0.0 turns -0.0 into 0.0.
+        vertices, vid = np.unique(points[expand_ranges(begin, end)] + 0.0,
+                                  axis=0, return_inverse=True)
+        vid = vid.reshape(-1)
+        # A point is a junction if it has different neighbors in
+        # different parts.  Lines wrap around here too, but their
+        # ends are junctions anyway.
+        nxt = np.arange(1, len(vid) + 1)
+        nxt[last] = first
+        prv = np.arange(-1, len(vid) - 1)
+        prv[first] = last
+        lo = np.minimum(vid[prv], vid[nxt])
+        hi = np.maximum(vid[prv], vid[nxt])
+        pairs = np.unique(np.column_stack((vid, lo, hi)), axis=0)
+        junction = np.bincount(pairs[:, 0], minlength=len(vertices)) > 1
+        if (not polygon):
+            junction[vid[first]] = True
+            junction[vid[last]] = True
+
+        arc_index = {}
+        arc_vids = []
+        part_arcs = []
+        part_offsets = [0]
+        for k in range(len(begin)):
+            seq = vid[first[k]:last[k] + 1]
+            for piece in self.__cut_part(seq, junction[seq], polygon):
+                key = piece.tobytes()
+                ref = arc_index.get(key)
+                if (ref == None):
+                    reverse = arc_index.get(piece[::-1].tobytes())
+                    if (reverse != None):
+                        ref = ~reverse
+                    else:
+                        ref = len(arc_vids)
+                        arc_index[key] = ref
+                        arc_vids.append(piece)
+                part_arcs.append(ref)
+            part_offsets.append(len(part_arcs))
+        arc_lengths = [len(piece) for piece in arc_vids]
+        self.arc_points = vertices[np.concatenate(arc_vids)]
+        self.arc_offsets = np.concatenate(([0], np.cumsum(arc_lengths)))
+        self.arc_offsets = self.arc_offsets.astype(np.int64)
+        self.part_arcs = np.array(part_arcs, dtype=np.int64)
+        self.part_offsets = np.array(part_offsets, dtype=np.int64)
+
+    def __cut_part(self, seq, is_junction, polygon):
+        """Cut the point numbers of one part at its junctions.
+        Returns a list of arrays of point numbers.
+        """
+        cuts = np.flatnonzero(is_junction)
+        if (not polygon):
+            return [seq[cuts[i]:cuts[i + 1] + 1] for i in range(len(cuts) - 1)]
+        if (len(cuts) == 0):
+            # A ring without junctions is one closed arc, starting at
+            # its lowest point number so the same ring always gives
+            # the same arc.
+            cuts = np.array([np.argmin(seq)])
+        ring = np.roll(seq, -cuts[0])
+        ring = np.append(ring, ring[0])
+        cuts = np.append(cuts - cuts[0], len(seq))
+        return [ring[cuts[i]:cuts[i + 1] + 1] for i in range(len(cuts) - 1)]
+
+    def choose_level(self, tolerance):
+        """Pick the coarsest level whose tolerance is within tolerance
+        (degrees).
+        Returns the level number, or None for full resolution.
+        """
+        return lodpyramid.choose_level(self.tolerances, tolerance)
+
+    def get_part_refs(self, row):
+        """Get the arc references of part table row row.
+        Returns an array of arc numbers, ~arc for reversed arcs.
+        """
+        return self.part_arcs[self.part_offsets[row]:self.part_offsets[row + 1]]
+
+    def get_arc_points(self, arc, level=None):
+        """Get the points of an arc, at a level or full resolution.
+        Returns an N x 2 array.
+        """
+        points = self.arc_points[self.arc_offsets[arc]:self.arc_offsets[arc + 1]]
+        if (level == None):
+            return points
+        keep = self.level_keep[level]
+        return points[keep[self.arc_offsets[arc]:self.arc_offsets[arc + 1]]]
+
+    def get_part_points(self, row, level=None):
+        """Join the arcs of part table row row.
+        Returns an N x 2 array in degrees.
+        """
+        refs = self.get_part_refs(row).tolist()
+        arcs = {}
+        for ref in refs:
+            arc = ref if (ref >= 0) else ~ref
+            arcs[arc] = self.get_arc_points(arc, level)
+        return join_arcs(arcs, refs)
+
+    def get_parts_points(self, rows, level=None):
+        """Join the arcs of many part table rows at once, the same
+        way get_part_points does for one row.
+        Returns (points, begin, end) in degrees, part i being
+        points[begin[i]:end[i]].
+        """
+        rows = np.asarray(rows, dtype=np.intp)
+        first = self.part_offsets[rows]
+        last = self.part_offsets[rows + 1]
+        refs = self.part_arcs[expand_ranges(first, last)]
+        arc = np.where(refs < 0, ~refs, refs)
+        points = self.arc_points
+        offsets = self.arc_offsets
+        if (level != None):
+            keep = self.level_keep[level]
+            points = points[keep]
+            offsets = np.concatenate(([0], np.cumsum(keep)))[offsets]
+        # Every arc but the first of a part starts with the last
+        # point of the arc before it, which is skipped.
+        num_refs = last - first
+        skip = np.ones(len(refs), dtype=np.intp)
+        skip[(np.cumsum(num_refs) - num_refs)[num_refs > 0]] = 0
+        arc_begin = offsets[arc]
+        arc_end = offsets[arc + 1]
+        count = np.maximum(arc_end - arc_begin - skip, 0)
+        k = expand_ranges(np.zeros(len(refs), dtype=np.intp), count)
+        skip = np.repeat(skip, count)
+        idx = np.where(np.repeat(refs < 0, count),
+                       np.repeat(arc_end - 1, count) - skip - k,
+                       np.repeat(arc_begin, count) + skip + k)
+        part = np.repeat(np.arange(len(rows)), num_refs)
+        num_points = np.bincount(part, weights=count,
+                                 minlength=len(rows)).astype(np.intp)
+        end = np.cumsum(num_points)
+        return (points[idx], end - num_points, end)
+
+    def save(self, file_name, source_hash):
+        levels = {}
+        for i in range(len(self.tolerances)):
+            levels["keep" + str(i)] = self.level_keep[i]
+        shpcache.save_npz(file_name,
+                          dict(version=np.array(self.TOPOLOGY_VERSION),
+                               source_hash=np.array(source_hash),
+                               tolerances=np.array(self.tolerances),
+                               arc_points=self.arc_points,
+                               arc_offsets=self.arc_offsets,
+                               part_arcs=self.part_arcs,
+                               part_offsets=self.part_offsets, **levels),
+                          compressed=True)
+
+    def load(self, file_name, source_hash):
+        """Load a saved topology.
+        Returns False if the file is for another version, source
+        or set of tolerances.
+        """
+        with np.load(file_name) as data:
+            if (int(data["version"]) != self.TOPOLOGY_VERSION or
+                str(data["source_hash"]) != source_hash or
+                data["tolerances"].tolist() != self.tolerances):
+                return False
+            self.arc_points = data["arc_points"]
+            self.arc_offsets = data["arc_offsets"]
+            self.part_arcs = data["part_arcs"]
+            self.part_offsets = data["part_offsets"]
+            self.level_keep = [data["keep" + str(i)]
+                               for i in range(len(self.tolerances))]
+        return True
+
+
+class ProjectedArcs():
+    """A set of arcs of a Topology projected, and optionally
+    simplified, once for a map; parts are then joined from them.
+    """
+
+    def __init__(self, topology, arcs, proj, level = None, simplifier = None,
+                 densifier = None):
+        """Project arcs (arc numbers) with proj, reading them at an
+        LOD level or at full resolution, densify them where the
+        projection curves them with densifier (a densify.Densifier)
+        and simplify them in map coordinates with simplifier if
+        given.
+        """
+        arcs = np.unique(np.asarray(arcs, dtype=np.int64))
+        self.arcs = {}
+        self.num_points = 0
+        if (len(arcs) == 0):
+            return
+        begin = topology.arc_offsets[arcs]
+        end = topology.arc_offsets[arcs + 1]
+        idx = expand_ranges(begin, end)
+        arc_of = np.repeat(np.arange(len(arcs)), end - begin)
+        if (level != None):
+            keep = topology.level_keep[level][idx]
+            idx = idx[keep]
+            arc_of = arc_of[keep]
+        if (densifier != None):
+            count = np.bincount(arc_of, minlength=len(arcs))
+            sub_end = np.cumsum(count)
+            pcs_array, sub_begin, sub_end = densifier.project_parts(
+                proj, topology.arc_points[idx], sub_end - count, sub_end)
+            arc_of = np.repeat(np.arange(len(arcs)), sub_end - sub_begin)
+        else:
+            pcs_array = proj.project_array(topology.arc_points[idx])
+        if (simplifier != None):
+            count = np.bincount(arc_of, minlength=len(arcs))
+            sub_end = np.cumsum(count)
+            keep = simplify_arcs(simplifier, pcs_array, sub_end - count, sub_end)
+            pcs_array = pcs_array[keep]
+            arc_of = arc_of[keep]
+        self.num_points = len(pcs_array)
+        count = np.bincount(arc_of, minlength=len(arcs))
+        pieces = np.split(pcs_array, np.cumsum(count)[:-1])
+        self.arcs = dict(zip(arcs.tolist(), pieces))
+
+    def get_class_name(self):
+        return type(self).__name__
+
+    def get_part(self, refs):
+        """Join projected arcs into a part.
+        refs are arc references as in Topology.get_part_refs.
+        Returns an N x 2 array in map coordinates.
+        """
+        return join_arcs(self.arcs, np.asarray(refs).tolist())
+
+
+def get_topology(source, collect_parts):
+    """Load the arc topology of a shapefile, or build and save it
+    (see shpcache.load_or_build).  source is the .zip or .shp file.
+    collect_parts is called to build a new topology and returns the
+    Topology.build arguments.
+    Returns a Topology.
+    """
+    return shpcache.load_or_build(source, ".topo.npz", Topology,
+                                  collect_parts)
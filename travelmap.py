@@ -1,17 +1,25 @@
 import sys
+import os
+import time
+import contextlib
 import shapefile
 import shpreader
+import shpcache
+import dbfcolumns
 import projection
+import simplify
+import clip
+import densify
+import geocache
+import featuretable
+import spatialindex
+import antimeridian
+import topology
 import mapimage
-import math
-import copy
+import numpy as np
 import pprint
 
 
-DEG_TO_RAD = math.pi / 180.0
-AREA_SPHERE = 4.0 * math.pi * 1 * 1
-
-
 class TmBaseError(Exception):
     """Base TravelMap exception.
     """
@@ -33,8 +41,44 @@ class TmUnknownPlotTypeError(TmBaseError):
 
 class AnyMap():
     """Base class for all maps.
+    Set NATIVE_READER to True to read shapes with shpreader's
+    memory mapped array decoder instead of pyshp.
+    Lines and polygons are simplified after projection with
+    SIMPLIFY_METHOD (None to disable) to SIMPLIFY_PIXELS pixels of
+    the output image; with REPORT_VERTICES the vertex counts are
+    written to stderr for each layer.  Layers that support it read
+    pre-simplified geometry from the shapefile's LOD pyramid when
+    USE_LOD is set, and then skip the per-render simplification.
+    Polygon layers that support it are drawn from the arc topology
+    of the shapefile when USE_TOPOLOGY is set, so borders shared by
+    two polygons are projected and simplified once.  With
+    MERGE_PATHS the shapes of the layer are written as a few merged
+    paths instead of an element per shape.  With CLIP_TO_VIEW
+    projected lines and polygons are culled and clipped to the part
+    of the map shown in the image, plus CLIP_MARGIN_PIXELS pixels so
+    the edges made by clipping stay out of sight.  With
+    SPLIT_ANTIMERIDIAN shapes are cut at the antimeridian of the
+    central meridian of the projection before projecting.  Edges
+    that the projection bends by more than DENSIFY_PIXELS pixels
+    (None to disable) get points added where they curve.  With
+    USE_GEOMETRY_CACHE the drawn geometry is kept in the geometry
+    cache, so drawing the layer again with the same projection,
+    view and settings skips reading and projecting.
     """
 
+    NATIVE_READER = False
+    SIMPLIFY_METHOD = "douglas-peucker"
+    SIMPLIFY_PIXELS = 0.5
+    REPORT_VERTICES = False
+    USE_LOD = True
+    USE_TOPOLOGY = True
+    MERGE_PATHS = False
+    CLIP_TO_VIEW = True
+    CLIP_MARGIN_PIXELS = 10
+    SPLIT_ANTIMERIDIAN = True
+    DENSIFY_PIXELS = 0.5
+    USE_GEOMETRY_CACHE = True
+
     def __init__(self, shfile):
         self.shape_file = shfile
         self.sfr = self.get_shape_reader(self.shape_file)
@@ -44,7 +88,12 @@ class AnyMap():
         self.map_attr.set_default_attr()
 
     def get_shape_reader(self, shfile):
-        sfr = shpreader.ShpReader(shfile)
+        """Get the shared reader for the shape file.
+        """
+        if (self.NATIVE_READER):
+            sfr = shpcache.get_reader(shfile, shpreader.ShpArrayReader)
+        else:
+            sfr = shpcache.get_reader(shfile, shpreader.ShpReader)
         return sfr
 
     def get_class_name(self):
@@ -64,80 +113,60 @@ class AnyMap():
         """
         return None
 
-    def update_shape_map_attr(self, shrec, map_attr):
-        """Update the shape MapAttr based on properties of the shape.
+    def update_shape_map_attr(self, table, row, map_attr):
+        """Update the shape MapAttr based on properties of the shape,
+        record row of a featuretable.FeatureTable.
         """
 
-    def bbox_area_estimate(self, shrec):
-        """Estimate the area of the bounding box.
-        Works well for small areas.
-        Return as a percent of the whole earth.
-        
-        With coordinates in radians, at the equator, the area of a small
-        bounding box is approximately dx * dy since sin(dx) ~= dx.  As
-        the box moves towards the poles, the width (difference between
-        longitude values) decreases with the cosine of the latitude, so
-        that must be added to the equation.  Finally, the area of a
-        sphere is 4*pi*r^2.
-        """
-        # shapefile returns all data in degrees
-        #
-        dx = (shrec.shape.bbox[2] - shrec.shape.bbox[0]) * DEG_TO_RAD
-        dy = (shrec.shape.bbox[3] - shrec.shape.bbox[1]) * DEG_TO_RAD
-        # Select one value for the latitude.
-        lat_adj = math.cos(shrec.shape.bbox[1] * DEG_TO_RAD)
-        # Area estimate
-        area = dx * dy * lat_adj
-        # Percent
-        percent = area / AREA_SPHERE
-        return percent
-
-    def shape_in_bounding_box(self, shrec, bound):
-        """Determine if the bounding box of a shape lies
-        entirely inside the provided bounding box.
-        Bounding box is [min_x, min_y, max_x, max_y].
-        Returns True or False
-        """
-        if (shrec.shape.bbox[0] >= bound[0] and
-            shrec.shape.bbox[1] >= bound[1] and
-            shrec.shape.bbox[2] <= bound[2] and
-            shrec.shape.bbox[3] <= bound[3]):
-            return True
-        else:
-            return False
-        
-    def shape_includes_naukan(self, shrec):
-        """Specify if the shape includes Naukan in eastern Russia.
-        Bounding box is [min_x, min_y, max_x, max_y].
+    def get_record_filter(self):
+        """Get the attribute predicates selecting the records to draw.
+        They are evaluated on the .dbf columns before any geometry
+        is read.
+        Returns a list of dbfcolumns.FieldPredicate (empty for all).
         """
-        bound = [-180.1, +64.0, -169.6, 89.0]
-        return self.shape_in_bounding_box(shrec, bound)
+        return []
 
-    def shape_includes_antarctica(self, shrec):
-        """Specify if the shape includes Antarctica.
+    def get_lod_tolerance(self, proj, mimg, bbox):
+        """Get the simplification tolerance in degrees that keeps the
+        projected map within SIMPLIFY_PIXELS pixels of the map image
+        over bbox (the whole world if None).
         """
-        bound = [ -180.1, -90.0, +180.1, -60.0]
-        return self.shape_in_bounding_box(shrec, bound)
+        tolerance = self.SIMPLIFY_PIXELS * mimg.get_pixel_size()
+        return tolerance / proj.estimate_scale(bbox)
 
-    def move_naukan(self, shrec):
-        """Move Naukan to the other side of the world.
+    def get_lod_source(self):
+        """Get the levels of detail the layer is drawn from.
+        Returns a lodpyramid.LodPyramid or topology.Topology, or None.
         """
-        lon_incr = 360.0
-        new_points = []
-        for coord in shrec.shape.points:
-            new_coord = (coord[0] + lon_incr, coord[1])
-            new_points.append(new_coord)
-        shrec.shape.points = new_points
+        return None
 
-    def use_shape(self, shrec):
-        """Specify if this shape should be used in the map.
+    def get_lod_level(self, proj, mimg, bbox):
+        """Get the level of detail to draw from.
+        Returns the LOD pyramid level, or None for full resolution.
         """
-        return True
+        return None
 
-    def transform_shape(self, shrec):
-        """Transform a shape before using in a map.
+    def use_arcs(self):
+        """Specify if the layer is drawn from the arc topology.
         """
-        pass
+        return False
+
+    def use_records(self, table):
+        """Specify which records of the table read for the map (a
+        featuretable.FeatureTable in degrees) are used in the map.
+        Returns a boolean array or array of table rows, or None for
+        all records.
+        """
+        return None
+
+    def transform_table(self, table):
+        """Transform the table read for the map (a
+        featuretable.FeatureTable in degrees) before it is cut at the
+        seam and projected.  Layers drawn from arcs only use the arcs
+        if the points of the table are returned unchanged.
+        Returns a FeatureTable.
+        """
+        return table
 
     def get_draw_function(self, mimg):
         """Get the draw function from the mapimage based
@@ -154,24 +183,243 @@ class AnyMap():
             raise TmKnownPlotType("get_draw_function", self.plot_type)
         return draw_function
 
-    def draw(self, proj, mimg, fields=None, bbox=None):
-        """Draw the map
+    def get_simplifier(self, mimg):
+        """Get the simplifier for projected shapes, with a tolerance
+        of SIMPLIFY_PIXELS pixels of the map image.
+        Returns a simplify.Simplifier, or None for no simplification.
+        """
+        if (self.SIMPLIFY_METHOD == None or
+            self.plot_type == shapefile.POINT):
+            return None
+        tolerance = self.SIMPLIFY_PIXELS * mimg.get_pixel_size()
+        return simplify.Simplifier(tolerance, self.SIMPLIFY_METHOD)
+
+    def get_clipper(self, mimg):
+        """Get the clipper for projected shapes, clipping to the map
+        shown in the image.
+        Returns a clip.Clipper, or None for no clipping.
+        """
+        if (self.CLIP_TO_VIEW == False or
+            self.plot_type == shapefile.POINT):
+            return None
+        return clip.Clipper(mimg.get_map_bbox(self.CLIP_MARGIN_PIXELS))
+
+    def get_antimeridian(self, proj):
+        """Get the stage cutting shapes at the antimeridian of the
+        central meridian of proj.
+        Returns an antimeridian.Antimeridian, or None.
+        """
+        if (self.SPLIT_ANTIMERIDIAN == False):
+            return None
+        return antimeridian.Antimeridian(proj.get_central_meridian())
+
+    def get_densifier(self, mimg):
+        """Get the densifier for projecting lines and polygons, with a
+        tolerance of DENSIFY_PIXELS pixels of the map image.
+        Returns a densify.Densifier, or None to project the points
+        as they are.
+        """
+        if (self.DENSIFY_PIXELS == None or
+            self.plot_type == shapefile.POINT):
+            return None
+        return densify.Densifier(self.DENSIFY_PIXELS * mimg.get_pixel_size())
+
+    def read_feature_table(self, fields, bbox, lod_level):
+        """Read the records to draw from the shape reader into a
+        featuretable.FeatureTable in degrees, with the .dbf fields
+        in fields as columns.
+        """
+        return self.sfr.get_feature_table(fields, bbox,
+                                          self.get_record_filter(), None,
+                                          lod_level)
+
+    def read_arc_table(self, fields, bbox, lod_level):
+        """Read the parts to draw, joined from the arcs of the
+        topology, into a featuretable.FeatureTable in degrees with
+        one row per part, with the .dbf fields in fields as columns.
+        Returns (FeatureTable, array of the part table row of each
+        table row).
+        """
+        return self.sfr.get_arc_table(fields, bbox, self.get_record_filter(),
+                                      None, lod_level)
+
+    def split_table(self, table, seam):
+        """Cut the lines and polygons of a table in degrees at the
+        seam of the map (an antimeridian.Antimeridian), and move
+        points to the map side of the seam.
+        Returns a FeatureTable.
+        """
+        if (seam == None):
+            return table
+        if (self.plot_type == shapefile.POINT):
+            return table.with_points(seam.wrap_points(table.points))
+        return seam.split_table(table, self.plot_type == shapefile.POLYGON)
+
+    def project_table(self, proj, table, densifier):
+        """Project all points of a table at once, densified by
+        densifier if given.
+        Returns a FeatureTable in map coordinates.
+        """
+        if (densifier != None):
+            return densifier.project_table(proj, table)
+        return proj.project_table(table)
+
+    def project_arcs(self, proj, part_rows, lod_level, simplifier,
+                     densifier):
+        """Project, densify and simplify (with densifier and
+        simplifier, if given) the arcs of the part table rows
+        part_rows at once.
+        Returns a topology.ProjectedArcs.
+        """
+        topo = self.sfr.get_topology()
+        refs = topo.part_arcs[spatialindex.expand_ranges(
+            topo.part_offsets[part_rows], topo.part_offsets[part_rows + 1])]
+        arcs = np.where(refs < 0, ~refs, refs)
+        return topology.ProjectedArcs(topo, arcs, proj, lod_level, simplifier,
+                                      densifier)
+
+    def get_geometry_key(self, proj, mimg, bbox):
+        """Get the key of the layer geometry in the geometry cache:
+        the shapefile checksum, the layer class, projection, record
+        filter, area threshold, bbox, view and the settings of every
+        drawing stage.
+        Returns a tuple, or None if the layer is not cached; layers
+        with per-shape attributes are not.
+        """
+        if (self.USE_GEOMETRY_CACHE == False or
+            self.get_shape_map_attr() != None):
+            return None
+        source = shpreader.index_source(self.shape_file)
+        filters = [pred.get_cache_key() for pred in self.get_record_filter()]
+        settings = (self.SIMPLIFY_METHOD, self.SIMPLIFY_PIXELS, self.USE_LOD,
+                    self.USE_TOPOLOGY, self.CLIP_TO_VIEW,
+                    self.CLIP_MARGIN_PIXELS, self.SPLIT_ANTIMERIDIAN,
+                    self.DENSIFY_PIXELS)
+        return (shpcache.get_cache().get_checksum(source),
+                self.get_class_name(), self.plot_type, proj.get_cache_key(),
+                tuple(filters), getattr(self, "area_threshold", None),
+                None if (bbox == None) else tuple(bbox), settings,
+                tuple(mimg.get_view_box()), tuple(mimg.get_image_size()))
+
+    def draw_table(self, mimg, table, attr = None):
+        """Draw all parts of a table in map coordinates.
         """
-        shape_attr = self.get_shape_map_attr()
         draw_function = self.get_draw_function(mimg)
+        if (self.plot_type == shapefile.POINT):
+            for i in range(table.get_num_parts()):
+                draw_function(table.get_part(i), attr)
+        else:
+            mimg.add_feature_table(table, self.plot_type == shapefile.POLYGON,
+                                   attr)
 
-        mimg.add_group(self.get_group_id(), self.map_attr)
-
-        for shrec in self.sfr.iterShapeRecords(fields, bbox):
-            if (self.use_shape(shrec) == False):
-                continue
-            self.transform_shape(shrec)
+    def draw_cached(self, mimg, points, offsets):
+        """Draw the shapes stored in the geometry cache.
+        """
+        mimg.add_group(self.get_group_id(), self.map_attr, self.MERGE_PATHS)
+        table = featuretable.FeatureTable(self.plot_type, points, offsets,
+                                          [0, len(offsets) - 1])
+        self.draw_table(mimg, table)
+        if (self.REPORT_VERTICES and self.plot_type != shapefile.POINT):
+            print("{}: {} vertices from the geometry cache".format(
+                self.get_class_name(), len(points)), file=sys.stderr)
 
-            #pprint.pprint(vars(shrec.record))
-            #pprint.pprint(vars(shrec.shape))
-            pcs_points = proj.project_points(shrec.shape.points)
-            self.update_shape_map_attr(shrec, shape_attr)
-            draw_function(pcs_points, shape_attr)
+    def draw(self, proj, mimg, fields=None, bbox=None):
+        """Draw the map.  The layer is read into a
+        featuretable.FeatureTable, filtered by use_records, transformed
+        by transform_table, cut at the seam and projected as a whole.
+        Layers drawn from arcs read one row per part, and the parts
+        the seam leaves alone are drawn from their projected arcs.
+        """
+        cache_key = self.get_geometry_key(proj, mimg, bbox)
+        if (cache_key != None):
+            cached = geocache.get_geometry_cache().get(cache_key)
+            if (cached != None):
+                return self.draw_cached(mimg, *cached)
+        shape_attr = self.get_shape_map_attr()
+        draw_function = self.get_draw_function(mimg)
+        lod_level = self.get_lod_level(proj, mimg, bbox)
+        simplifier = None
+        if (lod_level == None):
+            simplifier = self.get_simplifier(mimg)
+        clipper = self.get_clipper(mimg)
+        seam = self.get_antimeridian(proj)
+        densifier = self.get_densifier(mimg)
+        closed = (self.plot_type == shapefile.POLYGON)
+
+        mimg.add_group(self.get_group_id(), self.map_attr, self.MERGE_PATHS)
+
+        # The attribute columns are only used for per-shape attributes.
+        columns = fields if (shape_attr != None) else []
+        part_rows = None
+        if (self.use_arcs()):
+            table, part_rows = self.read_arc_table(columns, bbox, lod_level)
+        else:
+            table = self.read_feature_table(columns, bbox, lod_level)
+        use = self.use_records(table)
+        if (use is not None):
+            table = table.select(use)
+            if (part_rows is not None):
+                part_rows = part_rows[use]
+        transformed = self.transform_table(table)
+        arcs = None
+        on_arcs = None
+        if (part_rows is not None and transformed.points is table.points):
+            # Parts cut or moved at the seam no longer match the
+            # shared arcs, so they are projected on their own.  A
+            # row holds one part.
+            on_arcs = np.ones(len(table), dtype=bool)
+            if (seam != None):
+                on_arcs = ~seam.find_outside_parts(table)
+            arcs = self.project_arcs(proj, part_rows[on_arcs], lod_level,
+                                     simplifier, densifier)
+            transformed = transformed.select_parts(~on_arcs)
+        projected = self.project_table(proj,
+                                       self.split_table(transformed, seam),
+                                       densifier)
+
+        if (simplifier != None):
+            projected = simplifier.simplify_table(projected, closed)
+        if (arcs != None):
+            rows = np.flatnonzero(on_arcs)
+            topo = self.sfr.get_topology()
+            arc_parts = [arcs.get_part(topo.get_part_refs(part_rows[row]))
+                         for row in rows.tolist()]
+            projected = featuretable.merge_parts(
+                projected, featuretable.table_from_parts(
+                    self.plot_type, arc_parts, rows, len(projected)))
+        if (clipper != None):
+            projected = clipper.clip_table(projected, closed)
+
+        num_vertices = len(projected.points)
+        for row in range(len(projected)):
+            self.update_shape_map_attr(projected, row, shape_attr)
+            for piece in projected.get_parts(row):
+                draw_function(piece, shape_attr)
+
+        if (cache_key != None):
+            geocache.get_geometry_cache().put(cache_key, projected.points,
+                                              projected.part_offsets)
+
+        if (self.REPORT_VERTICES and self.plot_type != shapefile.POINT):
+            if (simplifier != None):
+                report = str(simplifier)
+            elif (lod_level != None):
+                report = "LOD level {} ({} degrees), {} vertices".format(
+                    lod_level, self.get_lod_source().tolerances[lod_level],
+                    num_vertices)
+            else:
+                report = str(num_vertices) + " vertices"
+            if (arcs != None):
+                report += ", {} arc vertices projected for {} drawn".format(
+                    arcs.num_points, num_vertices)
+            if (clipper != None):
+                report += ", " + str(clipper)
+            if (seam != None and seam.parts_moved + seam.parts_split > 0):
+                report += ", seam: " + str(seam)
+            if (densifier != None and
+                densifier.points_out > densifier.points_in):
+                report += ", " + str(densifier)
+            print(self.get_class_name() + ": " + report, file=sys.stderr)
 
     def print(self):
         self.mimg.print()
@@ -179,34 +427,61 @@ class AnyMap():
 
 class StdWorld(AnyMap):
 
+    MERGE_PATHS = True
+
     def __init__(self, shfile):
         super().__init__(shfile)
         self.area_threshold = 3.0E-6
 
     def get_shape_reader(self, shfile):
-        sfr = shpreader.ShpPartReader(shfile)
+        """Get the shared part reader for the shape file.
+        """
+        if (self.NATIVE_READER):
+            sfr = shpcache.get_reader(shfile, shpreader.ShpArrayPartReader)
+        else:
+            sfr = shpcache.get_reader(shfile, shpreader.ShpPartReader)
         return sfr
 
-    def use_shape(self, shrec):
+    def use_arcs(self):
+        """Polygons are drawn from the arc topology with USE_TOPOLOGY.
         """
-        if (shrec.shape.bbox[3] < 0):
-            return False
-        if (shrec.shape.bbox[0] > -160):
-            return False
-        if (self.shape_includes_antarctica(shrec)):
-            return False
-        """
-
-        area = self.bbox_area_estimate(shrec)
-        if (area < self.area_threshold):
-            return False
-        return True
+        return (self.USE_TOPOLOGY and self.plot_type == shapefile.POLYGON)
 
-    def transform_shape(self, shrec):
-        """Transform a shape before using in a map.
+    def get_lod_source(self):
+        """Get the levels of detail: the arcs of the topology for
+        layers drawn from arcs, the LOD pyramid otherwise.
+        """
+        if (self.use_arcs()):
+            return self.sfr.get_topology()
+        return self.sfr.get_lod_pyramid()
+
+    def get_lod_level(self, proj, mimg, bbox):
+        """Pick the coarsest level of detail that still meets the
+        pixel tolerance of the map image.
+        Returns the level, or None for full resolution.
         """
-        if (self.shape_includes_naukan(shrec)):
-            self.move_naukan(shrec)
+        if (self.USE_LOD == False):
+            return None
+        tolerance = self.get_lod_tolerance(proj, mimg, bbox)
+        return self.get_lod_source().choose_level(tolerance)
+
+    def read_feature_table(self, fields, bbox, lod_level):
+        """Read the parts to draw into a featuretable.FeatureTable.
+        Parts smaller than area_threshold (a fraction of the whole
+        earth; spherical area for polygons, bbox area for lines) are
+        dropped with one mask over the reader's part table.
+        """
+        return self.sfr.get_feature_table(fields, bbox,
+                                          self.get_record_filter(),
+                                          self.area_threshold, lod_level)
+
+    def read_arc_table(self, fields, bbox, lod_level):
+        """Read the parts to draw from the arcs of the topology,
+        dropping parts smaller than area_threshold as
+        read_feature_table does.
+        """
+        return self.sfr.get_arc_table(fields, bbox, self.get_record_filter(),
+                                      self.area_threshold, lod_level)
 
 '''
 class CoastSmall(StdWorld):
@@ -259,6 +534,10 @@ class BoundaryLinesMed(StdWorld):
 
 
 class StdPlace(AnyMap):
+    """Places drawn as circles in bulk.
+    """
+
+    MERGE_PATHS = True
 
     def __init__(self, shfile):
         super().__init__(shfile)
@@ -271,13 +550,47 @@ class StdPlace(AnyMap):
         self.map_attr.line_width = "0"
         self.map_attr.area_fill = color
 
-    def use_shape(self, shrec):
+    def get_record_filter(self):
+        """Select places up to the maximum scale rank.
+        """
+        return [dbfcolumns.FieldRange('scalerank', hi=self.max_scale_rank)]
+
+    def get_symbol_classes(self, records):
+        """Get the symbol size class of each place.
+        records is an array of record numbers.
+        Returns (array of size classes, list of the radius of each
+        class).
         """
+        return (np.zeros(len(records), dtype=np.intp), [self.map_attr.radius])
+
+    def draw(self, proj, mimg, fields=None, bbox=None):
+        """Draw the places in bulk.  The points are read from the
+        part table and the sizes from the .dbf columns, so no shape
+        or record is decoded one at a time, and all points are
+        projected at once.  With CLIP_TO_VIEW the places outside the
+        map shown in the image are dropped.
         """
-        #print(shrec.record['scalerank'])
-        if (shrec.record['scalerank'] > self.max_scale_rank):
-            return False
-        return True
+        if (self.sfr.shapeType != shapefile.POINT):
+            return super().draw(proj, mimg, fields, bbox)
+        rows = shpreader.select_part_rows(self.sfr, bbox,
+                                          self.get_record_filter())
+        table = self.sfr.get_part_table()
+        classes, radii = self.get_symbol_classes(table.record[rows])
+        gcs_array = table.centroid[rows]
+        seam = self.get_antimeridian(proj)
+        if (seam != None):
+            gcs_array = seam.wrap_points(gcs_array)
+        pcs_array = proj.project_array(gcs_array)
+        if (self.CLIP_TO_VIEW):
+            view = mimg.get_map_bbox(self.CLIP_MARGIN_PIXELS)
+            inside = ((pcs_array[:, 0] >= view[0]) &
+                      (pcs_array[:, 0] <= view[2]) &
+                      (pcs_array[:, 1] >= view[1]) &
+                      (pcs_array[:, 1] <= view[3]))
+            pcs_array = pcs_array[inside]
+            classes = classes[inside]
+        mimg.add_group(self.get_group_id(), self.map_attr, self.MERGE_PATHS)
+        mimg.add_symbols(pcs_array, classes, radii)
 
 
 class PopulatedPlacesMed(StdPlace):
@@ -289,21 +602,17 @@ class PopulatedPlacesMed(StdPlace):
         #
         self.ref_size = 0.25
 
-    def get_shape_map_attr(self):
-        """Get the MapAttr to be used for drawing map shapes.
-        """
-        shape_attr = copy.deepcopy(self.map_attr)
-        return shape_attr
-
-    def update_shape_map_attr(self, shrec, map_attr):
-        """Update the shape MapAttr based on properties of the shape.
-        Calculate a percent base on the maximum scale rank.
+    def get_symbol_classes(self, records):
+        """Size the places by scale rank: size class k holds scale
+        rank k and has a radius of ref_size * (11 - k) / 11 percent.
         In ne_50m_populated_places_simple, the max scale rank is 10.
         """
         rscale = 11
-        percent = (rscale - shrec.record['scalerank']) / rscale
-        city_size = self.ref_size * percent
-        map_attr.radius = str(city_size) + "%"
+        ranks = self.sfr.get_dbf_columns().get_column('scalerank')[records]
+        classes = np.clip(np.nan_to_num(ranks), 0, rscale - 1).astype(np.intp)
+        radii = [str(self.ref_size * (rscale - k) / rscale) + "%"
+                 for k in range(rscale)]
+        return (classes, radii)
 
 
 
@@ -316,18 +625,17 @@ class UsaMap(StdWorld):
         self.area_threshold = 0
         self.map_bbox = [-168, 18, 44, 71]
 
-    def use_shape(self, shrec):
-        """
+    def get_record_filter(self):
+        """Select the USA records.
         """
-        if (shrec.record['ADM0_A3'] != "USA"):
-            return False
-        return super().use_shape(shrec)
+        return [dbfcolumns.FieldEquals('ADM0_A3', "USA")]
 
     def draw(self, proj, mimg):
         """Draw the map
         """
-        # The bbox argument looks suspect; not sure how a bounding
-        # box around USA returns anything in Africa or ASIA...
+        # Only parts overlapping map_bbox are read, found with the
+        # shapefile's spatial index.  map_bbox reaches 44 E, which is
+        # why shapes in Africa and Asia overlap it.
         super().draw(proj, mimg, None, self.map_bbox)
 
 
@@ -347,17 +655,31 @@ class UsaCountriesLakes(UsaMap):
 
 
 class ConusCountriesLakes(UsaCountriesLakes):
+    """The lower 48 states.  Alaska and Hawaii are outside the view
+    box set by get_view_box, so their parts are culled after
+    projection, and parts crossing the edge of the view are clipped.
+    """
+
+    # Longitude and latitude range of the lower 48 states.
+    CONUS_BBOX = [-125.0, 24.5, -66.9, 49.4]
 
     def __init__(self):
         super().__init__()
         self.map_bbox = [-127, 18, 44, 50]
 
-    def use_shape(self, shrec):
-        """
+    def get_view_box(self, proj):
+        """Get the view box holding the lower 48 states in proj.
+        The edges of the range are projected, as they may bulge.
+        Returns the view box (min_x, min_y, width, height).
         """
-        if (self.shape_in_bounding_box(shrec, self.map_bbox) == False):
-            return False
-        return super().use_shape(shrec)
+        lon0, lat0, lon1, lat1 = self.CONUS_BBOX
+        t = np.linspace(0.0, 1.0, 33)
+        lon = np.concatenate((lon0 + t * (lon1 - lon0), np.full(33, lon1),
+                              lon1 - t * (lon1 - lon0), np.full(33, lon0)))
+        lat = np.concatenate((np.full(33, lat0), lat0 + t * (lat1 - lat0),
+                              np.full(33, lat1), lat1 - t * (lat1 - lat0)))
+        edges = proj.project_array(np.column_stack((lon, lat)))
+        return mapimage.fit_view_box(edges)
 
 
 class TravelMap():
@@ -394,15 +716,20 @@ class TravelMap():
         wm.draw(full_proj, mimg)
         mimg.print()
 
-    def create_world(self):
-        """Create a standard World Map
+    def example_approximate(self):
+        """Example of an interpolated projection, accurate to
+        a quarter of a pixel.
         """
-        # TODO - How do I set the projection?
-        
-        #proj = projection.NaturalEarth2()
-        proj = projection.Rect(3.1 / 180.0, 3.1 / 180.0 )
         mimg = mapimage.SvgImage()
+        proj = projection.Approximate(projection.VanDerGrinten(),
+                                      0.25 * mimg.get_pixel_size())
+        wm = CountriesLakesMed();
+        wm.draw(proj, mimg)
+        mimg.print()
 
+    def draw_world(self, proj, mimg):
+        """Draw the layers of the standard World Map.
+        """
         wm = CountriesLakesMed()
         wm.set_map_color("brown")
         wm.draw(proj, mimg)
@@ -415,6 +742,50 @@ class TravelMap():
         wm.set_map_color("yellow")
         wm.draw(proj, mimg)
 
+    def example_compact_output(self, out_dir = ".", quantum = 0.1):
+        """Write the World Map with each SVG backend, to compare
+        output size and write time (printed to stderr); open the
+        files in a browser to compare parse and render times.
+        The compact file is quantized to quantum pixels.
+        """
+        proj = projection.NaturalEarth2()
+        outputs = (("tree", lambda f: mapimage.SvgImage()),
+                   ("stream", lambda f: mapimage.SvgStreamImage(f)),
+                   ("compact", lambda f: mapimage.SvgStreamImage(f, quantum)))
+        for name, make_image in outputs:
+            file_name = os.path.join(out_dir, "world_" + name + ".svg")
+            start = time.perf_counter()
+            with open(file_name, "w") as f:
+                mimg = make_image(f)
+                self.draw_world(proj, mimg)
+                with contextlib.redirect_stdout(f):
+                    mimg.print()
+            seconds = time.perf_counter() - start
+            print("{}: {} bytes in {:.3f} s".format(
+                file_name, os.path.getsize(file_name), seconds),
+                  file=sys.stderr)
+
+    def example_thumbnail(self, file_name = "world.png", supersample = 2):
+        """Write the World Map as a PNG thumbnail, without any SVG
+        renderer.  The write time is printed to stderr.
+        """
+        start = time.perf_counter()
+        mimg = mapimage.PngImage(file_name, supersample)
+        self.draw_world(projection.NaturalEarth2(), mimg)
+        mimg.print()
+        print("{}: {} bytes in {:.3f} s".format(
+            file_name, os.path.getsize(file_name),
+            time.perf_counter() - start), file=sys.stderr)
+
+    def create_world(self):
+        """Create a standard World Map
+        """
+        # TODO - How do I set the projection?
+        
+        #proj = projection.NaturalEarth2()
+        proj = projection.Rect(3.1 / 180.0, 3.1 / 180.0 )
+        mimg = mapimage.SvgStreamImage()
+        self.draw_world(proj, mimg)
         mimg.print()
 
     def create_usa(self):
@@ -422,9 +793,10 @@ class TravelMap():
         """
 
         # CONUS
-        mimg = mapimage.SvgImage()
+        mimg = mapimage.SvgStreamImage()
         proj = projection.Albers(45.5, 29.5, -96, 37.5)
         um = ConusCountriesLakes()
+        mimg.set_view_box(um.get_view_box(proj))
         um.set_map_color("brown")
         um.draw(proj, mimg)
 
@@ -433,6 +805,9 @@ class TravelMap():
 if __name__ == "__main__":
     #print("Running as __main__ with args:", sys.argv)
 
+    # --report shows what each layer draws.
+    if ("--report" in sys.argv[1:]):
+        AnyMap.REPORT_VERTICES = True
     tm = TravelMap()
     #tm.create_world()
     tm.create_usa()